@@ -0,0 +1,128 @@
+"""
+Admission control for video jobs: per-user quotas, global byte and disk limits
+"""
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional
+from config import (
+    ADMIN_ID, ADMIN_WEIGHT, USER_MAX_JOBS, USER_MAX_BYTES, MAX_INFLIGHT_BYTES
+)
+from job_queue import JobQueue, JOB_RUNNING
+from scratch import ScratchSpace, scratch_space
+from utils import format_file_size, format_duration
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Admission:
+    # False: the job must not be queued, `message` explains why
+    accepted: bool
+    # Queued, but held back until running jobs free bytes or disk space
+    deferred: bool = False
+    message: str = ""
+    # Estimated seconds until the job finishes (accepted) or a retry can succeed (rejected)
+    eta: Optional[float] = None
+
+
+class AdmissionController:
+    def __init__(self, queue: JobQueue, admin_id: int = ADMIN_ID, scratch: ScratchSpace = scratch_space):
+        """
+        Initialize admission controller
+
+        Args:
+            queue: Job queue the decisions are based on
+            admin_id: User exempt from quotas and served with ADMIN_WEIGHT
+            scratch: Scratch space the jobs download into
+        """
+        self.queue = queue
+        self.admin_id = admin_id
+        self.scratch = scratch
+
+    def weight(self, user_id: int) -> float:
+        """Share of the workers a user's jobs get in the fair order"""
+        return ADMIN_WEIGHT if user_id == self.admin_id else 1.0
+
+    def admit(self, user_id: int, size: int) -> Admission:
+        """
+        Decide whether a new job may be queued
+
+        Args:
+            user_id: Telegram user ID of the requester
+            size: Disk bytes the job needs while running
+
+        Returns:
+            Admission: Decision with the message and ETA for the user
+        """
+        average, workers = self.queue.throughput()
+
+        if user_id != self.admin_id:
+            load = self.queue.user_load(user_id)
+            if load["jobs"] >= USER_MAX_JOBS:
+                eta = self._user_slot_eta(load, average, workers)
+                return Admission(
+                    accepted=False,
+                    message=(
+                        f"⏳ У вас уже {load['jobs']} видео в обработке (максимум {USER_MAX_JOBS}).\n"
+                        f"Отправьте это видео снова через {format_duration(eta)}."
+                    ),
+                    eta=eta
+                )
+            if load["bytes"] + size > USER_MAX_BYTES:
+                if size > USER_MAX_BYTES:
+                    return Admission(
+                        accepted=False,
+                        message=f"❌ Видео больше допустимого объёма ({format_file_size(USER_MAX_BYTES)})."
+                    )
+                eta = self._user_slot_eta(load, average, workers)
+                return Admission(
+                    accepted=False,
+                    message=(
+                        f"⏳ В обработке уже {format_file_size(load['bytes'])} ваших видео "
+                        f"(максимум {format_file_size(USER_MAX_BYTES)}).\n"
+                        f"Отправьте это видео снова через {format_duration(eta)}."
+                    ),
+                    eta=eta
+                )
+
+        if not self.scratch.fits(size):
+            return Admission(accepted=False, message="❌ Видео слишком большое для обработки на этом сервере.")
+
+        deferred = size > self.scratch.available() or (
+            MAX_INFLIGHT_BYTES and self.queue.inflight_bytes() + size > MAX_INFLIGHT_BYTES
+        )
+        return Admission(accepted=True, deferred=bool(deferred))
+
+    def estimate(self, position: int) -> float:
+        """
+        Estimate seconds until a queued job finishes
+
+        Args:
+            position: 1-based position in the claim order
+        """
+        average, workers = self.queue.throughput()
+        return self._finish_eta(position, average, workers)
+
+    @staticmethod
+    def _finish_eta(position: int, average: float, workers: int) -> float:
+        # Jobs ahead are shared by the workers; the current ones are half done on average
+        return (max(position - 1, 0) / workers + 0.5) * average + average
+
+    def _user_slot_eta(self, load: dict, average: float, workers: int) -> float:
+        """Estimate when the user's oldest unfinished job completes"""
+        oldest = load["oldest"]
+        if oldest is None:
+            return 0.0
+        if oldest["status"] == JOB_RUNNING and oldest["started_at"]:
+            return max(average - (time.time() - oldest["started_at"]), 1.0)
+        position = self.queue.position(oldest["id"])
+        return self._finish_eta(position, average, workers) if position else average
+
+    @staticmethod
+    def describe(admission: Admission, position: int, eta: float) -> str:
+        """Status line for an accepted job"""
+        text = f"место: {max(position, 1)}, готово {format_duration(eta)}"
+        if admission.deferred:
+            text += "; ждёт освобождения места на сервере"
+        return text
@@ -1,35 +1,177 @@
 """
 AI processor module for video analysis
 """
+import asyncio
+import hashlib
+import json
 import logging
-from config import OPENAI_API_KEY, AI_MODEL
+import os
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+import httpx
+from config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, AI_MODEL, AI_TIMEOUT, AI_REQUEST_TIMEOUT, AI_REQUESTS_PER_MINUTE,
+    AI_TOKENS_PER_MINUTE, AI_MAX_TOKENS, AI_BATCH_SIZE, AI_BATCH_WINDOW,
+    AI_MAX_CONNECTIONS, AI_CACHE_TTL, AI_CACHE_MAX_ENTRIES
+)
+from metrics import AI_REQUESTS, AI_BATCH_ITEMS, AI_CACHE_LOOKUPS
+
+if TYPE_CHECKING:
+    # The SDK takes a third of the bot's import time; it's imported with the first client
+    from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 
+# Instructions per request kind; each batch holds prompts of one kind
+PROMPTS = {
+    "analyze": (
+        "You review videos sent to a Telegram bot. For each video in the JSON list, "
+        "write 2-3 sentences in Russian on what its parameters mean for the viewer: "
+        "quality, smoothness, whether it plays well in Telegram or should be compressed. "
+        "Frame summaries, if present, describe a few sampled frames."
+    ),
+    "describe": (
+        "You write captions for videos sent to a Telegram bot. For each video in the "
+        "JSON list, write a one-sentence description in Russian of what the video "
+        "probably shows, based on its parameters and frame summaries (t in seconds; "
+        "brightness, contrast and saturation from 0 to 1; dominant color)."
+    ),
+}
+RESPONSE_FORMAT = (
+    'Reply with a JSON object {"results": [...]} holding exactly one string per video, '
+    "in the same order as the input."
+)
+
+# Metadata fields sent to the model; everything else doesn't change the answer
+PROMPT_FIELDS = (
+    "duration", "resolution", "fps", "video_codec", "audio_codec", "file_name", "frames"
+)
+
+DEFAULT_COMMENT = "✅ Видео успешно обработано и готово к использованию!"
+DEFAULT_DESCRIPTION = "AI-сгенерированное описание видео"
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        """
+        Initialize a token bucket
+
+        Args:
+            per_minute: Tokens refilled per minute, also the burst size
+        """
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0):
+        """Wait until `amount` tokens are available and take them (FIFO)"""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def drain(self):
+        """Empty the bucket after the server reported a rate limit"""
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+
+
+class _Pending:
+    __slots__ = ("key", "item", "future")
+
+    def __init__(self, key: str, item: dict, future: asyncio.Future):
+        self.key = key
+        self.item = item
+        self.future = future
+
 
 class AIProcessor:
-    def __init__(self):
+    def __init__(
+        self,
+        api_key: str = OPENAI_API_KEY,
+        model: str = AI_MODEL,
+        base_url: Optional[str] = OPENAI_BASE_URL
+    ):
         """Initialize AI processor"""
-        self.api_key = OPENAI_API_KEY
-        self.model = AI_MODEL
-        logger.info("AI Processor initialized")
-    
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        self._client: Optional["AsyncOpenAI"] = None
+        # Buckets per model, shared by all batches of this process
+        self._limits: dict[str, tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._pending: dict[str, list[_Pending]] = {}
+        self._flush_timers: dict[str, asyncio.TimerHandle] = {}
+        self._batches: set[asyncio.Task] = set()
+        # Identical prompts in flight share one answer
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        logger.info("AI Processor initialized (%s)", 'model ' + model if api_key else 'templates only')
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the model is called at all"""
+        return bool(self.api_key)
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        """Shared API client with a pooled HTTP connection, created on first use"""
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                # Slow answers fall back to templates instead of being retried
+                max_retries=0,
+                timeout=AI_REQUEST_TIMEOUT,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=AI_MAX_CONNECTIONS,
+                        max_keepalive_connections=AI_MAX_CONNECTIONS
+                    ),
+                    timeout=AI_REQUEST_TIMEOUT
+                )
+            )
+        return self._client
+
+    async def warm_up(self):
+        """Import the SDK and create the client ahead of the first request"""
+        if self.enabled:
+            await asyncio.to_thread(lambda: self.client)
+
+    async def close(self):
+        """Close the HTTP connections of the client"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
     async def analyze_video(self, video_data: dict) -> str:
         """
         Analyze video data using AI
-        
+
         Args:
             video_data: Dictionary containing video metadata and analysis
-            
+
         Returns:
-            str: AI-generated analysis of the video
+            str: AI-generated analysis of the video, or the template text if
+                the model is disabled, failed or didn't answer in time
         """
         try:
             # Extract video information
             duration = video_data.get("duration", "Unknown")
             resolution = video_data.get("resolution", "Unknown")
             fps = video_data.get("fps", "Unknown")
-            
+
+            comment = await self._ask("analyze", video_data) or DEFAULT_COMMENT
+
             # Create analysis
             analysis = f"""
 🎥 Анализ видео:
@@ -38,29 +180,189 @@ class AIProcessor:
 📐 Разрешение: {resolution}
 🎞️ FPS: {fps}
 
-✅ Видео успешно обработано и готово к использованию!
+{comment}
 """
-            
+
             return analysis.strip()
-            
+
         except Exception as e:
-            logger.error(f"Error analyzing video: {e}")
+            logger.error("Error analyzing video: %s", e)
             return "❌ Ошибка при анализе видео"
-    
-    async def generate_description(self, video_path: str) -> str:
+
+    async def generate_description(self, video_path: str, video_data: Optional[dict] = None) -> str:
         """
         Generate a description for the video using AI
-        
+
         Args:
             video_path: Path to the video file
-            
+            video_data: Optional metadata of the video, with frame summaries
+                from VideoProcessor.summarize_frames under "frames"
+
         Returns:
             str: AI-generated description
         """
         try:
-            # Placeholder for AI description generation
-            description = "AI-сгенерированное описание видео"
-            return description
+            item = dict(video_data) if video_data else {"file_name": os.path.basename(video_path)}
+            return await self._ask("describe", item) or DEFAULT_DESCRIPTION
         except Exception as e:
-            logger.error(f"Error generating description: {e}")
+            logger.error("Error generating description: %s", e)
             return "Описание недоступно"
+
+    async def _ask(self, kind: str, video_data: dict) -> Optional[str]:
+        """
+        Get the model's answer for one video, batched with concurrent calls
+
+        Returns:
+            Optional[str]: Answer, None if there is none within AI_TIMEOUT
+        """
+        if not self.enabled:
+            return None
+
+        item = self._normalize(video_data)
+        key = self._cache_key(kind, item)
+        cached = self._cache_get(key)
+        if cached is not None:
+            AI_CACHE_LOOKUPS.inc(result="hit")
+            return cached
+        AI_CACHE_LOOKUPS.inc(result="miss")
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._submit(kind, key, item)
+        try:
+            # The batch keeps running after a timeout, its answer still fills the cache
+            return await asyncio.wait_for(asyncio.shield(future), AI_TIMEOUT)
+        except asyncio.TimeoutError:
+            AI_REQUESTS.inc(model=self.model, result="timeout")
+            logger.warning("AI %s request timed out after %ss, using the template", kind, AI_TIMEOUT)
+            return None
+
+    @staticmethod
+    def _normalize(video_data: dict) -> dict:
+        """Keep the prompt fields and round numbers, so equal videos share a cache key"""
+        item = {}
+        for field in PROMPT_FIELDS:
+            value = video_data.get(field)
+            if value in (None, "", "Unknown"):
+                continue
+            if field in ("duration", "fps"):
+                try:
+                    value = round(float(value), 1)
+                except (TypeError, ValueError):
+                    continue
+            item[field] = value
+        return item
+
+    def _cache_key(self, kind: str, item: dict) -> str:
+        data = json.dumps([self.model, PROMPTS[kind], item], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, text = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return text
+
+    def _cache_put(self, key: str, text: str):
+        self._cache[key] = (time.monotonic() + AI_CACHE_TTL, text)
+        self._cache.move_to_end(key)
+        while len(self._cache) > AI_CACHE_MAX_ENTRIES:
+            self._cache.popitem(last=False)
+
+    def _submit(self, kind: str, key: str, item: dict) -> asyncio.Future:
+        """Queue a prompt for the next batch of its kind"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[key] = future
+        pending = self._pending.setdefault(kind, [])
+        pending.append(_Pending(key, item, future))
+
+        if len(pending) >= AI_BATCH_SIZE:
+            self._flush(kind)
+        elif kind not in self._flush_timers:
+            # Wait briefly for concurrent calls to join the batch
+            self._flush_timers[kind] = loop.call_later(AI_BATCH_WINDOW, self._flush, kind)
+        return future
+
+    def _flush(self, kind: str):
+        timer = self._flush_timers.pop(kind, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(kind, [])
+        if batch:
+            task = asyncio.create_task(self._send_batch(kind, batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    def _get_limits(self, model: str) -> tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        if model not in self._limits:
+            self._limits[model] = (
+                TokenBucket(AI_REQUESTS_PER_MINUTE) if AI_REQUESTS_PER_MINUTE > 0 else None,
+                TokenBucket(AI_TOKENS_PER_MINUTE) if AI_TOKENS_PER_MINUTE > 0 else None,
+            )
+        return self._limits[model]
+
+    async def _send_batch(self, kind: str, batch: list[_Pending]):
+        """Send one request for the whole batch and resolve its futures"""
+        from openai import OpenAIError, RateLimitError
+        results: list[Optional[str]] = [None] * len(batch)
+        try:
+            content = json.dumps({"videos": [pending.item for pending in batch]}, ensure_ascii=False)
+            max_tokens = AI_MAX_TOKENS * len(batch)
+            requests_bucket, tokens_bucket = self._get_limits(self.model)
+            if requests_bucket:
+                await requests_bucket.acquire()
+            if tokens_bucket:
+                # ~4 characters per token for the prompt, plus the longest possible answer
+                await tokens_bucket.acquire((len(PROMPTS[kind]) + len(content)) / 4 + max_tokens)
+
+            AI_BATCH_ITEMS.observe(len(batch))
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": f"{PROMPTS[kind]} {RESPONSE_FORMAT}"},
+                    {"role": "user", "content": content},
+                ],
+                max_tokens=max_tokens,
+                temperature=0.3
+            )
+            answers = self._parse_results(response.choices[0].message.content or "")
+            if len(answers) != len(batch):
+                raise ValueError(f"expected {len(batch)} results, got {len(answers)}")
+            results = [(answer.strip() or None) if isinstance(answer, str) else None for answer in answers]
+            AI_REQUESTS.inc(model=self.model, result="ok")
+        except RateLimitError as e:
+            requests_bucket, _ = self._get_limits(self.model)
+            if requests_bucket:
+                requests_bucket.drain()
+            AI_REQUESTS.inc(model=self.model, result="rate_limited")
+            logger.warning("AI rate limit hit for %s: %s", self.model, e)
+        except (OpenAIError, ValueError) as e:
+            AI_REQUESTS.inc(model=self.model, result="error")
+            logger.warning("AI %s batch of %s failed: %s", kind, len(batch), e)
+        except Exception as e:
+            AI_REQUESTS.inc(model=self.model, result="error")
+            logger.error("Unexpected AI error: %s", e, exc_info=True)
+        finally:
+            for pending, text in zip(batch, results):
+                if text:
+                    self._cache_put(pending.key, text)
+                self._inflight.pop(pending.key, None)
+                if not pending.future.done():
+                    pending.future.set_result(text)
+
+    @staticmethod
+    def _parse_results(content: str) -> list:
+        """Extract the results list, tolerating text around the JSON object"""
+        start, end = content.find("{"), content.rfind("}")
+        if start < 0 or end < start:
+            raise ValueError("no JSON object in the answer")
+        results = json.loads(content[start:end + 1]).get("results")
+        if not isinstance(results, list):
+            raise ValueError("no results list in the answer")
+        return results
@@ -0,0 +1,126 @@
+"""
+Local stand-in for the Telegram Bot API used by the benchmarks
+
+Serves getFile and /file/bot<token>/<path> (with HTTP Range support) for the
+files in a directory; the file_id of a file is its name.
+
+Usage:
+    python benchmarks/fake_telegram.py --dir bench_data --port 8081
+"""
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+from pathlib import Path
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def generate_file(path: Path, size: int):
+    """Create a file of `size` bytes filled with a repeated random block"""
+    if path.exists() and path.stat().st_size == size:
+        return
+    block = os.urandom(min(BLOCK_SIZE, size))
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def generate_video(path: Path, duration: int, size: str = "1280x720", fps: int = 30):
+    """
+    Create a synthetic H.264/AAC video with ffmpeg's testsrc
+
+    Args:
+        path: Output path
+        duration: Length in seconds
+        size: Frame size, e.g. "1280x720"
+        fps: Frame rate
+    """
+    if path.exists():
+        return
+    subprocess.run(
+        [
+            "ffmpeg", "-v", "error", "-y",
+            "-f", "lavfi", "-i", f"testsrc=duration={duration}:size={size}:rate={fps}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-shortest", str(path)
+        ],
+        check=True
+    )
+
+
+def create_app(data_dir: Path, token: str) -> web.Application:
+    """Create the fake Bot API application"""
+    data_dir = data_dir.resolve()
+
+    async def get_file(request: web.Request) -> web.Response:
+        file_id = request.query.get("file_id", "")
+        path = (data_dir / file_id).resolve()
+        if path.parent != data_dir or not path.is_file():
+            return web.json_response(
+                {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"},
+                status=400
+            )
+        return web.json_response({
+            "ok": True,
+            "result": {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": path.stat().st_size,
+                "file_path": file_id
+            }
+        })
+
+    app = web.Application()
+    app.router.add_get(f"/bot{token}/getFile", get_file)
+    # FileResponse behind add_static handles Range requests
+    app.router.add_static(f"/file/bot{token}/", data_dir)
+    return app
+
+
+async def start_server(data_dir: Path, token: str, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+    """
+    Start the fake Bot API server in the running event loop
+
+    Returns:
+        tuple: (runner, base URL)
+    """
+    runner = web.AppRunner(create_app(data_dir, token), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+async def serve(data_dir: Path, token: str, host: str, port: int):
+    runner, url = await start_server(data_dir, token, host, port)
+    logger.info("Fake Bot API serving %s on %s", data_dir, url)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API file server")
+    parser.add_argument("--dir", type=Path, default=Path("bench_data"))
+    parser.add_argument("--token", default="bench")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    args.dir.mkdir(parents=True, exist_ok=True)
+    asyncio.run(serve(args.dir, args.token, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
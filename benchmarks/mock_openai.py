@@ -0,0 +1,125 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions API
+
+Answers POST /v1/chat/completions requests of AIProcessor with one canned
+result per video, after a configurable latency. With --rpm it returns 429
+like the real API once the per-minute request limit is exceeded.
+GET /stats reports the requests and videos received.
+
+Usage:
+    python benchmarks/mock_openai.py --port 8082 --latency 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8082/v1 OPENAI_API_KEY=mock python bot.py
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+def create_app(latency: float = 0.0, rpm: int = 0) -> web.Application:
+    """
+    Create the mock API application
+
+    Args:
+        latency: Seconds to wait before answering
+        rpm: Requests allowed per minute, 0 for no limit
+    """
+    stats = {"requests": 0, "videos": 0, "rate_limited": 0}
+    recent: deque[float] = deque()
+
+    async def chat_completions(request: web.Request) -> web.Response:
+        now = time.monotonic()
+        while recent and recent[0] < now - 60:
+            recent.popleft()
+        if rpm and len(recent) >= rpm:
+            stats["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"retry-after": str(int(60 - (now - recent[0])) + 1)}
+            )
+        recent.append(now)
+
+        body = await request.json()
+        try:
+            videos = json.loads(body["messages"][-1]["content"])["videos"]
+        except (KeyError, ValueError, TypeError):
+            return web.json_response({"error": {"message": "Unexpected prompt", "type": "invalid_request_error"}},
+                                     status=400)
+        stats["requests"] += 1
+        stats["videos"] += len(videos)
+        if latency:
+            await asyncio.sleep(latency)
+
+        results = [
+            f"Тестовый ответ: {video.get('resolution', '?')}, {video.get('duration', '?')} сек"
+            for video in videos
+        ]
+        content = json.dumps({"results": results}, ensure_ascii=False)
+        return web.json_response({
+            "id": f"chatcmpl-mock{stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        })
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+async def start_server(latency: float = 0.0, rpm: int = 0, host: str = "127.0.0.1",
+                       port: int = 0) -> tuple[web.AppRunner, str]:
+    """
+    Start the mock API server in the running event loop
+
+    Returns:
+        tuple: (runner, base URL ending in /v1)
+    """
+    runner = web.AppRunner(create_app(latency, rpm), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}/v1"
+
+
+async def serve(latency: float, rpm: int, host: str, port: int):
+    runner, url = await start_server(latency, rpm, host, port)
+    logger.info("Mock OpenAI API on %s", url)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per answer")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429, 0 = unlimited")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.latency, args.rpm, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+POST recorded Telegram updates to a webhook receiver
+
+The file holds one update per line (JSON lines) or a JSON list of updates,
+e.g. as returned by getUpdates. Update IDs are shifted with --offset so the
+same file can be replayed more than once past the receiver's deduplication.
+
+Usage:
+    BOT_MODE=webhook WEBHOOK_SET_ON_START=false python bot.py
+    python benchmarks/replay_updates.py updates.jsonl --url http://127.0.0.1:8080/telegram
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def load_updates(path: Path) -> list[dict]:
+    """Read updates from a JSON list or JSON lines file"""
+    text = path.read_text()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+async def replay(updates: list[dict], url: str, secret_token: str, concurrency: int, offset: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses: dict[int, int] = {}
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def post(update: dict):
+            update = dict(update, update_id=update["update_id"] + offset)
+            async with semaphore:
+                response = await client.post(
+                    url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret_token}
+                )
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+    print(f"Posted {len(updates)} updates in {elapsed:.2f}s, responses: {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded updates against a webhook receiver")
+    parser.add_argument("file", type=Path, help="JSON list or JSON lines of updates")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram")
+    parser.add_argument("--secret-token", help="defaults to the bot's WEBHOOK_SECRET_TOKEN")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--offset", type=int, default=0, help="added to every update_id")
+    args = parser.parse_args()
+
+    secret_token = args.secret_token
+    if secret_token is None:
+        os.environ.setdefault("BOT_TOKEN", "")
+        from config import WEBHOOK_SECRET_TOKEN
+        secret_token = WEBHOOK_SECRET_TOKEN
+
+    asyncio.run(replay(load_updates(args.file), args.url, secret_token, args.concurrency, args.offset))
+
+
+if __name__ == "__main__":
+    main()
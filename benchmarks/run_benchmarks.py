@@ -0,0 +1,370 @@
+"""
+Benchmark suite for the download/probe/compress/database pipeline stages
+
+Runs against a local fake Bot API server, a mock OpenAI-compatible server and
+synthetic ffmpeg testsrc videos, so no bot token, API key or network access is needed.
+
+Usage:
+    python benchmarks/run_benchmarks.py --stages download,probe,compress,db,ai \\
+        --sizes 1M,100M --concurrency 4 --output bench_results/run.json
+    python benchmarks/run_benchmarks.py --compare bench_results/old.json bench_results/new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+TOKEN = "bench"
+
+# Repository modules read their configuration at import time
+os.environ.setdefault("BOT_TOKEN", TOKEN)
+os.environ.setdefault("METRICS_PORT", "0")
+
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(value: str) -> int:
+    """Parse sizes like 1M, 500M, 2G"""
+    value = value.strip().upper()
+    if value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def run_stage(name: str, operations: list, concurrency: int, bytes_per_op: int = 0) -> dict:
+    """
+    Run coroutine factories with bounded concurrency and collect statistics
+
+    Args:
+        name: Stage name
+        operations: Zero-argument callables returning awaitables
+        concurrency: Operations running at the same time
+        bytes_per_op: Bytes handled by each operation, for throughput
+
+    Returns:
+        dict: Latency percentiles, throughput, peak RSS and CPU time
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    peak_rss = current_rss()
+    sampling = True
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while sampling:
+            peak_rss = max(peak_rss, current_rss())
+            await asyncio.sleep(0.05)
+
+    async def run_one(operation):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await operation()
+            except Exception as e:
+                errors += 1
+                print(f"  {name}: error: {e}", file=sys.stderr)
+            latencies.append(time.perf_counter() - started)
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(operation) for operation in operations))
+    wall = time.perf_counter() - started
+    sampling = False
+    await sampler
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu_self = (self_after.ru_utime - self_before.ru_utime) + (self_after.ru_stime - self_before.ru_stime)
+    cpu_children = (
+        (children_after.ru_utime - children_before.ru_utime)
+        + (children_after.ru_stime - children_before.ru_stime)
+    )
+    result = {
+        "operations": len(operations),
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_seconds": wall,
+        "ops_per_second": len(operations) / wall if wall else 0.0,
+        "p50_seconds": percentile(latencies, 0.50),
+        "p99_seconds": percentile(latencies, 0.99),
+        "max_seconds": max(latencies, default=0.0),
+        "peak_rss_mb": peak_rss / 1024 ** 2,
+        "children_max_rss_mb": children_after.ru_maxrss / 1024,
+        "cpu_seconds_self": cpu_self,
+        "cpu_seconds_children": cpu_children,
+    }
+    if bytes_per_op:
+        result["bytes_per_op"] = bytes_per_op
+        result["throughput_mb_per_second"] = bytes_per_op * len(operations) / wall / 1024 ** 2 if wall else 0.0
+    print(
+        f"  {name}: {result['ops_per_second']:.2f} ops/s, "
+        f"p50 {result['p50_seconds'] * 1000:.1f} ms, p99 {result['p99_seconds'] * 1000:.1f} ms, "
+        f"peak RSS {result['peak_rss_mb']:.0f} MB, CPU {cpu_self:.2f}s + {cpu_children:.2f}s children"
+        + (f", {result['throughput_mb_per_second']:.1f} MB/s" if bytes_per_op else "")
+    )
+    return result
+
+
+async def bench_download(data_dir: Path, work_dir: Path, sizes: list[int], iterations: int, concurrency: int) -> dict:
+    from fake_telegram import generate_file, start_server
+    from download_manager import DownloadManager
+
+    results = {}
+    runner, url = await start_server(data_dir, TOKEN)
+    manager = DownloadManager(bot_token=TOKEN, api_url=url)
+    try:
+        for size in sizes:
+            name = f"blob_{size}.bin"
+            await asyncio.to_thread(generate_file, data_dir / name, size)
+
+            def make_operation(i):
+                async def operation():
+                    output = work_dir / f"download_{size}_{i}.bin"
+                    try:
+                        await manager.download(name, size, str(output))
+                    finally:
+                        output.unlink(missing_ok=True)
+                return operation
+
+            results[str(size)] = await run_stage(
+                f"download {size / 1024 ** 2:.0f} MB",
+                [make_operation(i) for i in range(iterations)],
+                concurrency,
+                bytes_per_op=size
+            )
+    finally:
+        await manager.close()
+        await runner.cleanup()
+    return results
+
+
+async def bench_media(data_dir: Path, work_dir: Path, durations: list[int], iterations: int,
+                      concurrency: int, compress: bool) -> dict:
+    from fake_telegram import generate_video
+    from media_executor import MediaExecutor
+    from video_processor import VideoProcessor
+
+    processor = VideoProcessor(MediaExecutor(concurrency))
+    results = {}
+    for duration in durations:
+        video = data_dir / f"testsrc_{duration}s.mp4"
+        await asyncio.to_thread(generate_video, video, duration)
+        size = video.stat().st_size
+
+        async def probe():
+            metadata = await processor.get_video_metadata(str(video))
+            if metadata["duration"] == "Unknown":
+                raise RuntimeError("ffprobe failed")
+
+        results[f"probe_{duration}s"] = await run_stage(
+            f"probe {duration}s", [probe] * iterations, concurrency, bytes_per_op=size
+        )
+
+        if compress:
+            def make_operation(i):
+                async def operation():
+                    output = work_dir / f"compress_{duration}_{i}.mp4"
+                    try:
+                        if not await processor.compress_video(str(video), str(output)):
+                            raise RuntimeError("ffmpeg failed")
+                    finally:
+                        output.unlink(missing_ok=True)
+                return operation
+
+            results[f"compress_{duration}s"] = await run_stage(
+                f"compress {duration}s",
+                [make_operation(i) for i in range(iterations)],
+                concurrency,
+                bytes_per_op=size
+            )
+    return results
+
+
+async def bench_database(iterations: int, concurrency: int) -> dict:
+    from database import Database
+
+    db = Database()
+    user_ids = range(iterations)
+
+    def writer(user_id):
+        async def operation():
+            await db.add_user(user_id, f"user{user_id}")
+            await db.log_video_processing(user_id, 1024 * 1024, 1500)
+        return operation
+
+    async def read_stats():
+        await db.get_stats()
+
+    # Writes only queue statements; the flush stage times the transaction that commits them
+    results = {
+        "write": await run_stage("db write", [writer(i) for i in user_ids], concurrency),
+        "flush": await run_stage("db flush", [db.flush], 1),
+        "stats": await run_stage("db stats", [read_stats] * max(1, iterations // 10), concurrency),
+    }
+    await db.close()
+    return results
+
+
+async def bench_ai(iterations: int, concurrency: int, latency: float) -> dict:
+    from mock_openai import start_server
+    from ai_processor import AIProcessor
+
+    runner, url = await start_server(latency)
+    processor = AIProcessor(api_key="mock", base_url=url)
+
+    def analyze(i):
+        async def operation():
+            # Distinct metadata, so every call misses the response cache
+            await processor.analyze_video({"duration": f"{i}.0", "resolution": "1280x720", "fps": "30.0"})
+        return operation
+
+    try:
+        results = {
+            "analyze": await run_stage("ai analyze", [analyze(i) for i in range(iterations)], concurrency),
+            "cached": await run_stage("ai cached", [analyze(i) for i in range(iterations)], concurrency),
+        }
+        stats = runner.app["stats"]
+        results["analyze"]["api_requests"] = stats["requests"]
+        print(f"  ai: {stats['videos']} videos in {stats['requests']} API requests")
+    finally:
+        await processor.close()
+        await runner.cleanup()
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old_path: Path, new_path: Path):
+    """Print the relative change of latency and throughput between two runs"""
+    old = json.loads(old_path.read_text())["results"]
+    new = json.loads(new_path.read_text())["results"]
+    print(f"{'stage':<32} {'p50':>10} {'p99':>10} {'ops/s':>10}")
+    for stage, cases in new.items():
+        for case, result in cases.items():
+            before = old.get(stage, {}).get(case)
+            if before is None:
+                continue
+
+            def change(key):
+                if not before[key]:
+                    return "n/a"
+                return f"{(result[key] - before[key]) / before[key] * 100:+.1f}%"
+
+            print(
+                f"{stage + ' ' + case:<32} {change('p50_seconds'):>10} "
+                f"{change('p99_seconds'):>10} {change('ops_per_second'):>10}"
+            )
+
+
+async def run(args) -> dict:
+    data_dir = args.data_dir
+    data_dir.mkdir(parents=True, exist_ok=True)
+    stages = set(args.stages.split(","))
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        work_dir = Path(tmp)
+        if "download" in stages:
+            print("Download:")
+            sizes = [parse_size(size) for size in args.sizes.split(",")]
+            results["download"] = await bench_download(
+                data_dir, work_dir, sizes, args.iterations, args.concurrency
+            )
+        if "probe" in stages or "compress" in stages:
+            print("Media:")
+            durations = [int(d) for d in args.durations.split(",")]
+            results["media"] = await bench_media(
+                data_dir, work_dir, durations, args.iterations, args.concurrency, "compress" in stages
+            )
+        if "db" in stages:
+            print("Database:")
+            results["database"] = await bench_database(args.db_operations, args.concurrency)
+        if "ai" in stages:
+            print("AI:")
+            results["ai"] = await bench_ai(args.iterations, args.concurrency, args.ai_latency)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline benchmarks with local stand-ins")
+    parser.add_argument("--stages", default="download,probe,compress,db,ai",
+                        help="comma-separated: download, probe, compress, db, ai")
+    parser.add_argument("--sizes", default="1M,64M", help="download file sizes, e.g. 1M,500M,2G")
+    parser.add_argument("--durations", default="10,60", help="synthetic video durations in seconds")
+    parser.add_argument("--iterations", type=int, default=8, help="operations per case")
+    parser.add_argument("--db-operations", type=int, default=5000, help="database writes")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--ai-latency", type=float, default=0.2, help="mock AI answer latency in seconds")
+    parser.add_argument("--data-dir", type=Path, default=ROOT / "bench_data",
+                        help="generated input files, reused between runs")
+    parser.add_argument("--output", type=Path, help="write JSON results to this file")
+    parser.add_argument("--compare", type=Path, nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="bench_db_") as db_dir:
+        # The database stage must not touch the bot's real database
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_dir}/bench.db"
+        results = asyncio.run(run(args))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": git_revision(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "arguments": {key: str(value) for key, value in vars(args).items()},
+        "results": results,
+    }
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,32 +2,88 @@
 Telegram Bot for Video Processing with AI
 Main bot file
 """
-import os
+import asyncio
+import io
+import json
 import logging
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from config import BOT_TOKEN, ADMIN_ID
+import shutil
+from functools import partial
+from typing import Optional
+from startup import Lazy, initialize, requires, startup_profile
+from telegram import Bot, Message, MessageEntity, Update
+from telegram.ext import (
+    Application, BaseHandler, CallbackQueryHandler, CommandHandler, InlineQueryHandler,
+    MessageHandler, filters, ContextTypes
+)
+from config import (
+    BOT_TOKEN, ADMIN_ID, EMBEDDED_WORKERS, METRICS_HOST, METRICS_PORT,
+    TELEGRAM_MAX_FILE_SIZE, TELEGRAM_UPLOAD_LIMIT, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH,
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET_TOKEN, WEBHOOK_SET_ON_START, YTDLP_PATH, URL_MAX_BYTES,
+    DATABASE_URL
+)
 from database import Database
 from ai_processor import AIProcessor
 from video_processor import VideoProcessor
-from utils import setup_logging, download_large_file, format_file_size
+from job_queue import JobQueue
+from admission import AdmissionController
+from pipeline import VideoPipeline, format_album_report
+from result_cache import ResultCache
+from media_registry import MediaRegistry, variant_key
+from media_groups import MediaGroupCollector, MediaGroupStore
+from scratch import scratch_space
+from worker import start_workers
+from download_manager import download_manager
+from metrics import registry, JOB_QUEUE_DEPTH, start_metrics_server
+from transcoder import PROFILES, DEFAULT_PROFILE
+from webhook import serve_webhook
+from health import HealthMonitor, binary_check, queue_check, sqlite_check
+from url_ingest import IngestError, check_url, extract_url, url_key
+from utils import setup_logging, format_file_size
+
+startup_profile.mark("imports")
 
 # Setup logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
-# Initialize components
-db = Database()
+# Update types each handler class consumes
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: [Update.MESSAGE],
+    MessageHandler: [Update.MESSAGE],
+    CallbackQueryHandler: [Update.CALLBACK_QUERY],
+    InlineQueryHandler: [Update.INLINE_QUERY],
+}
+
+# Initialize components; the ones touching the database are created in a thread by
+# the background warm-up (or the first update that needs them), not at import and
+# never on the event loop: handlers using them are decorated with @requires
+db = Lazy("database", Database)
 ai_processor = AIProcessor()
 video_processor = VideoProcessor()
+job_queue = Lazy("job queue", JobQueue)
+admission = AdmissionController(job_queue)
+result_cache = Lazy("result cache", ResultCache)
+media_registry = Lazy("media registry", MediaRegistry)
+media_group_store = Lazy("media group store", MediaGroupStore)
+LAZY_COMPONENTS = (db, job_queue, result_cache, media_registry, media_group_store)
+pipeline = VideoPipeline(db, ai_processor, video_processor, result_cache, media_registry)
+JOB_QUEUE_DEPTH.set_function(lambda: {(k,): v for k, v in job_queue.depth().items()})
 
+# Served on the webhook and metrics ports for the orchestrator
+health = HealthMonitor()
+health.add_check("ffmpeg", binary_check(("ffmpeg", "ffprobe")))
+health.add_check("database", sqlite_check(DATABASE_URL.replace("sqlite:///", "")))
+health.add_check("queue", queue_check(lambda: job_queue.depth()))
+startup_profile.mark("components")
 
+
+@requires(*LAZY_COMPONENTS)
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     user_id = update.effective_user.id
     username = update.effective_user.username or "Unknown"
     
-    db.add_user(user_id, username)
+    await db.add_user(user_id, username)
     
     await update.message.reply_text(
         "👋 Привет! Я бот для обработки видео с AI.\n\n"
@@ -35,9 +91,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@requires(*LAZY_COMPONENTS)
 async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle video messages"""
-    video_path = None
     try:
         user_id = update.effective_user.id
         video = update.message.video
@@ -47,9 +103,7 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Get video file info
-        file_id = video.file_id
         file_size = video.file_size
-        file_name = video.file_name or f"video_{file_id}.mp4"
         
         # Check file size limit (2 GB)
         max_size_bytes = 2 * 1024 * 1024 * 1024  # 2 GB
@@ -61,62 +115,294 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # Send processing message with file info
+        # Videos of an album are processed together once the whole album arrived
+        if update.message.media_group_id:
+            await context.bot_data["album_collector"].add(
+                f"{update.effective_chat.id}:{update.message.media_group_id}",
+                update.message.message_id,
+                update.message.to_dict()
+            )
+            return
+        
+        # Answer repeated videos from the cache without downloading them
+        cached = await asyncio.to_thread(result_cache.get, video.file_unique_id, "analyze")
+        if cached is not None:
+            await update.message.reply_text(f"✅ Видео обработано!\n\n{cached['analysis']}")
+            await db.log_video_processing(user_id)
+            return
+        
+        # Reject right away instead of letting the job wait for a quota
+        decision = await asyncio.to_thread(admission.admit, user_id, file_size)
+        if not decision.accepted:
+            await update.message.reply_text(decision.message)
+            return
+        
+        # Enqueue the job; workers download and process it
+        job_id = await asyncio.to_thread(
+            job_queue.enqueue,
+            user_id,
+            update.effective_chat.id,
+            "analyze",
+            {
+                "file_id": video.file_id,
+                "file_unique_id": video.file_unique_id,
+                "file_size": file_size,
+                "file_name": video.file_name or f"video_{video.file_id}.mp4",
+            },
+            size=file_size,
+            weight=admission.weight(user_id)
+        )
+        
+        # Send status message with file info; workers edit it with progress
         file_size_str = format_file_size(file_size)
+        position = await asyncio.to_thread(job_queue.position, job_id)
+        eta = await asyncio.to_thread(admission.estimate, position)
         processing_msg = await update.message.reply_text(
-            f"⏳ Загружаю видео...\n"
+            f"⏳ Видео поставлено в очередь ({admission.describe(decision, position, eta)})\n"
             f"📦 Размер: {file_size_str}"
         )
+        await asyncio.to_thread(job_queue.set_status_message, job_id, processing_msg.message_id)
         
-        # Download video using new method for large files
-        video_path = f"temp_{user_id}_{file_id}.mp4"
-        
-        # Try to download the video
-        success, error_msg = await download_large_file(file_id, file_size, video_path)
+    except Exception as e:
+        logger.error("Ошибка обработки видео: %s", e, exc_info=True)
+        try:
+            await update.message.reply_text(
+                "❌ Произошла ошибка при обработке видео.\n"
+                "Пожалуйста, попробуйте ещё раз позже."
+            )
+        except:
+            pass
+
+
+async def handle_album(bot: Bot, items: list[dict]):
+    """Queue the videos of an album as one job with a single status message"""
+    messages = [Message.de_json(item, bot) for item in items]
+    first = messages[0]
+    user_id = first.from_user.id
+    try:
+        videos = [
+            {
+                "file_id": message.video.file_id,
+                "file_unique_id": message.video.file_unique_id,
+                "file_size": message.video.file_size,
+                "file_name": message.video.file_name,
+            }
+            for message in messages
+        ]
+        found = await asyncio.to_thread(
+            result_cache.get_many, [video["file_unique_id"] for video in videos], "analyze"
+        )
+        cached = [found.get(video["file_unique_id"]) for video in videos]
+        if all(entry is not None for entry in cached):
+            for text in format_album_report([
+                (video["file_name"], entry["analysis"]) for video, entry in zip(videos, cached)
+            ]):
+                await first.reply_text(text)
+            await db.log_video_processing(user_id)
+            return
         
-        if not success:
-            await processing_msg.edit_text(error_msg)
+        # Cached videos aren't downloaded again
+        size = sum(video["file_size"] for video, entry in zip(videos, cached) if entry is None)
+        decision = await asyncio.to_thread(admission.admit, user_id, size)
+        if not decision.accepted:
+            await first.reply_text(decision.message)
             return
         
-        # Update status
-        await processing_msg.edit_text(
-            f"✅ Видео загружено!\n"
-            f"⏳ Обрабатываю видео..."
+        job_id = await asyncio.to_thread(
+            job_queue.enqueue,
+            user_id,
+            first.chat_id,
+            "analyze_album",
+            {"videos": videos, "file_size": size},
+            size=size,
+            weight=admission.weight(user_id)
         )
+        position = await asyncio.to_thread(job_queue.position, job_id)
+        eta = await asyncio.to_thread(admission.estimate, position)
+        processing_msg = await first.reply_text(
+            f"⏳ Альбом из {len(videos)} видео поставлен в очередь "
+            f"({admission.describe(decision, position, eta)})\n"
+            f"📦 Размер: {format_file_size(size)}"
+        )
+        await asyncio.to_thread(job_queue.set_status_message, job_id, processing_msg.message_id)
         
-        # Process video
-        result = await video_processor.process_video(video_path)
+    except Exception as e:
+        logger.error("Ошибка постановки альбома в очередь: %s", e, exc_info=True)
+        await first.reply_text(
+            "❌ Произошла ошибка при обработке видео.\n"
+            "Пожалуйста, попробуйте ещё раз позже."
+        )
+
+
+
+def get_message_url(message: Optional[Message]) -> Optional[str]:
+    """First link of a message, including links hidden behind text"""
+    if message is None:
+        return None
+    for entity in message.entities or message.caption_entities or ():
+        if entity.type == MessageEntity.TEXT_LINK:
+            return entity.url
+    return extract_url(message.text or message.caption)
+
+
+@requires(*LAZY_COMPONENTS)
+async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle messages with a link to a video"""
+    try:
+        user_id = update.effective_user.id
+        url = get_message_url(update.message)
+        if not url:
+            return
+        file_unique_id = url_key(url)
         
-        # Get AI analysis
-        analysis = await ai_processor.analyze_video(result)
+        # Links to internal hosts are refused before anything fetches them
+        try:
+            await check_url(url)
+        except IngestError as e:
+            await update.message.reply_text(str(e))
+            return
         
-        # Send result
-        await processing_msg.edit_text(
-            f"✅ Видео обработано!\n\n{analysis}"
-        )
+        cached = await asyncio.to_thread(result_cache.get, file_unique_id, "analyze")
+        if cached is not None:
+            await update.message.reply_text(f"✅ Видео обработано!\n\n{cached['analysis']}")
+            await db.log_video_processing(user_id)
+            return
+        
+        # The size is only known after the download; admit the largest one allowed
+        decision = await asyncio.to_thread(admission.admit, user_id, URL_MAX_BYTES)
+        if not decision.accepted:
+            await update.message.reply_text(decision.message)
+            return
         
-        # Log to database
-        db.log_video_processing(user_id)
+        job_id = await asyncio.to_thread(
+            job_queue.enqueue,
+            user_id,
+            update.effective_chat.id,
+            "analyze",
+            {
+                "url": url,
+                "file_unique_id": file_unique_id,
+                "file_size": 0,
+                "file_name": url,
+            },
+            size=URL_MAX_BYTES,
+            weight=admission.weight(user_id)
+        )
+        position = await asyncio.to_thread(job_queue.position, job_id)
+        eta = await asyncio.to_thread(admission.estimate, position)
+        processing_msg = await update.message.reply_text(
+            f"⏳ Видео по ссылке поставлено в очередь ({admission.describe(decision, position, eta)})"
+        )
+        await asyncio.to_thread(job_queue.set_status_message, job_id, processing_msg.message_id)
         
     except Exception as e:
-        logger.error(f"Ошибка обработки видео: {e}", exc_info=True)
-        try:
+        logger.error("Ошибка постановки ссылки в очередь: %s", e, exc_info=True)
+        await update.message.reply_text(
+            "❌ Произошла ошибка при обработке видео.\n"
+            "Пожалуйста, попробуйте ещё раз позже."
+        )
+
+
+@requires(*LAZY_COMPONENTS)
+async def compress(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /compress [profile] [size in MB] sent as a reply to a video"""
+    try:
+        user_id = update.effective_user.id
+        reply = update.message.reply_to_message
+        video = reply.video if reply else None
+        # A link in the replied message is downloaded by the worker
+        url = get_message_url(reply) if reply and not video else None
+        args = list(context.args or [])
+        profile = args.pop(0) if args and args[0] in PROFILES else DEFAULT_PROFILE
+        
+        # An explicit size switches to two-pass encoding aimed at that size
+        target_size = TELEGRAM_UPLOAD_LIMIT
+        exact_size = False
+        if args:
+            try:
+                target_size = min(int(float(args[0].replace(",", ".")) * 1024 * 1024), TELEGRAM_UPLOAD_LIMIT)
+                exact_size = target_size > 0
+            except ValueError:
+                target_size = 0
+        
+        if not (video or url) or len(args) > 1 or target_size <= 0:
+            profiles = "\n".join(
+                f"• {name} — {p.description}" for name, p in PROFILES.items()
+            )
             await update.message.reply_text(
-                "❌ Произошла ошибка при обработке видео.\n"
-                "Пожалуйста, попробуйте ещё раз позже."
+                "ℹ️ Ответьте командой /compress [профиль] [размер в МБ] на сообщение с видео "
+                "или ссылкой на видео.\n"
+                f"Размер — не больше {format_file_size(TELEGRAM_UPLOAD_LIMIT)}, "
+                "например: /compress small 20\n\n"
+                f"Профили:\n{profiles}"
             )
-        except:
-            pass
-    finally:
-        # Clean up: remove temporary file
-        if video_path and os.path.exists(video_path):
+            return
+        
+        if video and video.file_size > TELEGRAM_MAX_FILE_SIZE:
+            await update.message.reply_text("❌ Файл слишком большой. Максимальный размер: 2 ГБ")
+            return
+        
+        if url:
             try:
-                os.remove(video_path)
-                logger.info(f"Temporary file removed: {video_path}")
-            except Exception as e:
-                logger.error(f"Failed to remove temporary file: {e}")
+                await check_url(url)
+            except IngestError as e:
+                await update.message.reply_text(str(e))
+                return
+        
+        if video:
+            source = {
+                "file_id": video.file_id,
+                "file_unique_id": video.file_unique_id,
+                "file_size": video.file_size,
+            }
+        else:
+            # The size of a linked video is only known after the download
+            source = {"url": url, "file_unique_id": url_key(url), "file_size": 0}
+        
+        # The same result sent before is forwarded by file_id without any work
+        variant = variant_key(profile, target_size if exact_size else None)
+        if await pipeline.send_registered(context.bot, update.effective_chat.id, source["file_unique_id"], variant):
+            await db.log_video_processing(user_id)
+            return
+        
+        # The source and the compressed copy are on disk at the same time
+        job_size = (video.file_size if video else URL_MAX_BYTES) + target_size
+        decision = await asyncio.to_thread(admission.admit, user_id, job_size)
+        if not decision.accepted:
+            await update.message.reply_text(decision.message)
+            return
+        
+        job_id = await asyncio.to_thread(
+            job_queue.enqueue,
+            user_id,
+            update.effective_chat.id,
+            "compress",
+            {
+                **source,
+                "profile": profile,
+                "target_size": target_size,
+                "exact_size": exact_size,
+            },
+            size=job_size,
+            weight=admission.weight(user_id)
+        )
+        position = await asyncio.to_thread(job_queue.position, job_id)
+        eta = await asyncio.to_thread(admission.estimate, position)
+        processing_msg = await update.message.reply_text(
+            f"⏳ Сжатие ({profile}, до {format_file_size(target_size)}) поставлено в очередь "
+            f"({admission.describe(decision, position, eta)})"
+        )
+        await asyncio.to_thread(job_queue.set_status_message, job_id, processing_msg.message_id)
+        
+    except Exception as e:
+        logger.error("Ошибка постановки сжатия в очередь: %s", e, exc_info=True)
+        await update.message.reply_text(
+            "❌ Произошла ошибка при обработке видео.\n"
+            "Пожалуйста, попробуйте ещё раз позже."
+        )
 
 
+@requires(*LAZY_COMPONENTS)
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /stats command (admin only)"""
     user_id = update.effective_user.id
@@ -125,29 +411,179 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⛔ У вас нет доступа к этой команде.")
         return
     
-    stats_data = db.get_stats()
+    stats_data = await db.get_stats()
+    cache_stats = await asyncio.to_thread(result_cache.get_stats)
+    media_stats = await asyncio.to_thread(media_registry.get_stats)
+    
+    def format_ms(value):
+        return f"{value / 1000:.1f} сек" if value is not None else "—"
+    
+    per_day = "\n".join(
+        f"  {day}: {videos}" for day, videos in stats_data["videos_per_day"]
+    ) or "  —"
+    top_users = "\n".join(
+        f"  {username or user_id}: {videos}"
+        for user_id, username, videos in stats_data["top_users"]
+    ) or "  —"
+    transcodes = "\n".join(
+        f"  {method}: {jobs} шт., {passes:.1f} прох., {cpu:.0f} сек CPU"
+        for method, jobs, passes, cpu in stats_data["transcodes"]
+    ) or "  —"
     await update.message.reply_text(
         f"📊 Статистика бота:\n\n"
         f"👥 Всего пользователей: {stats_data['total_users']}\n"
-        f"🎬 Обработано видео: {stats_data['total_videos']}"
+        f"🎬 Обработано видео: {stats_data['total_videos']}\n"
+        f"💾 Обработано данных: {format_file_size(stats_data['total_bytes'])}\n"
+        f"⏱ Время обработки p50/p95: "
+        f"{format_ms(stats_data['p50_ms'])} / {format_ms(stats_data['p95_ms'])}\n\n"
+        f"📅 Видео по дням:\n{per_day}\n\n"
+        f"🏆 Топ пользователей:\n{top_users}\n\n"
+        f"🎞 Сжатие (в среднем на видео):\n{transcodes}\n\n"
+        f"🗄 Кэш результатов: {cache_stats['entries']} записей\n"
+        f"🎯 Попадания/промахи: {cache_stats['hits']}/{cache_stats['misses']} "
+        f"({cache_stats['hit_rate']:.0%})\n\n"
+        f"📤 Повторные отправки по file_id: {media_stats['hits']}/{media_stats['misses']} "
+        f"({media_stats['hit_rate']:.0%}), не выгружено {format_file_size(media_stats['bytes_saved'])}"
     )
 
 
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /metrics command (admin only): send a JSON dump of the metrics"""
+    user_id = update.effective_user.id
+    
+    if user_id != ADMIN_ID:
+        await update.message.reply_text("⛔ У вас нет доступа к этой команде.")
+        return
+    
+    data = await asyncio.to_thread(registry.to_dict)
+    dump = json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    await update.message.reply_document(
+        document=io.BytesIO(dump),
+        filename="metrics.json",
+        caption="📈 Метрики процесса бота"
+    )
+
+
+async def warm_up(application: Application):
+    """
+    Create components, check dependencies and start embedded queue workers in
+    the background, while the bot already receives updates
+    """
+    try:
+        with startup_profile.phase("warm-up"):
+            await asyncio.gather(
+                *(
+                    asyncio.to_thread(initialize, component)
+                    for component in LAZY_COMPONENTS
+                ),
+                # Files of jobs this host was running when a process died
+                asyncio.to_thread(scratch_space.sweep),
+                ai_processor.warm_up(),
+                video_processor.warm_up()
+            )
+        if EMBEDDED_WORKERS > 0:
+            application.bot_data["workers"] = start_workers(
+                application.bot, pipeline, job_queue, EMBEDDED_WORKERS
+            )
+        health.set_warm()
+        startup_profile.log()
+    except Exception as e:
+        # The instance stays unready, so the orchestrator doesn't route traffic to it
+        logger.error("Warm-up failed: %s", e, exc_info=True)
+
+
+async def post_init(application: Application):
+    """Start the metrics server and the background warm-up once the bot is initialized"""
+    if METRICS_PORT:
+        application.bot_data["metrics_server"] = await start_metrics_server(
+            METRICS_HOST, METRICS_PORT, health
+        )
+    # Album items are collected in the database shared with other replicas
+    application.bot_data["album_collector"] = MediaGroupCollector(
+        partial(handle_album, application.bot), media_group_store
+    )
+    application.bot_data["warm_up"] = asyncio.create_task(warm_up(application))
+    startup_profile.mark("accepting updates")
+
+
+async def post_stop(application: Application):
+    """Stop embedded queue workers (unfinished jobs go back to the queue) and close connections"""
+    warm_up_task = application.bot_data.get("warm_up")
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+    # Albums still being collected are queued rather than lost
+    album_collector = application.bot_data.get("album_collector")
+    if album_collector is not None:
+        await album_collector.close()
+    workers = application.bot_data.get("workers", [])
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await download_manager.close()
+    await ai_processor.close()
+    if db.initialized:
+        await db.close()
+    metrics_server = application.bot_data.get("metrics_server")
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+
+
+def get_allowed_updates(application: Application) -> list[str]:
+    """
+    Update types the registered handlers need, so Telegram doesn't send the rest
+    (edited messages, for instance, would re-trigger video processing)
+    """
+    allowed = []
+    handlers: list[BaseHandler] = [h for group in application.handlers.values() for h in group]
+    for handler in handlers:
+        types = HANDLER_UPDATE_TYPES.get(type(handler))
+        if types is None:
+            logger.warning("Unknown update types of %s, subscribing to all", type(handler).__name__)
+            return Update.ALL_TYPES
+        allowed.extend(t for t in types if t not in allowed)
+    return allowed
+
+
 def main():
     """Start the bot"""
     logger.info("Starting bot...")
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = Application.builder().token(BOT_TOKEN).post_init(post_init).post_stop(post_stop)
+    if BOT_MODE == "webhook":
+        # Updates come from our own HTTP server, not from getUpdates
+        builder = builder.updater(None)
+    application = builder.build()
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("compress", compress))
+    application.add_handler(CommandHandler("metrics", metrics_command))
     application.add_handler(MessageHandler(filters.VIDEO, handle_video))
+    if shutil.which(YTDLP_PATH):
+        application.add_handler(MessageHandler(
+            filters.TEXT & ~filters.COMMAND
+            & (filters.Entity(MessageEntity.URL) | filters.Entity(MessageEntity.TEXT_LINK)),
+            handle_url
+        ))
+    else:
+        logger.warning("%s not found, links to videos are ignored", YTDLP_PATH)
     
     # Start bot
-    logger.info("Bot is running!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    allowed_updates = get_allowed_updates(application)
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL and WEBHOOK_SET_ON_START:
+            raise SystemExit("WEBHOOK_URL is required in webhook mode")
+        logger.info("Bot is running (webhook)!")
+        asyncio.run(serve_webhook(
+            application, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT,
+            WEBHOOK_SECRET_TOKEN, allowed_updates, set_webhook=WEBHOOK_SET_ON_START, health=health
+        ))
+    else:
+        logger.info("Bot is running!")
+        application.run_polling(allowed_updates=allowed_updates)
 
 
 if __name__ == "__main__":
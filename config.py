@@ -1,6 +1,7 @@
 """
 Configuration file for the bot
 """
+import hashlib
 import os
 from dotenv import load_dotenv
 
@@ -9,24 +10,166 @@ load_dotenv()
 
 # Bot configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Bot API server; point to a local telegram-bot-api server to lift download limits
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 
+# Update delivery: "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Public base URL Telegram posts updates to, e.g. https://<app>.up.railway.app
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080")))  # Railway provides PORT
+# Derived from the bot token by default, so all replicas share it without extra setup
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN") or hashlib.sha256(
+    f"webhook:{BOT_TOKEN}".encode()
+).hexdigest()
+# Disable on replicas that shouldn't re-register the webhook on start
+WEBHOOK_SET_ON_START = os.getenv("WEBHOOK_SET_ON_START", "true").lower() in ("1", "true", "yes")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
 # AI configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 AI_MODEL = os.getenv("AI_MODEL", "gpt-3.5-turbo")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # any OpenAI-compatible server
+
+# AI client: reply fallback timeout, per-model rate limits (0 = unlimited),
+# micro-batching of concurrent requests and the response cache
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "10"))
+AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT", "60"))  # late answers still fill the cache
+AI_REQUESTS_PER_MINUTE = int(os.getenv("AI_REQUESTS_PER_MINUTE", "60"))
+AI_TOKENS_PER_MINUTE = int(os.getenv("AI_TOKENS_PER_MINUTE", "60000"))
+AI_MAX_TOKENS = int(os.getenv("AI_MAX_TOKENS", "200"))  # per video in a batch
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "8"))
+AI_BATCH_WINDOW = float(os.getenv("AI_BATCH_WINDOW", "0.05"))  # seconds
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "20"))
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", str(24 * 3600)))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "1000"))
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///bot.db")
 
+# Database write batching: queued writes are committed together
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "500"))  # flush immediately at this many writes
+DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", "0.05"))  # seconds
+
 # Video processing configuration
 # Telegram supports up to 2 GB file uploads
 MAX_VIDEO_SIZE_MB = int(os.getenv("MAX_VIDEO_SIZE_MB", "2048"))  # 2 GB default
 MAX_VIDEO_SIZE_BYTES = MAX_VIDEO_SIZE_MB * 1024 * 1024
 VIDEO_FORMATS = [".mp4", ".avi", ".mov", ".mkv", ".webm", ".flv"]
 
+# Maximum number of ffmpeg/ffprobe jobs running in parallel (defaults to CPU cores)
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", str(os.cpu_count() or 1)))
+FFPROBE_TIMEOUT = int(os.getenv("FFPROBE_TIMEOUT", "30"))  # seconds
+FFMPEG_TIMEOUT = int(os.getenv("FFMPEG_TIMEOUT", "300"))  # seconds, minimum for long encodes
+
+# Frame sampling for the AI description: keyframes decoded per video, frames
+# handed to the model, thumbnail width and the hash distance of near-duplicates
+FRAME_CANDIDATES = int(os.getenv("FRAME_CANDIDATES", "24"))
+FRAME_BUDGET = int(os.getenv("FRAME_BUDGET", "6"))
+FRAME_THUMB_WIDTH = int(os.getenv("FRAME_THUMB_WIDTH", "160"))
+FRAME_HASH_DISTANCE = int(os.getenv("FRAME_HASH_DISTANCE", "10"))  # of 64 bits
+TRANSCODE_THREADS = int(os.getenv("TRANSCODE_THREADS", "0"))  # 0 = chosen by ffmpeg
+# Two-pass target-size encoding: accepted undershoot and extra second passes on overshoot
+TARGET_SIZE_TOLERANCE = float(os.getenv("TARGET_SIZE_TOLERANCE", "0.05"))
+TARGET_SIZE_RETRIES = int(os.getenv("TARGET_SIZE_RETRIES", "1"))
+# Segmented encoding: videos at least this long (seconds, 0 = off) are split into
+# keyframe-aligned chunks of up to SEGMENT_DURATION seconds encoded in parallel
+SEGMENT_MIN_DURATION = float(os.getenv("SEGMENT_MIN_DURATION", "120"))
+SEGMENT_DURATION = float(os.getenv("SEGMENT_DURATION", "30"))
+SEGMENT_THREADS = int(os.getenv("SEGMENT_THREADS", "1"))  # encoder threads per chunk
+
+# Job queue configuration
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))  # lease renewed by worker heartbeats
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = int(os.getenv("JOB_RETRY_DELAY", "10"))  # seconds, doubled on every retry
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))  # seconds
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))  # processes started by worker.py
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", str(MEDIA_WORKERS)))  # jobs per process
+# Worker loops run inside the bot process; set to 0 when separate workers are deployed
+EMBEDDED_WORKERS = int(os.getenv("EMBEDDED_WORKERS", str(WORKER_CONCURRENCY)))
+
+# Admission control: per-user limits on unfinished jobs and their bytes, global
+# limit on bytes of running jobs (0 = unlimited), disk space kept free, and the
+# admin's share of the workers relative to a regular user
+USER_MAX_JOBS = int(os.getenv("USER_MAX_JOBS", "3"))
+USER_MAX_BYTES = int(os.getenv("USER_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+MAX_INFLIGHT_BYTES = int(os.getenv("MAX_INFLIGHT_BYTES", str(8 * 1024 * 1024 * 1024)))
+MIN_FREE_DISK = int(os.getenv("MIN_FREE_DISK", str(2 * 1024 * 1024 * 1024)))
+ADMIN_WEIGHT = float(os.getenv("ADMIN_WEIGHT", "4"))
+JOB_MAX_DEFER = int(os.getenv("JOB_MAX_DEFER", "300"))  # seconds smaller jobs may overtake a large one
+
+# Scratch space for downloads and transcodes: one directory per job under SCRATCH_DIR,
+# capped at SCRATCH_MAX_BYTES in total (0 = only MIN_FREE_DISK applies). Jobs up to
+# SCRATCH_TMPFS_MAX_JOB_SIZE go to SCRATCH_TMPFS_DIR (e.g. /dev/shm, empty = disabled)
+# while it has room under SCRATCH_TMPFS_MAX_BYTES
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", "scratch")
+SCRATCH_MAX_BYTES = int(os.getenv("SCRATCH_MAX_BYTES", "0"))
+SCRATCH_TMPFS_DIR = os.getenv("SCRATCH_TMPFS_DIR", "")
+SCRATCH_TMPFS_MAX_JOB_SIZE = int(os.getenv("SCRATCH_TMPFS_MAX_JOB_SIZE", str(128 * 1024 * 1024)))
+SCRATCH_TMPFS_MAX_BYTES = int(os.getenv("SCRATCH_TMPFS_MAX_BYTES", str(512 * 1024 * 1024)))
+SCRATCH_RETRY_DELAY = int(os.getenv("SCRATCH_RETRY_DELAY", "30"))  # seconds before a job waiting for space is retried
+
+# Status message progress: at most one edit per message every this many seconds
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "3"))
+
+# Albums: videos of one media group arriving within MEDIA_GROUP_WINDOW seconds of each
+# other are processed as one job, downloading up to ALBUM_PARALLEL_DOWNLOADS at a time
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.0"))
+ALBUM_PARALLEL_DOWNLOADS = int(os.getenv("ALBUM_PARALLEL_DOWNLOADS", "3"))
+
+# Result cache configuration
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+# Telegram file_ids of sent results, reused instead of uploading the same output again
+MEDIA_REGISTRY_MAX_ENTRIES = int(os.getenv("MEDIA_REGISTRY_MAX_ENTRIES", "10000"))
+
 # Telegram file download limits
 TELEGRAM_SMALL_FILE_LIMIT = 20 * 1024 * 1024  # 20 MB - limit for bot.get_file()
 TELEGRAM_MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2 GB - Telegram's max file size
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024  # 50 MB - max file a bot can send
+TELEGRAM_MESSAGE_LIMIT = 4096  # characters of a text message
+
+# Download manager configuration
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))  # 1 MB buffers
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "32"))  # pooled connections
+DOWNLOAD_PARALLEL_PARTS = int(os.getenv("DOWNLOAD_PARALLEL_PARTS", "4"))  # ranges per large file
+DOWNLOAD_PARALLEL_MIN_SIZE = int(os.getenv("DOWNLOAD_PARALLEL_MIN_SIZE", str(64 * 1024 * 1024)))
+DOWNLOAD_MAX_RETRIES = int(os.getenv("DOWNLOAD_MAX_RETRIES", "5"))  # resumes per range
+
+# Links: videos are fetched with yt-dlp in the smallest format the operation needs,
+# with concurrent fragment downloads, up to URL_MAX_BYTES and URL_MAX_DURATION seconds
+YTDLP_PATH = os.getenv("YTDLP_PATH", "yt-dlp")
+YTDLP_CONCURRENT_FRAGMENTS = int(os.getenv("YTDLP_CONCURRENT_FRAGMENTS", "4"))
+YTDLP_TIMEOUT = int(os.getenv("YTDLP_TIMEOUT", "1800"))  # seconds per download
+URL_MAX_BYTES = int(os.getenv("URL_MAX_BYTES", str(1024 * 1024 * 1024)))
+URL_MAX_DURATION = int(os.getenv("URL_MAX_DURATION", "3600"))
+URL_ANALYZE_MIN_HEIGHT = int(os.getenv("URL_ANALYZE_MIN_HEIGHT", "240"))  # enough for frame thumbnails
+# Extractors yt-dlp may use (--use-extractors syntax, empty = all). The generic extractor
+# fetches any page it is given, so it is off and links only reach sites with an extractor
+YTDLP_EXTRACTORS = os.getenv("YTDLP_EXTRACTORS", "default,-generic")
+
+# Streaming probe: metadata of large files is read from partial downloads
+STREAM_PROBE_MIN_SIZE = int(os.getenv("STREAM_PROBE_MIN_SIZE", str(32 * 1024 * 1024)))
+# Head and tail windows must cover at least 1 MB each, the content hash samples them
+STREAM_PROBE_HEAD_BYTES = max(int(os.getenv("STREAM_PROBE_HEAD_BYTES", str(2 * 1024 * 1024))), 1024 * 1024)
+STREAM_PROBE_TAIL_BYTES = max(int(os.getenv("STREAM_PROBE_TAIL_BYTES", str(4 * 1024 * 1024))), 1024 * 1024)
+STREAM_PROBE_MAX_BYTES = int(os.getenv("STREAM_PROBE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Metrics HTTP endpoint (/metrics, /metrics.json); port 0 disables it.
+# Local only by default; set 0.0.0.0 to scrape it from another host or where the
+# platform polls /healthz and /readyz
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+# Worker processes started by worker.py listen on WORKER_METRICS_PORT + process index
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
 
-# Logging configuration
+# Logging configuration: records are written by a background thread from a queue of
+# LOG_QUEUE_SIZE records (dropped when full) as "text" or "json" lines; stage spans
+# (download, probe, analyze, reply) are logged for LOG_SPAN_SAMPLE_RATE of the jobs
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SPAN_SAMPLE_RATE = float(os.getenv("LOG_SPAN_SAMPLE_RATE", "0.1"))
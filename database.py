@@ -1,94 +1,465 @@
 """
 Database module for storing user data and statistics
 """
+import asyncio
+import os
 import sqlite3
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from config import DATABASE_URL
+from itertools import groupby
+from typing import Optional
+from config import DATABASE_URL, DB_BATCH_SIZE, DB_FLUSH_INTERVAL
+from metrics import DB_CALL_DURATION
 
 logger = logging.getLogger(__name__)
 
+ADD_USER_SQL = "INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)"
+LOG_VIDEO_SQL = "INSERT INTO video_logs (user_id, file_size, processing_ms) VALUES (?, ?, ?)"
+LOG_TRANSCODE_SQL = """
+    INSERT INTO transcode_stats (
+        job_id, user_id, profile, method, passes, cpu_seconds,
+        input_size, output_size, target_size, elapsed_ms
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Upper bounds (ms) of the processing time histogram used for percentiles
+PROCESSING_TIME_BUCKETS = [
+    100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 15000, 20000,
+    30000, 45000, 60000, 90000, 120000, 180000, 300000, 600000, 1200000, 3600000
+]
+
+
+def connect(db_path: str, **kwargs) -> sqlite3.Connection:
+    """
+    Open a SQLite connection tuned for concurrent access
+
+    WAL lets readers run alongside the writer, and synchronous=NORMAL
+    avoids an fsync per commit (WAL stays consistent after a crash).
+    """
+    conn = sqlite3.connect(db_path, timeout=30, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+class ThreadLocalConnection:
+    def __init__(self, db_path: str, row_factory=None):
+        """
+        One reused connection per thread, for components called through asyncio.to_thread
+
+        sqlite3 connections can't be shared between threads, so each thread of the
+        pool gets its own, opened on first use and kept (with its statement cache)
+        for the life of the thread. A forked process opens new ones.
+
+        Args:
+            db_path: SQLite database path
+            row_factory: Row factory set on every connection
+        """
+        self.db_path = db_path
+        self.row_factory = row_factory
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        """Get the connection of the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect(self.db_path, cached_statements=256)
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
 
 class Database:
     def __init__(self):
         """Initialize database connection"""
         self.db_path = DATABASE_URL.replace("sqlite:///", "")
+        # All statements run on one thread that owns the persistent connection
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: list[tuple[str, tuple]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
         self.init_db()
-    
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # sqlite3 keeps compiled statements in a per-connection cache,
+            # so the constant queries below are prepared only once
+            self._conn = connect(self.db_path, cached_statements=256)
+        return self._conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        with DB_CALL_DURATION.time(operation=func.__name__.lstrip("_")):
+            return await loop.run_in_executor(self._executor, func, *args)
+
     def init_db(self):
         """Create database tables if they don't exist"""
+        self._executor.submit(self._init_db).result()
+
+    def _init_db(self):
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Users table
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        user_id INTEGER PRIMARY KEY,
-                        username TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Video processing log table
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS video_logs (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users(user_id)
-                    )
-                """)
-                
-                conn.commit()
-                logger.info("Database initialized successfully")
-        except Exception as e:
-            logger.error(f"Error initializing database: {e}")
-    
-    def add_user(self, user_id: int, username: str):
-        """Add a new user to the database"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)",
-                    (user_id, username)
+            conn = self._connection()
+            cursor = conn.cursor()
+
+            # Users table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
-                conn.commit()
-        except Exception as e:
-            logger.error(f"Error adding user: {e}")
-    
-    def log_video_processing(self, user_id: int):
-        """Log a video processing event"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO video_logs (user_id) VALUES (?)",
-                    (user_id,)
+            """)
+
+            # Video processing log table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS video_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(user_id)
                 )
-                conn.commit()
+            """)
+
+            # Columns added after the first release
+            columns = {row[1] for row in cursor.execute("PRAGMA table_info(video_logs)")}
+            if "file_size" not in columns:
+                cursor.execute("ALTER TABLE video_logs ADD COLUMN file_size INTEGER NOT NULL DEFAULT 0")
+            if "processing_ms" not in columns:
+                cursor.execute("ALTER TABLE video_logs ADD COLUMN processing_ms INTEGER")
+
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_video_logs_user ON video_logs (user_id)")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_video_logs_processed_at ON video_logs (processed_at)"
+            )
+
+            # Per-job transcoding cost, to compare methods and profiles
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS transcode_stats (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER,
+                    user_id INTEGER,
+                    profile TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    passes INTEGER NOT NULL,
+                    cpu_seconds REAL NOT NULL,
+                    input_size INTEGER NOT NULL,
+                    output_size INTEGER NOT NULL,
+                    target_size INTEGER,
+                    elapsed_ms INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            self._init_rollups(cursor)
+
+            conn.commit()
+            logger.info("Database initialized successfully")
         except Exception as e:
-            logger.error(f"Error logging video processing: {e}")
-    
-    def get_stats(self):
+            logger.error("Error initializing database: %s", e)
+
+    def _init_rollups(self, cursor: sqlite3.Cursor):
+        """
+        Create statistics rollups maintained by triggers on every insert,
+        so /stats reads a few rows instead of scanning the logs
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                day TEXT PRIMARY KEY,
+                videos INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                processing_ms INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id INTEGER PRIMARY KEY,
+                videos INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                processing_ms INTEGER NOT NULL DEFAULT 0,
+                last_processed_at TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_videos ON user_stats (videos)")
+        # Databases created before the transcoding rollup are filled from the history below
+        new_transcode_rollup = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transcode_method_stats'"
+        ).fetchone() is None
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS transcode_method_stats (
+                method TEXT PRIMARY KEY,
+                jobs INTEGER NOT NULL DEFAULT 0,
+                passes INTEGER NOT NULL DEFAULT 0,
+                cpu_seconds REAL NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS processing_time_histogram (
+                upper_ms INTEGER PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_users_insert AFTER INSERT ON users
+            BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE name = 'total_users';
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_video_logs_insert AFTER INSERT ON video_logs
+            BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE name = 'total_videos';
+                UPDATE stats_counters SET value = value + NEW.file_size WHERE name = 'total_bytes';
+                INSERT INTO daily_stats (day, videos, bytes, processing_ms)
+                VALUES (date(NEW.processed_at), 1, NEW.file_size, COALESCE(NEW.processing_ms, 0))
+                ON CONFLICT (day) DO UPDATE SET
+                    videos = videos + 1,
+                    bytes = bytes + excluded.bytes,
+                    processing_ms = processing_ms + excluded.processing_ms;
+                INSERT INTO user_stats (user_id, videos, bytes, processing_ms, last_processed_at)
+                VALUES (NEW.user_id, 1, NEW.file_size, COALESCE(NEW.processing_ms, 0), NEW.processed_at)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    videos = videos + 1,
+                    bytes = bytes + excluded.bytes,
+                    processing_ms = processing_ms + excluded.processing_ms,
+                    last_processed_at = excluded.last_processed_at;
+                UPDATE processing_time_histogram SET count = count + 1
+                WHERE NEW.processing_ms IS NOT NULL
+                  AND upper_ms = (
+                      SELECT MIN(upper_ms) FROM processing_time_histogram
+                      WHERE upper_ms >= NEW.processing_ms
+                  );
+            END
+        """)
+
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_transcode_stats_insert AFTER INSERT ON transcode_stats
+            BEGIN
+                INSERT INTO transcode_method_stats (method, jobs, passes, cpu_seconds)
+                VALUES (NEW.method, 1, NEW.passes, NEW.cpu_seconds)
+                ON CONFLICT (method) DO UPDATE SET
+                    jobs = jobs + 1,
+                    passes = passes + excluded.passes,
+                    cpu_seconds = cpu_seconds + excluded.cpu_seconds;
+            END
+        """)
+
+        cursor.executemany(
+            "INSERT OR IGNORE INTO processing_time_histogram (upper_ms) VALUES (?)",
+            # The last bucket catches everything slower than the largest bound
+            [(bound,) for bound in PROCESSING_TIME_BUCKETS + [2 ** 62]]
+        )
+
+        # First run on an existing database: build the rollups from the history once
+        if cursor.execute("SELECT COUNT(*) FROM stats_counters").fetchone()[0] == 0:
+            cursor.execute("""
+                INSERT INTO stats_counters (name, value)
+                SELECT 'total_users', COUNT(*) FROM users
+                UNION ALL SELECT 'total_videos', COUNT(*) FROM video_logs
+                UNION ALL SELECT 'total_bytes', COALESCE(SUM(file_size), 0) FROM video_logs
+            """)
+            cursor.execute("""
+                INSERT OR REPLACE INTO daily_stats (day, videos, bytes, processing_ms)
+                SELECT date(processed_at), COUNT(*), SUM(file_size), COALESCE(SUM(processing_ms), 0)
+                FROM video_logs GROUP BY date(processed_at)
+            """)
+            cursor.execute("""
+                INSERT OR REPLACE INTO user_stats (user_id, videos, bytes, processing_ms, last_processed_at)
+                SELECT user_id, COUNT(*), SUM(file_size), COALESCE(SUM(processing_ms), 0), MAX(processed_at)
+                FROM video_logs GROUP BY user_id
+            """)
+            cursor.execute("""
+                UPDATE processing_time_histogram SET count = (
+                    SELECT COUNT(*) FROM video_logs v
+                    WHERE v.processing_ms IS NOT NULL
+                      AND processing_time_histogram.upper_ms = (
+                          SELECT MIN(upper_ms) FROM processing_time_histogram h
+                          WHERE h.upper_ms >= v.processing_ms
+                      )
+                )
+            """)
+
+        if new_transcode_rollup:
+            cursor.execute("""
+                INSERT INTO transcode_method_stats (method, jobs, passes, cpu_seconds)
+                SELECT method, COUNT(*), SUM(passes), SUM(cpu_seconds)
+                FROM transcode_stats GROUP BY method
+            """)
+
+    async def add_user(self, user_id: int, username: str):
+        """Add a new user to the database (written by the background writer)"""
+        self._enqueue(ADD_USER_SQL, (user_id, username))
+
+    async def log_video_processing(
+        self, user_id: int, file_size: int = 0, processing_ms: Optional[int] = None
+    ):
+        """
+        Log a video processing event (written by the background writer)
+        
+        Args:
+            user_id: Telegram user ID
+            file_size: Bytes of video processed
+            processing_ms: Processing time, None if nothing was processed (e.g. cache hit)
+        """
+        self._enqueue(LOG_VIDEO_SQL, (user_id, file_size, processing_ms))
+
+    async def log_transcode(
+        self,
+        job_id: int,
+        user_id: int,
+        result: dict,
+        input_size: int,
+        target_size: Optional[int] = None
+    ):
+        """
+        Log the cost of a transcoding job (written by the background writer)
+
+        Args:
+            job_id: Queue job ID
+            user_id: Telegram user ID
+            result: Result of Transcoder.transcode
+            input_size: Bytes of the source video
+            target_size: Requested maximum output size, None for no limit
+        """
+        self._enqueue(LOG_TRANSCODE_SQL, (
+            job_id, user_id, result["profile"], result["method"], result["passes"],
+            result["cpu_seconds"], input_size, result["output_size"], target_size,
+            int(result["elapsed"] * 1000)
+        ))
+
+    async def get_stats(self):
         """Get bot statistics"""
+        # Make pending writes visible to the query
+        await self.flush()
+        return await self._run(self._get_stats)
+
+    def _get_stats(self, days: int = 7, top: int = 5):
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Get total users
-                cursor.execute("SELECT COUNT(*) FROM users")
-                total_users = cursor.fetchone()[0]
-                
-                # Get total processed videos
-                cursor.execute("SELECT COUNT(*) FROM video_logs")
-                total_videos = cursor.fetchone()[0]
-                
-                return {
-                    "total_users": total_users,
-                    "total_videos": total_videos
-                }
+            cursor = self._connection().cursor()
+
+            counters = dict(cursor.execute("SELECT name, value FROM stats_counters").fetchall())
+
+            # Latest days and top users are read through primary key / index order
+            videos_per_day = cursor.execute(
+                "SELECT day, videos FROM daily_stats ORDER BY day DESC LIMIT ?", (days,)
+            ).fetchall()
+            top_users = cursor.execute(
+                """
+                SELECT s.user_id, u.username, s.videos
+                FROM user_stats s LEFT JOIN users u ON u.user_id = s.user_id
+                ORDER BY s.videos DESC LIMIT ?
+                """,
+                (top,)
+            ).fetchall()
+            histogram = cursor.execute(
+                "SELECT upper_ms, count FROM processing_time_histogram ORDER BY upper_ms"
+            ).fetchall()
+            transcodes = cursor.execute(
+                """
+                SELECT method, jobs, CAST(passes AS REAL) / jobs, cpu_seconds / jobs
+                FROM transcode_method_stats WHERE jobs > 0 ORDER BY jobs DESC
+                """
+            ).fetchall()
+
+            return {
+                "total_users": counters.get("total_users", 0),
+                "total_videos": counters.get("total_videos", 0),
+                "total_bytes": counters.get("total_bytes", 0),
+                "videos_per_day": videos_per_day,
+                "top_users": top_users,
+                "p50_ms": self._percentile(histogram, 0.50),
+                "p95_ms": self._percentile(histogram, 0.95),
+                "transcodes": transcodes
+            }
         except Exception as e:
-            logger.error(f"Error getting stats: {e}")
-            return {"total_users": 0, "total_videos": 0}
+            logger.error("Error getting stats: %s", e)
+            return {
+                "total_users": 0, "total_videos": 0, "total_bytes": 0,
+                "videos_per_day": [], "top_users": [], "p50_ms": None, "p95_ms": None,
+                "transcodes": []
+            }
+
+    @staticmethod
+    def _percentile(histogram: list[tuple[int, int]], q: float) -> Optional[int]:
+        """Upper bound of the histogram bucket containing the q-th quantile"""
+        total = sum(count for _, count in histogram)
+        if total == 0:
+            return None
+        seen = 0
+        for upper_ms, count in histogram:
+            seen += count
+            if seen >= q * total:
+                return min(upper_ms, PROCESSING_TIME_BUCKETS[-1])
+        return PROCESSING_TIME_BUCKETS[-1]
+
+    def _enqueue(self, sql: str, params: tuple):
+        """Queue a write for the background writer"""
+        self._pending.append((sql, params))
+        if self._writer is None or self._writer.done():
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.create_task(self._writer_loop())
+        self._wakeup.set()
+
+    async def _writer_loop(self):
+        """Coalesce queued writes into one transaction per flush interval"""
+        while True:
+            await self._wakeup.wait()
+            if len(self._pending) < DB_BATCH_SIZE:
+                await asyncio.sleep(DB_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write all queued statements in a single transaction and wait until earlier batches are written"""
+        batch, self._pending = self._pending, []
+        # The writer thread runs work in order, so this also waits for a batch the writer loop took
+        await self._run(self._write_batch, batch)
+
+    def _write_batch(self, batch: list[tuple[str, tuple]]):
+        if not batch:
+            return
+        conn = self._connection()
+        try:
+            with conn:
+                # Consecutive statements of the same kind go through one executemany
+                for sql, items in groupby(batch, key=lambda item: item[0]):
+                    conn.executemany(sql, [params for _, params in items])
+            logger.debug("Wrote %s queued statements", len(batch))
+            return
+        except Exception as e:
+            logger.warning("Batch of %s statements failed, writing them one by one: %s", len(batch), e)
+
+        # The batch was rolled back; keep every write that succeeds on its own
+        for sql, params in batch:
+            try:
+                with conn:
+                    conn.execute(sql, params)
+            except Exception as e:
+                logger.error("Error writing %s with %s: %s", " ".join(sql.split())[:60], params, e)
+
+    async def close(self):
+        """Flush queued writes and close the connection"""
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        await self.flush()
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
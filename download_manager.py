@@ -0,0 +1,279 @@
+"""
+Download manager for Telegram files with a shared connection pool,
+resumable and parallel ranged fetches
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+import httpx
+from config import (
+    BOT_TOKEN, TELEGRAM_API_URL, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_MAX_CONNECTIONS,
+    DOWNLOAD_PARALLEL_PARTS, DOWNLOAD_PARALLEL_MIN_SIZE, DOWNLOAD_MAX_RETRIES,
+    STREAM_PROBE_HEAD_BYTES, STREAM_PROBE_TAIL_BYTES, STREAM_PROBE_MAX_BYTES
+)
+from metrics import DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    """Download failure; the message is shown to the user"""
+
+
+class DownloadManager:
+    def __init__(
+        self,
+        bot_token: str = BOT_TOKEN,
+        api_url: str = TELEGRAM_API_URL,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        parallel_parts: int = DOWNLOAD_PARALLEL_PARTS,
+        parallel_min_size: int = DOWNLOAD_PARALLEL_MIN_SIZE,
+        max_retries: int = DOWNLOAD_MAX_RETRIES
+    ):
+        """
+        Initialize download manager
+
+        Args:
+            bot_token: Telegram bot token
+            api_url: Bot API server URL
+            chunk_size: Read/write buffer size in bytes
+            parallel_parts: Number of ranges fetched concurrently for large files
+            parallel_min_size: Files smaller than this are fetched with one connection
+            max_retries: Resume attempts per range after a connection failure
+        """
+        self.bot_token = bot_token
+        self.api_url = api_url.rstrip("/")
+        self.chunk_size = chunk_size
+        self.parallel_parts = max(1, parallel_parts)
+        self.parallel_min_size = parallel_min_size
+        self.max_retries = max_retries
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared HTTP client, created on first use in the running event loop"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(30.0, read=60.0),
+                limits=httpx.Limits(
+                    max_connections=DOWNLOAD_MAX_CONNECTIONS,
+                    max_keepalive_connections=DOWNLOAD_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+
+    async def close(self):
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_file_url(self, file_id: str) -> str:
+        """
+        Resolve a file_id to a direct download URL via getFile
+
+        Raises:
+            DownloadError: If Telegram doesn't return the file path
+        """
+        response = await self.client.get(
+            f"{self.api_url}/bot{self.bot_token}/getFile", params={"file_id": file_id}
+        )
+        if response.status_code != 200:
+            logger.error("Failed to get file info: %s", response.text)
+            raise DownloadError("❌ Не удалось получить информацию о файле")
+
+        result = response.json()
+        if not result.get("ok"):
+            logger.error("Telegram API error: %s", result)
+            raise DownloadError("❌ Ошибка при получении файла от Telegram")
+
+        file_path = result["result"]["file_path"]
+        logger.info("Downloading Telegram file: %s", file_path)
+        return f"{self.api_url}/file/bot{self.bot_token}/{file_path}"
+
+    async def download(
+        self,
+        file_id: str,
+        file_size: int,
+        output_path: str,
+        on_progress: Optional[Callable[[int], None]] = None
+    ):
+        """
+        Download a Telegram file to disk
+
+        Large files are split into ranges fetched over parallel connections.
+        Every range resumes from the last written byte after a dropped connection.
+
+        Args:
+            file_id: Telegram file ID
+            file_size: Expected file size in bytes
+            output_path: Destination path
+            on_progress: Optional callback receiving the bytes written so far
+
+        Raises:
+            DownloadError: If the file can't be downloaded or its size doesn't match
+        """
+        url = await self.get_file_url(file_id)
+        started = time.perf_counter()
+
+        written = 0
+
+        def on_bytes(count: int):
+            nonlocal written
+            written += count
+            on_progress(min(written, file_size))
+
+        reporter = on_bytes if on_progress is not None else None
+        fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if (
+                self.parallel_parts > 1
+                and file_size >= self.parallel_min_size
+                and await self._supports_ranges(url, file_size)
+            ):
+                await asyncio.to_thread(os.ftruncate, fd, file_size)
+                part_size = -(-file_size // self.parallel_parts)
+                await asyncio.gather(*(
+                    self._fetch_range(url, fd, start, min(start + part_size, file_size) - 1, reporter)
+                    for start in range(0, file_size, part_size)
+                ))
+            else:
+                await self._fetch_range(url, fd, 0, None, reporter)
+            size = (await asyncio.to_thread(os.fstat, fd)).st_size
+        finally:
+            os.close(fd)
+
+        # A connection closed cleanly mid-body ends the stream without an error
+        if size != file_size:
+            logger.error("Downloaded %s bytes of %s to %s", size, file_size, output_path)
+            raise DownloadError("❌ Файл скачан не полностью")
+
+        elapsed = time.perf_counter() - started
+        if elapsed > 0:
+            DOWNLOAD_THROUGHPUT.observe(file_size / elapsed)
+        logger.info("File downloaded successfully to: %s", output_path)
+
+    async def download_for_probe(
+        self,
+        file_id: str,
+        file_size: int,
+        output_path: str,
+        probe: Callable[[str], Awaitable[Optional[dict]]]
+    ) -> Optional[dict]:
+        """
+        Fetch only as much of a file as is needed to read its metadata.
+
+        The file is preallocated as a sparse file, then the head (container
+        header) and the tail (where MP4s often keep the moov atom) are fetched
+        and probed. If the probe fails, the head is extended in growing windows
+        up to STREAM_PROBE_MAX_BYTES. The rest of the file is never downloaded.
+
+        Args:
+            file_id: Telegram file ID
+            file_size: File size in bytes
+            output_path: Destination path of the sparse file
+            probe: Coroutine returning metadata for a path, or None if it can't be parsed yet
+
+        Returns:
+            dict: Metadata returned by `probe`, or None if a full download is needed
+        """
+        url = await self.get_file_url(file_id)
+        if not await self._supports_ranges(url, file_size):
+            return None
+
+        head_end = min(STREAM_PROBE_HEAD_BYTES, file_size)
+        tail_start = max(file_size - STREAM_PROBE_TAIL_BYTES, head_end)
+
+        fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            await asyncio.to_thread(os.ftruncate, fd, file_size)
+            ranges = [self._fetch_range(url, fd, 0, head_end - 1)]
+            if tail_start < file_size:
+                ranges.append(self._fetch_range(url, fd, tail_start, file_size - 1))
+            await asyncio.gather(*ranges)
+
+            while True:
+                metadata = await probe(output_path)
+                if metadata is not None:
+                    logger.info(
+                        "Metadata read after fetching %s of %s bytes",
+                        head_end + file_size - tail_start, file_size
+                    )
+                    return metadata
+                if head_end >= tail_start or head_end >= STREAM_PROBE_MAX_BYTES:
+                    return None
+
+                # Extend the head window and try again
+                next_end = min(head_end * 2, tail_start, STREAM_PROBE_MAX_BYTES)
+                await self._fetch_range(url, fd, head_end, next_end - 1)
+                head_end = next_end
+        finally:
+            os.close(fd)
+
+    async def _supports_ranges(self, url: str, file_size: int) -> bool:
+        try:
+            async with self.client.stream("GET", url, headers={"Range": "bytes=0-0"}) as response:
+                content_range = response.headers.get("Content-Range", "")
+                return response.status_code == 206 and content_range.endswith(f"/{file_size}")
+        except httpx.HTTPError:
+            return False
+
+    async def _fetch_range(
+        self,
+        url: str,
+        fd: int,
+        start: int,
+        end: Optional[int],
+        on_bytes: Optional[Callable[[int], None]] = None
+    ):
+        """Fetch bytes start..end (inclusive, None for the rest of the file) into fd"""
+        offset = start
+        failures = 0
+        while end is None or offset <= end:
+            resumed_at = offset
+            headers = {}
+            if offset > 0 or end is not None:
+                headers["Range"] = f"bytes={offset}-{'' if end is None else end}"
+            try:
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 200 and offset > 0:
+                        # Server ignored the Range header: start over
+                        if start > 0:
+                            raise DownloadError("❌ Сервер не поддерживает докачку файла")
+                        offset = 0
+                    elif response.status_code not in (200, 206):
+                        logger.error("Failed to download file: %s", response.status_code)
+                        raise DownloadError("❌ Не удалось скачать файл")
+
+                    async for chunk in response.aiter_bytes(chunk_size=self.chunk_size):
+                        # Write off the event loop; positional writes let ranges share one fd
+                        await asyncio.to_thread(os.pwrite, fd, chunk, offset)
+                        offset += len(chunk)
+                        DOWNLOAD_BYTES.inc(len(chunk))
+                        if on_bytes is not None:
+                            on_bytes(len(chunk))
+                if end is None:
+                    return
+                if offset > resumed_at:
+                    continue
+                # Empty response for a pending range
+                failures += 1
+                if failures > self.max_retries:
+                    raise DownloadError("❌ Не удалось скачать файл")
+            except httpx.TimeoutException:
+                failures += 1
+                if failures > self.max_retries:
+                    raise
+                logger.warning("Download timed out at byte %s, resuming", offset)
+            except httpx.TransportError as e:
+                failures += 1
+                if failures > self.max_retries:
+                    raise
+                logger.warning("Download interrupted at byte %s (%s), resuming", offset, e)
+            await asyncio.sleep(min(2 ** failures, 30))
+
+
+# Shared download manager of the process
+download_manager = DownloadManager()
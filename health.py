@@ -0,0 +1,134 @@
+"""
+Liveness and readiness endpoints for the orchestrator
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Awaitable, Callable, Iterable
+from aiohttp import web
+from startup import StartupProfile, startup_profile
+
+logger = logging.getLogger(__name__)
+
+# Seconds a single readiness check may take before it counts as failed
+CHECK_TIMEOUT = 3.0
+
+# Returns whether the dependency is usable and details for the report
+HealthCheck = Callable[[], Awaitable[tuple[bool, dict]]]
+
+
+class HealthMonitor:
+    def __init__(self, profile: StartupProfile = startup_profile):
+        """
+        Readiness of the process: warmed up and all registered checks passing
+
+        Args:
+            profile: Startup profile included in the readiness report
+        """
+        self.profile = profile
+        self.warm = False
+        self.started = time.monotonic()
+        self._checks: dict[str, HealthCheck] = {}
+
+    def add_check(self, name: str, check: HealthCheck):
+        """Register a dependency check run on every readiness request"""
+        self._checks[name] = check
+
+    def set_warm(self):
+        """Mark the warm-up as finished"""
+        self.warm = True
+        self.profile.mark("ready")
+
+    async def readiness(self) -> tuple[bool, dict]:
+        """
+        Run all checks concurrently
+
+        Returns:
+            tuple: (ready, report with the result of every check)
+        """
+        results = await asyncio.gather(*(self._run(name, check) for name, check in self._checks.items()))
+        checks = dict(results)
+        ready = self.warm and all(result["ok"] for result in checks.values())
+        return ready, {
+            "ready": ready,
+            "warm": self.warm,
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "checks": checks,
+            "startup": self.profile.to_dict(),
+        }
+
+    @staticmethod
+    async def _run(name: str, check: HealthCheck) -> tuple[str, dict]:
+        try:
+            ok, details = await asyncio.wait_for(check(), CHECK_TIMEOUT)
+        except asyncio.TimeoutError:
+            ok, details = False, {"error": f"timed out after {CHECK_TIMEOUT}s"}
+        except Exception as e:
+            ok, details = False, {"error": str(e) or type(e).__name__}
+        if not ok:
+            logger.debug("Readiness check %s failed: %s", name, details)
+        return name, {"ok": ok, **details}
+
+
+def binary_check(names: Iterable[str] = ("ffmpeg", "ffprobe")) -> HealthCheck:
+    """Check that executables run; a binary found once isn't run again"""
+    names = tuple(names)
+    available: set[str] = set()
+
+    async def check() -> tuple[bool, dict]:
+        for name in names:
+            if name in available:
+                continue
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    name, "-version",
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+                )
+                if await process.wait() == 0:
+                    available.add(name)
+            except OSError:
+                pass
+        return len(available) == len(names), {"available": {name: name in available for name in names}}
+    return check
+
+
+def sqlite_check(db_path: str) -> HealthCheck:
+    """Check that the database answers a query"""
+    def query():
+        conn = sqlite3.connect(db_path, timeout=CHECK_TIMEOUT)
+        try:
+            conn.execute("SELECT 1").fetchone()
+        finally:
+            conn.close()
+
+    async def check() -> tuple[bool, dict]:
+        await asyncio.to_thread(query)
+        return True, {}
+    return check
+
+
+def queue_check(depth: Callable[[], dict]) -> HealthCheck:
+    """Report the job queue depth (informational, never fails)"""
+    async def check() -> tuple[bool, dict]:
+        return True, {"depth": await asyncio.to_thread(depth)}
+    return check
+
+
+def add_health_routes(app: web.Application, monitor: HealthMonitor):
+    """
+    Serve /healthz (the event loop responds) and /readyz (200 when ready, 503 otherwise)
+
+    Args:
+        app: aiohttp application already serving webhooks or metrics
+        monitor: Readiness state of the process
+    """
+    async def handle_live(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "uptime_s": round(time.monotonic() - monitor.started, 1)})
+
+    async def handle_ready(request: web.Request) -> web.Response:
+        ready, report = await monitor.readiness()
+        return web.json_response(report, status=200 if ready else 503)
+
+    app.router.add_get("/healthz", handle_live)
+    app.router.add_get("/readyz", handle_ready)
@@ -0,0 +1,456 @@
+"""
+Persistent job queue stored in the bot's SQLite database
+"""
+import json
+import logging
+import sqlite3
+import time
+from typing import Optional
+from config import (
+    DATABASE_URL, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY, MAX_INFLIGHT_BYTES, EMBEDDED_WORKERS,
+    JOB_MAX_DEFER
+)
+from database import ThreadLocalConnection
+from logs import current_trace_id, new_trace_id
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Run time assumed for ETAs until some jobs have finished
+DEFAULT_RUN_SECONDS = 60.0
+
+# Weighted-fair order: the n-th waiting job of a user who already has r jobs
+# running gets share (n + r) / weight, and the lowest share goes first. Users
+# take turns instead of one user's burst blocking everyone queued after it.
+RANKED_JOBS_SQL = """
+    WITH running AS (
+        SELECT user_id, COUNT(*) AS jobs FROM jobs
+        WHERE status = :running AND lease_until >= :now
+        GROUP BY user_id
+    ),
+    ranked AS (
+        SELECT j.id, j.size, j.available_at,
+               (ROW_NUMBER() OVER (PARTITION BY j.user_id ORDER BY j.id) + COALESCE(r.jobs, 0))
+                   / j.weight AS share
+        FROM jobs j LEFT JOIN running r ON r.user_id = j.user_id
+        WHERE {condition}
+    )
+"""
+
+
+class PermanentJobError(Exception):
+    """Job failure that must not be retried; the message is shown to the user"""
+
+
+class JobQueue:
+    def __init__(self, db_path: Optional[str] = None):
+        """Initialize job queue"""
+        self.db_path = db_path or DATABASE_URL.replace("sqlite:///", "")
+        self._connections = ThreadLocalConnection(self.db_path, sqlite3.Row)
+        self.init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def init_db(self):
+        """Create the jobs table if it doesn't exist"""
+        try:
+            with self._connect() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        chat_id INTEGER NOT NULL,
+                        status_message_id INTEGER,
+                        operation TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'queued',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        max_attempts INTEGER NOT NULL,
+                        worker_id TEXT,
+                        lease_until REAL,
+                        available_at REAL NOT NULL,
+                        progress TEXT,
+                        error TEXT,
+                        created_at REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+                # Columns added after the first release
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                if "size" not in columns:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+                if "weight" not in columns:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN weight REAL NOT NULL DEFAULT 1")
+                if "started_at" not in columns:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN started_at REAL")
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, status)")
+                conn.commit()
+        except Exception as e:
+            logger.error("Error initializing job queue: %s", e)
+
+    def enqueue(
+        self,
+        user_id: int,
+        chat_id: int,
+        operation: str,
+        payload: dict,
+        status_message_id: Optional[int] = None,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        size: int = 0,
+        weight: float = 1.0
+    ) -> int:
+        """
+        Add a job to the queue
+
+        Args:
+            user_id: Telegram user ID of the requester
+            chat_id: Chat to report results to
+            operation: Pipeline operation name (e.g. "analyze")
+            payload: JSON-serializable job parameters
+            status_message_id: Message edited with progress updates
+            max_attempts: How many times the job is tried before failing
+            size: Disk bytes the job needs while running
+            weight: Share of the workers the user gets relative to others
+
+        Returns:
+            int: ID of the new job
+        """
+        # Log records of the job carry this ID in every process that works on it
+        payload = {**payload, "trace_id": payload.get("trace_id") or current_trace_id() or new_trace_id()}
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO jobs (user_id, chat_id, status_message_id, operation, payload,
+                                  max_attempts, available_at, created_at, updated_at, size, weight)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, chat_id, status_message_id, operation, json.dumps(payload),
+                 max_attempts, now, now, now, size, weight)
+            )
+            conn.commit()
+        logger.info("Job %s (%s) enqueued with trace %s", cursor.lastrowid, operation, payload["trace_id"])
+        return cursor.lastrowid
+
+    def set_status_message(self, job_id: int, message_id: int):
+        """Attach the progress message to a job"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status_message_id = ?, updated_at = ? WHERE id = ?",
+                (message_id, time.time(), job_id)
+            )
+            conn.commit()
+
+    def claim(
+        self,
+        worker_id: str,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        max_inflight_bytes: int = MAX_INFLIGHT_BYTES,
+        free_disk: Optional[int] = None,
+        max_job_size: Optional[int] = None
+    ) -> Optional[dict]:
+        """
+        Lease the next available job in weighted-fair order.
+
+        Jobs whose lease expired (their worker died) are claimed again; once
+        they have used up all attempts they are marked as failed and returned
+        with status JOB_FAILED, so the worker can tell the user.
+        Jobs bigger than the remaining byte budget wait while smaller ones
+        go ahead. Once such a job has waited JOB_MAX_DEFER seconds nothing
+        is claimed past it until enough running jobs finish, and with nothing
+        running neither the in-flight limit nor the free disk applies, so
+        large jobs can't starve and can't stall the queue. Jobs bigger than
+        max_job_size are claimed right away: they can never run, and the
+        worker fails them permanently instead of letting them hold up others.
+
+        Args:
+            worker_id: Unique ID of the claiming worker
+            lease_seconds: How long the job stays reserved without a heartbeat
+            max_inflight_bytes: Total size of running jobs (0 = unlimited)
+            free_disk: Disk bytes available to new jobs, None if unknown
+            max_job_size: Largest job the scratch space could ever hold, None if unknown
+
+        Returns:
+            dict: The claimed job, a job that just failed for good, or None if no job can run now
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = conn.execute(
+                """
+                SELECT id FROM jobs WHERE status = ? AND lease_until < ? AND attempts >= max_attempts
+                ORDER BY id LIMIT 1
+                """,
+                (JOB_RUNNING, now)
+            ).fetchone()
+            if expired is not None:
+                # Handed to this worker only so it can tell the user
+                conn.execute(
+                    """
+                    UPDATE jobs SET status = ?, worker_id = ?, lease_until = NULL, error = 'lease expired',
+                                    updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (JOB_FAILED, worker_id, now, expired["id"])
+                )
+                job = conn.execute("SELECT * FROM jobs WHERE id = ?", (expired["id"],)).fetchone()
+                conn.commit()
+                return self._decode(job)
+
+            inflight = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM jobs WHERE status = ? AND lease_until >= ?",
+                (JOB_RUNNING, now)
+            ).fetchone()[0]
+            # Nothing running: the next job goes ahead whatever its size and waits
+            # for disk space in the worker if it must
+            budget = None
+            if inflight:
+                if max_inflight_bytes:
+                    budget = max_inflight_bytes - inflight
+                if free_disk is not None:
+                    budget = free_disk if budget is None else min(budget, free_disk)
+
+            candidates = conn.execute(
+                RANKED_JOBS_SQL.format(condition="""
+                    (j.status = :queued AND j.available_at <= :now)
+                    OR (j.status = :running AND j.lease_until < :now)
+                """) + "SELECT id, size, available_at FROM ranked ORDER BY share, id",
+                {"queued": JOB_QUEUED, "running": JOB_RUNNING, "now": now}
+            )
+            row = None
+            for candidate in candidates:
+                oversized = max_job_size is not None and candidate["size"] > max_job_size
+                if budget is None or candidate["size"] <= budget or oversized:
+                    row = candidate
+                    break
+                if now - candidate["available_at"] > JOB_MAX_DEFER:
+                    break
+            if row is None:
+                conn.commit()
+                return None
+
+            conn.execute(
+                """
+                UPDATE jobs
+                SET status = ?, worker_id = ?, lease_until = ?, attempts = attempts + 1,
+                    started_at = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (JOB_RUNNING, worker_id, now + lease_seconds, now, now, row["id"])
+            )
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        job = self._decode(job)
+        if job["attempts"] > 1:
+            logger.info("Job %s claimed again (attempt %s)", job['id'], job['attempts'])
+        return job
+
+    def heartbeat(
+        self,
+        job_id: int,
+        worker_id: str,
+        progress: Optional[str] = None,
+        lease_seconds: float = JOB_LEASE_SECONDS
+    ) -> bool:
+        """
+        Extend the lease of a running job
+
+        Returns:
+            bool: False if the worker no longer owns the job
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE jobs SET lease_until = ?, progress = COALESCE(?, progress), updated_at = ?
+                WHERE id = ? AND worker_id = ? AND status = ?
+                """,
+                (now + lease_seconds, progress, now, job_id, worker_id, JOB_RUNNING)
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str):
+        """Mark a job as successfully finished"""
+        self._finish(job_id, worker_id, JOB_DONE, None)
+
+    def fail(self, job_id: int, worker_id: str, error: str, retry: bool = True) -> bool:
+        """
+        Record a failed attempt
+
+        Args:
+            job_id: Job ID
+            worker_id: Worker that ran the attempt
+            error: Error description
+            retry: Whether the job may be attempted again
+
+        Returns:
+            bool: True if the job was re-queued for another attempt
+        """
+        now = time.time()
+        with self._connect() as conn:
+            job = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker_id = ?",
+                (job_id, worker_id)
+            ).fetchone()
+            if job is None:
+                return False
+
+            if retry and job["attempts"] < job["max_attempts"]:
+                # Exponential backoff between attempts
+                delay = JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+                conn.execute(
+                    """
+                    UPDATE jobs SET status = ?, worker_id = NULL, lease_until = NULL,
+                                    available_at = ?, error = ?, updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (JOB_QUEUED, now + delay, error, now, job_id)
+                )
+                conn.commit()
+                return True
+
+        self._finish(job_id, worker_id, JOB_FAILED, error)
+        return False
+
+    def release(self, job_id: int, worker_id: str, delay: float = 0.0):
+        """
+        Return a job to the queue without counting the attempt (e.g. on shutdown)
+
+        Args:
+            job_id: Job ID
+            worker_id: Worker giving the job back
+            delay: Seconds before the job may be claimed again
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, worker_id = NULL, lease_until = NULL,
+                                attempts = MAX(attempts - 1, 0), available_at = ?, updated_at = ?
+                WHERE id = ? AND worker_id = ? AND status = ?
+                """,
+                (JOB_QUEUED, now + delay, now, job_id, worker_id, JOB_RUNNING)
+            )
+            conn.commit()
+
+    def position(self, job_id: int) -> int:
+        """Get the 1-based position of a queued job in claim order, 0 if it is not waiting"""
+        with self._connect() as conn:
+            row = conn.execute(
+                RANKED_JOBS_SQL.format(condition="j.status = :queued") + """
+                SELECT COUNT(*) FROM ranked, (SELECT share, id FROM ranked WHERE id = :job_id) target
+                WHERE ranked.share < target.share
+                   OR (ranked.share = target.share AND ranked.id <= target.id)
+                """,
+                {"queued": JOB_QUEUED, "running": JOB_RUNNING, "now": time.time(), "job_id": job_id}
+            ).fetchone()
+            return row[0]
+
+    def user_load(self, user_id: int) -> dict:
+        """
+        Get the unfinished jobs of a user
+
+        Returns:
+            dict: jobs, bytes (their total size) and oldest (the oldest job
+                as a dict with id, status and started_at, or None)
+        """
+        with self._connect() as conn:
+            jobs, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM jobs WHERE user_id = ? AND status IN (?, ?)",
+                (user_id, JOB_QUEUED, JOB_RUNNING)
+            ).fetchone()
+            oldest = conn.execute(
+                """
+                SELECT id, status, started_at FROM jobs
+                WHERE user_id = ? AND status IN (?, ?)
+                ORDER BY status = ? DESC, id LIMIT 1
+                """,
+                (user_id, JOB_QUEUED, JOB_RUNNING, JOB_RUNNING)
+            ).fetchone()
+            return {"jobs": jobs, "bytes": size, "oldest": dict(oldest) if oldest else None}
+
+    def inflight_bytes(self) -> int:
+        """Get the total size of running jobs"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM jobs WHERE status = ? AND lease_until >= ?",
+                (JOB_RUNNING, time.time())
+            ).fetchone()[0]
+
+    def throughput(self, window: float = 600.0, samples: int = 100) -> tuple[float, int]:
+        """
+        Estimate how fast the queue drains
+
+        Args:
+            window: Seconds a worker counts as active after touching a job
+            samples: Recently finished jobs averaged for the run time
+
+        Returns:
+            tuple: (average run time of a job in seconds, number of active workers)
+        """
+        now = time.time()
+        with self._connect() as conn:
+            average = conn.execute(
+                """
+                SELECT AVG(updated_at - started_at) FROM (
+                    SELECT updated_at, started_at FROM jobs
+                    WHERE status = ? AND started_at IS NOT NULL
+                    ORDER BY updated_at DESC LIMIT ?
+                )
+                """,
+                (JOB_DONE, samples)
+            ).fetchone()[0]
+            workers = conn.execute(
+                "SELECT COUNT(DISTINCT worker_id) FROM jobs WHERE worker_id IS NOT NULL AND updated_at >= ?",
+                (now - window,)
+            ).fetchone()[0]
+        return average or DEFAULT_RUN_SECONDS, max(workers, EMBEDDED_WORKERS, 1)
+
+    def depth(self) -> dict:
+        """Get the number of queued and running jobs"""
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT status, COUNT(*) FROM jobs WHERE status IN (?, ?) GROUP BY status",
+                    (JOB_QUEUED, JOB_RUNNING)
+                ).fetchall()
+                counts = {status: count for status, count in rows}
+                return {
+                    "queued": counts.get(JOB_QUEUED, 0),
+                    "running": counts.get(JOB_RUNNING, 0)
+                }
+        except Exception as e:
+            logger.error("Error getting queue depth: %s", e)
+            return {"queued": 0, "running": 0}
+
+    @staticmethod
+    def _decode(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def _finish(self, job_id: int, worker_id: str, status: str, error: Optional[str]):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ?
+                WHERE id = ? AND worker_id = ?
+                """,
+                (status, error, now, job_id, worker_id)
+            )
+            conn.commit()
@@ -0,0 +1,251 @@
+"""
+Non-blocking logging: a queue-backed handler with a writer thread, JSON or text
+output, per-job trace IDs with sampled stage spans, and secret redaction
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bot API URLs carry the token: https://api.telegram.org/bot<token>/getFile
+TOKEN_PATTERN = re.compile(r"\d{5,}:[A-Za-z0-9_-]{30,}")
+REDACTED = "***"
+
+# Extra record attributes copied into JSON output
+SPAN_FIELDS = ("span", "duration_ms", "span_status")
+
+
+class Trace:
+    __slots__ = ("trace_id", "job_id", "sampled")
+
+    def __init__(self, trace_id: str, job_id: Optional[int], sampled: bool):
+        self.trace_id = trace_id
+        self.job_id = job_id
+        self.sampled = sampled
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("log_trace", default=None)
+_span_sample_rate = 1.0
+
+
+def new_trace_id() -> str:
+    """Random 16 hex digit trace ID"""
+    return uuid.uuid4().hex[:16]
+
+
+def is_sampled(trace_id: str, rate: float) -> bool:
+    """
+    Whether the detailed spans of a trace are logged
+
+    Derived from the ID, so the bot and every worker process agree on it.
+    """
+    if rate >= 1.0:
+        return True
+    return int(trace_id[:8], 16) / 0x100000000 < rate
+
+
+def current_trace_id() -> Optional[str]:
+    """Trace ID of the job the current task works on"""
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def job_trace(job_id: Optional[int], trace_id: Optional[str] = None):
+    """
+    Attach a trace to all records logged in the block, including tasks created in it
+
+    Args:
+        job_id: Queue job ID
+        trace_id: Trace ID stored with the job, a new one if None
+    """
+    trace_id = trace_id or new_trace_id()
+    token = _current_trace.set(Trace(trace_id, job_id, is_sampled(trace_id, _span_sample_rate)))
+    try:
+        yield trace_id
+    finally:
+        _current_trace.reset(token)
+
+
+def record_span(name: str, seconds: float, failed: bool = False):
+    """
+    Log a finished stage of the current job
+
+    Spans are logged for sampled traces only; failed spans are always logged.
+
+    Args:
+        name: Stage name, e.g. "download"
+        seconds: Stage duration
+        failed: The stage raised an exception
+    """
+    trace = _current_trace.get()
+    if trace is None or not (trace.sampled or failed):
+        return
+    duration_ms = round(seconds * 1000, 1)
+    status = "failed" if failed else "ok"
+    logger.log(
+        logging.WARNING if failed else logging.INFO,
+        "Span %s %s in %.1f ms", name, status, duration_ms,
+        extra={"span": name, "duration_ms": duration_ms, "span_status": status}
+    )
+
+
+class SecretRedactor:
+    def __init__(self, secrets: Iterable[Optional[str]] = ()):
+        """
+        Replace secrets in log output
+
+        Args:
+            secrets: Literal values to hide (empty values are ignored); Telegram
+                bot tokens are hidden even if they aren't listed
+        """
+        self.secrets = sorted({secret for secret in secrets if secret}, key=len, reverse=True)
+
+    def __call__(self, text: str) -> str:
+        for secret in self.secrets:
+            if secret in text:
+                text = text.replace(secret, REDACTED)
+        return TOKEN_PATTERN.sub(REDACTED, text)
+
+
+class TraceContextFilter(logging.Filter):
+    """Copy the current trace onto records in the logging thread, before they are queued"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = _current_trace.get()
+        record.trace_id = trace.trace_id if trace else None
+        record.job_id = trace.job_id if trace else None
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, redact: SecretRedactor):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        self.redact = redact
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            text = f"{text} [job={record.job_id} trace={trace_id}]"
+        return self.redact(text)
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redact: SecretRedactor):
+        super().__init__()
+        self.redact = redact
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+            entry["job_id"] = record.job_id
+        for field in SPAN_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return self.redact(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        """
+        Hand records to the writer thread without blocking the caller
+
+        Messages are formatted in the writer thread: only the record is queued,
+        with its arguments. A full queue drops the record instead of waiting.
+        """
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.addFilter(TraceContextFilter())
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: Optional[LogQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup(
+    level: str = "INFO",
+    fmt: str = "text",
+    queue_size: int = 10000,
+    span_sample_rate: float = 1.0,
+    secrets: Iterable[Optional[str]] = ()
+):
+    """
+    Route all logging through the queue to a stdout writer thread
+
+    Args:
+        level: Root log level name
+        fmt: "json" for one JSON object per line, otherwise text
+        queue_size: Records buffered for the writer thread (0 = unbounded)
+        span_sample_rate: Share of job traces whose stage spans are logged
+        secrets: Values replaced in the output
+    """
+    global _handler, _listener, _span_sample_rate
+    stop()
+    _span_sample_rate = span_sample_rate
+    redact = SecretRedactor(secrets)
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter(redact) if fmt == "json" else TextFormatter(redact))
+    log_queue = queue.Queue(max(queue_size, 0))
+    _handler = LogQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, output)
+
+    root = logging.getLogger()
+    # Forked worker processes inherit the parent's handlers, but not its writer thread
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(getattr(logging, level))
+    # httpx logs every request line; Telegram file downloads issue one per range
+    if root.level > logging.DEBUG:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener.start()
+
+
+def stop():
+    """Write out the queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop)
+
+
+def queue_stats() -> dict:
+    """Records waiting for the writer thread and records dropped so far"""
+    if _handler is None:
+        return {}
+    return {("queued",): _handler.queue.qsize(), ("dropped",): _handler.dropped}
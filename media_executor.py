@@ -0,0 +1,217 @@
+"""
+Async execution layer for ffmpeg/ffprobe subprocesses
+"""
+import asyncio
+import contextvars
+import logging
+import subprocess
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+from config import MEDIA_WORKERS
+from metrics import MEDIA_SLOTS
+
+logger = logging.getLogger(__name__)
+
+# Called with the 1-based position while a job waits for a free slot
+QueuePositionCallback = Callable[[int], Awaitable[None]]
+
+# Set while the current task holds a slot, so nested run() calls of the same
+# job don't queue behind themselves
+_slot_held = contextvars.ContextVar("media_slot_held", default=False)
+
+
+class _Waiter:
+    __slots__ = ("future", "on_position", "position", "reporter")
+
+    def __init__(self, future: asyncio.Future, on_position: Optional[QueuePositionCallback]):
+        self.future = future
+        self.on_position = on_position
+        self.position = 0
+        self.reporter: Optional[asyncio.Task] = None
+
+
+class MediaExecutor:
+    def __init__(self, max_workers: int = MEDIA_WORKERS):
+        """
+        Initialize media executor
+
+        Args:
+            max_workers: Maximum number of media jobs running at the same time
+        """
+        self.max_workers = max(1, max_workers)
+        self._active = 0
+        self._waiters: deque[_Waiter] = deque()
+        logger.info("Media executor initialized with %s workers", self.max_workers)
+
+    @property
+    def active(self) -> int:
+        """Number of jobs currently holding a slot"""
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        """Number of jobs waiting for a slot"""
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self, on_position: Optional[QueuePositionCallback] = None):
+        """
+        Reserve a worker slot for the duration of the block.
+
+        Jobs are admitted in FIFO order. While waiting, `on_position` is
+        called whenever the job's place in the queue changes.
+
+        Args:
+            on_position: Optional coroutine function receiving the queue position
+        """
+        if _slot_held.get():
+            yield
+            return
+
+        await self._acquire(on_position)
+        token = _slot_held.set(True)
+        try:
+            yield
+        finally:
+            _slot_held.reset(token)
+            self._release()
+
+    async def run(
+        self,
+        cmd: list[str],
+        timeout: Optional[float] = None,
+        text: bool = True,
+        on_position: Optional[QueuePositionCallback] = None,
+        on_stdout_line: Optional[Callable[[str], None]] = None,
+    ) -> subprocess.CompletedProcess:
+        """
+        Run a command without blocking the event loop
+
+        Args:
+            cmd: Command and arguments
+            timeout: Timeout in seconds, None for no limit
+            text: Decode stdout/stderr as UTF-8
+            on_position: Optional queue position callback
+            on_stdout_line: Optional callback receiving stdout lines as they
+                are written (e.g. ffmpeg -progress output)
+
+        Returns:
+            subprocess.CompletedProcess: Result of the command
+
+        Raises:
+            subprocess.TimeoutExpired: If the command runs longer than timeout
+        """
+        async with self.slot(on_position):
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            if on_stdout_line is None:
+                communicate = process.communicate()
+            else:
+                communicate = self._communicate_lines(process, on_stdout_line)
+            try:
+                stdout, stderr = await asyncio.wait_for(communicate, timeout)
+            except asyncio.TimeoutError:
+                await self._kill(process)
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            except asyncio.CancelledError:
+                await self._kill(process)
+                raise
+
+        if text:
+            stdout = stdout.decode("utf-8", errors="replace")
+            stderr = stderr.decode("utf-8", errors="replace")
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+    @staticmethod
+    async def _communicate_lines(
+        process: asyncio.subprocess.Process, on_line: Callable[[str], None]
+    ) -> tuple[bytes, bytes]:
+        """Like Process.communicate(), but hands each stdout line to on_line as it arrives"""
+        async def read_stdout() -> bytes:
+            lines = []
+            async for line in process.stdout:
+                lines.append(line)
+                try:
+                    on_line(line.decode("utf-8", errors="replace").rstrip())
+                except Exception as e:
+                    logger.debug("Output line callback failed: %s", e)
+            return b"".join(lines)
+
+        stdout, stderr = await asyncio.gather(read_stdout(), process.stderr.read())
+        await process.wait()
+        return stdout, stderr
+
+    async def _acquire(self, on_position: Optional[QueuePositionCallback]):
+        if self._active < self.max_workers and not self._waiters:
+            self._active += 1
+            return
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), on_position)
+        self._waiters.append(waiter)
+        self._update_position(waiter, len(self._waiters))
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was handed over right before cancellation
+                self._release()
+            else:
+                self._waiters.remove(waiter)
+                self._notify_positions()
+            raise
+        finally:
+            if waiter.reporter and not waiter.reporter.done():
+                waiter.reporter.cancel()
+
+    def _release(self):
+        if self._waiters:
+            # Hand the slot directly to the next waiter so nobody can overtake it
+            waiter = self._waiters.popleft()
+            waiter.future.set_result(None)
+            self._notify_positions()
+        else:
+            self._active -= 1
+
+    def _notify_positions(self):
+        for position, waiter in enumerate(self._waiters, start=1):
+            self._update_position(waiter, position)
+
+    def _update_position(self, waiter: _Waiter, position: int):
+        if waiter.on_position is None or waiter.position == position:
+            return
+        waiter.position = position
+        if waiter.reporter is None or waiter.reporter.done():
+            waiter.reporter = asyncio.create_task(self._report(waiter))
+
+    @staticmethod
+    async def _report(waiter: _Waiter):
+        # Only the latest position is reported, intermediate ones are skipped
+        reported = 0
+        while reported != waiter.position and not waiter.future.done():
+            reported = waiter.position
+            try:
+                await waiter.on_position(reported)
+            except Exception as e:
+                logger.debug("Queue position callback failed: %s", e)
+
+    @staticmethod
+    async def _kill(process: asyncio.subprocess.Process):
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+
+# Shared executor used by all media operations of the process
+media_executor = MediaExecutor()
+MEDIA_SLOTS.set_function(lambda: {
+    ("active",): media_executor.active,
+    ("queued",): media_executor.queued
+})
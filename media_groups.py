@@ -0,0 +1,178 @@
+"""
+Collection of album (media group) messages into one batch
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Awaitable, Callable, Optional
+from config import DATABASE_URL, MEDIA_GROUP_WINDOW
+from database import ThreadLocalConnection
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which items of a group nobody collected (all its replicas died) are dropped
+STALE_GROUP_SECONDS = 3600
+
+
+class MediaGroupStore:
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Items of the media groups being collected, kept in the bot's database so
+        every process using it (replicas behind the webhook, for instance) adds
+        the items it receives to the same group
+
+        Args:
+            db_path: SQLite database path, defaults to the bot database
+        """
+        self.db_path = db_path or DATABASE_URL.replace("sqlite:///", "")
+        self._connections = ThreadLocalConnection(self.db_path)
+        self.init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def init_db(self):
+        """Create the items table if it doesn't exist"""
+        try:
+            with self._connect() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS media_group_items (
+                        group_id TEXT NOT NULL,
+                        item_id INTEGER NOT NULL,
+                        item TEXT NOT NULL,
+                        received_at REAL NOT NULL,
+                        PRIMARY KEY (group_id, item_id)
+                    )
+                """)
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_media_group_items_received ON media_group_items (received_at)"
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error("Error initializing media group store: %s", e)
+
+    def add(self, group_id: str, item_id: int, item: dict):
+        """
+        Add an item to its group (a redelivered item replaces itself)
+
+        Args:
+            group_id: Group the item belongs to
+            item_id: Orders the items of a group
+            item: JSON-serializable item
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO media_group_items (group_id, item_id, item, received_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (group_id, item_id, json.dumps(item), now)
+            )
+            conn.execute("DELETE FROM media_group_items WHERE received_at < ?", (now - STALE_GROUP_SECONDS,))
+            conn.commit()
+
+    def take(self, group_id: str, window: float) -> tuple[Optional[list[dict]], float]:
+        """
+        Remove and return the items of a group once none arrived for `window` seconds
+
+        Only one caller gets the items: the check and the removal are one transaction.
+
+        Returns:
+            tuple: (items in item_id order, 0) when the group is complete, an empty
+                list if another process already took it, or (None, seconds to wait
+                before trying again)
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            last = conn.execute(
+                "SELECT MAX(received_at) FROM media_group_items WHERE group_id = ?", (group_id,)
+            ).fetchone()[0]
+            if last is not None and now - last < window:
+                conn.commit()
+                return None, window - (now - last)
+            rows = conn.execute(
+                "SELECT item FROM media_group_items WHERE group_id = ? ORDER BY item_id", (group_id,)
+            ).fetchall()
+            conn.execute("DELETE FROM media_group_items WHERE group_id = ?", (group_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return [json.loads(row[0]) for row in rows], 0.0
+
+
+class MediaGroupCollector:
+    def __init__(
+        self,
+        on_complete: Callable[[list[dict]], Awaitable[None]],
+        store: MediaGroupStore,
+        window: float = MEDIA_GROUP_WINDOW
+    ):
+        """
+        Collect the items of a media group and hand them over together
+
+        Telegram delivers every message of an album as a separate update with
+        the same media_group_id and gives no count, so a group is complete once
+        no new item arrived for `window` seconds. Items go to the shared store
+        and every process that received one waits for the group to go quiet;
+        whichever takes it first hands over all items, so an album split
+        between replicas still becomes one batch.
+
+        Args:
+            on_complete: Coroutine function receiving the items of a group in item_id order
+            store: Shared store of the items
+            window: Seconds to wait for the next item of a group
+        """
+        self.on_complete = on_complete
+        self.store = store
+        self.window = window
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        """Number of groups this process waits on"""
+        return len(self._timers)
+
+    async def add(self, group_id: str, item_id: int, item: dict):
+        """Add an item to its group, restarting this process's wait for the group"""
+        await asyncio.to_thread(self.store.add, group_id, item_id, item)
+        self._schedule(group_id, self.window)
+
+    def _schedule(self, group_id: str, delay: float):
+        timer = self._timers.pop(group_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[group_id] = asyncio.get_running_loop().call_later(delay, self._start, group_id)
+
+    def _start(self, group_id: str, window: Optional[float] = None):
+        self._timers.pop(group_id, None)
+        task = asyncio.create_task(self._collect(group_id, self.window if window is None else window))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _collect(self, group_id: str, window: float):
+        try:
+            items, wait = await asyncio.to_thread(self.store.take, group_id, window)
+            if items is None:
+                # Another process received a later item; wait for the group to go quiet
+                if group_id not in self._timers:
+                    self._schedule(group_id, wait)
+                return
+            if items:
+                await self.on_complete(items)
+        except Exception as e:
+            logger.error("Failed to handle media group %s: %s", group_id, e, exc_info=True)
+
+    async def close(self):
+        """Hand over the groups this process waits on and wait until all are handled"""
+        for group_id in list(self._timers):
+            self._timers[group_id].cancel()
+            self._start(group_id, window=0)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,203 @@
+"""
+Typed media metadata parsed from ffprobe output
+"""
+from typing import Optional
+
+# Seconds of packets read to measure the keyframe interval; only the packet
+# index is read, nothing is decoded
+KEYFRAME_PROBE_SECONDS = 10
+
+FFPROBE_ENTRIES = ":".join((
+    "format=format_name,duration,size,bit_rate",
+    "stream=index,codec_type,codec_name,profile,width,height,pix_fmt,avg_frame_rate,r_frame_rate,"
+    "bit_rate,sample_rate,channels,channel_layout,duration",
+    "stream_tags=rotate,language",
+    "stream_side_data=rotation",
+))
+
+# Metadata returned when a file can't be probed
+UNKNOWN_METADATA = {
+    "duration": "Unknown",
+    "resolution": "Unknown",
+    "fps": "Unknown"
+}
+
+
+def build_probe_command(path: str) -> list[str]:
+    """ffprobe command reporting the format and stream fields MediaInfo uses"""
+    return [
+        "ffprobe",
+        "-v", "quiet",
+        "-print_format", "json",
+        "-show_entries", FFPROBE_ENTRIES,
+        path
+    ]
+
+
+def build_keyframe_probe_command(path: str) -> list[str]:
+    """
+    ffprobe command listing the packets of the first video stream in the
+    first KEYFRAME_PROBE_SECONDS; its "packets" go into MediaInfo's input.
+    A separate run because -select_streams would hide the audio streams too.
+    """
+    return [
+        "ffprobe",
+        "-v", "quiet",
+        "-print_format", "json",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=stream_index,pts_time,flags",
+        "-read_intervals", f"%+{KEYFRAME_PROBE_SECONDS}",
+        path
+    ]
+
+
+def _int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_rate(value: Optional[str]) -> float:
+    """Parse an ffprobe rational such as "30000/1001"; 0.0 if it's missing or invalid"""
+    if not value:
+        return 0.0
+    numerator, _, denominator = value.partition("/")
+    try:
+        if not denominator:
+            return float(numerator)
+        return float(numerator) / float(denominator)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+class StreamInfo:
+    __slots__ = (
+        "index", "codec_type", "codec_name", "profile", "bit_rate", "duration",
+        "width", "height", "pix_fmt", "fps", "rotation",
+        "sample_rate", "channels", "channel_layout", "language"
+    )
+
+    def __init__(self, data: dict):
+        """
+        Stream entry of ffprobe's JSON output
+
+        Args:
+            data: One element of the "streams" list
+        """
+        tags = data.get("tags") or {}
+        self.index: int = data.get("index", 0)
+        self.codec_type: Optional[str] = data.get("codec_type")
+        self.codec_name: Optional[str] = data.get("codec_name")
+        self.profile: Optional[str] = data.get("profile")
+        self.bit_rate = _int(data.get("bit_rate"))
+        self.duration = _float(data.get("duration"))
+        self.language: Optional[str] = tags.get("language")
+
+        # Video
+        self.width: int = data.get("width") or 0
+        self.height: int = data.get("height") or 0
+        self.pix_fmt: Optional[str] = data.get("pix_fmt")
+        # avg_frame_rate is the real rate of variable frame rate video; r_frame_rate the timebase guess
+        self.fps = parse_rate(data.get("avg_frame_rate")) or parse_rate(data.get("r_frame_rate"))
+        # Display matrix (current ffmpeg) or the rotate tag (older muxers)
+        rotation = next(
+            (side["rotation"] for side in data.get("side_data_list") or () if "rotation" in side),
+            tags.get("rotate")
+        )
+        self.rotation = (_int(rotation) or 0) % 360
+
+        # Audio
+        self.sample_rate = _int(data.get("sample_rate"))
+        self.channels: Optional[int] = data.get("channels")
+        self.channel_layout: Optional[str] = data.get("channel_layout")
+
+    @property
+    def display_size(self) -> tuple[int, int]:
+        """Width and height as played back, after applying the rotation"""
+        if self.rotation in (90, 270):
+            return self.height, self.width
+        return self.width, self.height
+
+
+class MediaInfo:
+    __slots__ = ("format_name", "duration", "size", "bit_rate", "streams", "keyframe_interval")
+
+    def __init__(self, data: dict):
+        """
+        Parse ffprobe's JSON output
+
+        Args:
+            data: Output of the command from build_probe_command, with the
+                "packets" of build_keyframe_probe_command if it ran
+        """
+        fmt = data.get("format") or {}
+        self.format_name: Optional[str] = fmt.get("format_name")
+        self.size = _int(fmt.get("size"))
+        self.bit_rate = _int(fmt.get("bit_rate"))
+        self.streams = [StreamInfo(stream) for stream in data.get("streams") or ()]
+        # Some containers only carry per-stream durations
+        self.duration: float = _float(fmt.get("duration")) or max(
+            (stream.duration or 0.0 for stream in self.streams), default=0.0
+        )
+
+        # Average distance of the keyframes in the probed packets
+        self.keyframe_interval: Optional[float] = None
+        video = self.video
+        if video is not None:
+            keyframes = sorted(
+                time for time in (
+                    _float(packet.get("pts_time"))
+                    for packet in data.get("packets") or ()
+                    if packet.get("stream_index") == video.index and "K" in packet.get("flags", "")
+                )
+                if time is not None
+            )
+            if len(keyframes) >= 2:
+                self.keyframe_interval = (keyframes[-1] - keyframes[0]) / (len(keyframes) - 1)
+
+    @property
+    def video(self) -> Optional[StreamInfo]:
+        """First video stream"""
+        return next((stream for stream in self.streams if stream.codec_type == "video"), None)
+
+    @property
+    def audio(self) -> Optional[StreamInfo]:
+        """First audio stream"""
+        return next((stream for stream in self.streams if stream.codec_type == "audio"), None)
+
+    def to_dict(self) -> dict:
+        """
+        Metadata dict in the format used by the pipeline, the transcoder and the
+        result cache: display strings for the user plus raw values. Width and
+        height are display dimensions, as ffmpeg filters see them after rotation.
+        """
+        video = self.video
+        audio = self.audio
+        width, height = video.display_size if video else (0, 0)
+        return {
+            "duration": f"{self.duration:.1f}",
+            "resolution": f"{width}x{height}",
+            "fps": f"{video.fps if video else 0.0:.1f}",
+            "width": width,
+            "height": height,
+            "video_codec": video.codec_name if video else None,
+            "pix_fmt": video.pix_fmt if video else None,
+            "video_bitrate": video.bit_rate if video else None,
+            "rotation": video.rotation if video else 0,
+            "keyframe_interval": (
+                round(self.keyframe_interval, 2) if self.keyframe_interval is not None else None
+            ),
+            "audio_codec": audio.codec_name if audio else None,
+            "audio_bitrate": audio.bit_rate if audio else None,
+            "audio_channels": audio.channels if audio else None,
+            "container": self.format_name,
+            "bit_rate": self.bit_rate
+        }
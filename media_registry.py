@@ -0,0 +1,190 @@
+"""
+Registry of results already uploaded to Telegram, keyed by source file and profile
+"""
+import logging
+import sqlite3
+import time
+from typing import Optional
+from config import DATABASE_URL, MEDIA_REGISTRY_MAX_ENTRIES
+from database import ThreadLocalConnection
+from metrics import MEDIA_REGISTRY_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+def variant_key(profile: str, target_size: Optional[int] = None) -> str:
+    """
+    Key of a compression result among the results of one source file
+
+    Args:
+        profile: Transcoding profile name
+        target_size: Requested output size for exact-size encodes, None otherwise
+    """
+    return f"{profile}:{target_size}" if target_size else profile
+
+
+class MediaRegistry:
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = MEDIA_REGISTRY_MAX_ENTRIES):
+        """
+        Initialize outgoing media registry
+
+        Args:
+            db_path: SQLite database path, defaults to the bot database
+            max_entries: Maximum number of entries, least recently used are evicted
+        """
+        self.db_path = db_path or DATABASE_URL.replace("sqlite:///", "")
+        self._connections = ThreadLocalConnection(self.db_path)
+        self.max_entries = max_entries
+        self.init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def init_db(self):
+        """Create registry tables if they don't exist"""
+        try:
+            with self._connect() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS outgoing_media (
+                        file_unique_id TEXT NOT NULL,
+                        variant TEXT NOT NULL,
+                        file_id TEXT NOT NULL,
+                        file_size INTEGER NOT NULL,
+                        caption TEXT,
+                        created_at REAL NOT NULL,
+                        last_access REAL NOT NULL,
+                        PRIMARY KEY (file_unique_id, variant)
+                    )
+                """)
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_outgoing_media_access ON outgoing_media (last_access)"
+                )
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS outgoing_media_stats (
+                        name TEXT PRIMARY KEY,
+                        value INTEGER NOT NULL DEFAULT 0
+                    )
+                """)
+                conn.execute(
+                    "INSERT OR IGNORE INTO outgoing_media_stats (name, value) "
+                    "VALUES ('hits', 0), ('misses', 0), ('bytes_saved', 0)"
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error("Error initializing media registry: %s", e)
+
+    def get(self, file_unique_id: str, variant: str, count_miss: bool = True) -> Optional[dict]:
+        """
+        Look up an uploaded result of a source file. Pass count_miss=False for
+        a repeated lookup of a request whose miss is already counted.
+
+        Returns:
+            dict: file_id, file_size and caption of the upload, or None on a miss
+        """
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    """
+                    SELECT file_id, file_size, caption FROM outgoing_media
+                    WHERE file_unique_id = ? AND variant = ?
+                    """,
+                    (file_unique_id, variant)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE outgoing_media SET last_access = ? WHERE file_unique_id = ? AND variant = ?",
+                        (now, file_unique_id, variant)
+                    )
+                    # Counted on lookup: the upload is skipped whenever the entry is found
+                    conn.execute(
+                        """
+                        UPDATE outgoing_media_stats
+                        SET value = value + CASE name WHEN 'hits' THEN 1 ELSE ? END
+                        WHERE name IN ('hits', 'bytes_saved')
+                        """,
+                        (row[1],)
+                    )
+                elif count_miss:
+                    conn.execute("UPDATE outgoing_media_stats SET value = value + 1 WHERE name = 'misses'")
+                conn.commit()
+        except Exception as e:
+            logger.error("Error reading media registry: %s", e)
+            return None
+
+        if row is None:
+            if count_miss:
+                MEDIA_REGISTRY_LOOKUPS.inc(result="miss")
+            return None
+        MEDIA_REGISTRY_LOOKUPS.inc(result="hit")
+        file_id, file_size, caption = row
+        return {"file_id": file_id, "file_size": file_size, "caption": caption}
+
+    def put(self, file_unique_id: str, variant: str, file_id: str, file_size: int, caption: Optional[str]):
+        """
+        Remember an uploaded result and evict least recently used entries
+
+        Args:
+            file_unique_id: Telegram file_unique_id of the source video
+            variant: Result key from variant_key()
+            file_id: Telegram file_id of the uploaded result
+            file_size: Size of the uploaded result in bytes
+            caption: Caption the result was sent with
+        """
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO outgoing_media
+                        (file_unique_id, variant, file_id, file_size, caption, created_at, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (file_unique_id, variant, file_id, file_size, caption, now, now)
+                )
+                conn.execute(
+                    """
+                    DELETE FROM outgoing_media WHERE rowid IN (
+                        SELECT rowid FROM outgoing_media
+                        ORDER BY last_access DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,)
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error("Error storing media registry entry: %s", e)
+
+    def forget(self, file_unique_id: str, variant: str):
+        """Drop an entry whose file_id Telegram no longer accepts"""
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "DELETE FROM outgoing_media WHERE file_unique_id = ? AND variant = ?",
+                    (file_unique_id, variant)
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error("Error removing media registry entry: %s", e)
+
+    def get_stats(self) -> dict:
+        """Get registry size, hit/miss counters and upload bytes saved"""
+        try:
+            with self._connect() as conn:
+                counters = dict(conn.execute("SELECT name, value FROM outgoing_media_stats").fetchall())
+                entries = conn.execute("SELECT COUNT(*) FROM outgoing_media").fetchone()[0]
+        except Exception as e:
+            logger.error("Error getting media registry stats: %s", e)
+            counters, entries = {}, 0
+
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "bytes_saved": counters.get("bytes_saved", 0)
+        }
@@ -0,0 +1,309 @@
+"""
+In-process metrics with Prometheus text exposition and JSON dump
+"""
+import asyncio
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+from aiohttp import web
+from health import HealthMonitor, add_health_routes
+from logs import queue_stats, record_span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0
+)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        """Increase the counter"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def expose(self) -> list[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in self.samples().items()
+        ]
+
+    def to_dict(self):
+        return {",".join(key) or "": value for key, value in self.samples().items()}
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], dict]] = None
+
+    def set(self, value: float, **labels):
+        """Set the gauge value"""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        """Decrease the gauge"""
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], dict]):
+        """
+        Compute values at collection time
+
+        Args:
+            function: Returns {label values tuple: value}, e.g. {("queued",): 3}
+        """
+        self._function = function
+
+    def samples(self) -> dict:
+        if self._function is not None:
+            try:
+                return {tuple(str(v) for v in key): value for key, value in self._function().items()}
+            except Exception as e:
+                logger.warning("Failed to collect gauge %s: %s", self.name, e)
+                return {}
+        return super().samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count], sum
+        self._series: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        """Record an observation"""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            return {key: (list(counts), total[0]) for key, (counts, total) in self._series.items()}
+
+    def expose(self) -> list[str]:
+        lines = self.header()
+        for key, (counts, total) in self._snapshot().items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def to_dict(self):
+        result = {}
+        for key, (counts, total) in self._snapshot().items():
+            count = sum(counts)
+            result[",".join(key) or ""] = {
+                "count": count,
+                "sum": total,
+                "avg": total / count if count else 0.0,
+                "p50": self._quantile(counts, count, 0.50),
+                "p95": self._quantile(counts, count, 0.95),
+            }
+        return result
+
+    def _quantile(self, counts: list[int], total: int, q: float) -> Optional[float]:
+        """Upper bound of the bucket containing the quantile"""
+        if total == 0:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= q * total:
+                return bound if bound != float("inf") else self.buckets[-1]
+        return self.buckets[-1]
+
+
+class Registry:
+    def __init__(self):
+        """Initialize an empty registry"""
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric):
+        """Add a metric to the registry"""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        """Render all metrics in Prometheus text format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        """Dump all metrics as a JSON-serializable dict"""
+        return {name: metric.to_dict() for name, metric in self._metrics.items()}
+
+
+registry = Registry()
+
+STAGE_DURATION = registry.register(Histogram(
+    "bot_stage_duration_seconds", "Duration of video pipeline stages", ("stage",)
+))
+STAGE_ERRORS = registry.register(Counter(
+    "bot_stage_errors_total", "Errors raised by video pipeline stages", ("stage",)
+))
+DOWNLOAD_BYTES = registry.register(Counter(
+    "bot_download_bytes_total", "Bytes downloaded from Telegram"
+))
+DOWNLOAD_THROUGHPUT = registry.register(Histogram(
+    "bot_download_throughput_bytes_per_second", "Download throughput per file",
+    buckets=(1e5, 5e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9)
+))
+DB_CALL_DURATION = registry.register(Histogram(
+    "bot_db_call_duration_seconds", "Duration of database calls", ("operation",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+))
+JOBS_IN_FLIGHT = registry.register(Gauge(
+    "bot_jobs_in_flight", "Jobs currently processed by this process"
+))
+JOB_QUEUE_DEPTH = registry.register(Gauge(
+    "bot_job_queue_depth", "Jobs in the persistent queue by status", ("status",)
+))
+MEDIA_SLOTS = registry.register(Gauge(
+    "bot_media_executor_jobs", "Media executor jobs by state", ("state",)
+))
+AI_REQUESTS = registry.register(Counter(
+    "bot_ai_requests_total", "AI model requests by result", ("model", "result")
+))
+AI_BATCH_ITEMS = registry.register(Histogram(
+    "bot_ai_batch_items", "Prompts combined into one AI request",
+    buckets=(1, 2, 4, 8, 16, 32)
+))
+AI_CACHE_LOOKUPS = registry.register(Counter(
+    "bot_ai_cache_lookups_total", "AI response cache lookups", ("result",)
+))
+STATUS_EDITS = registry.register(Counter(
+    "bot_status_edits_total", "Status message edits by result", ("result",)
+))
+MEDIA_REGISTRY_LOOKUPS = registry.register(Counter(
+    "bot_media_registry_lookups_total", "Lookups of already uploaded results", ("result",)
+))
+LOG_RECORDS = registry.register(Gauge(
+    "bot_log_records", "Log records waiting for the writer thread and dropped on a full queue", ("state",)
+))
+LOG_RECORDS.set_function(queue_stats)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Time a pipeline stage, count its errors and log it as a span of the current job"""
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, stage=stage)
+        record_span(stage, elapsed, failed)
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    # Gauge callbacks may query the database, keep them off the event loop
+    return web.Response(
+        text=await asyncio.to_thread(registry.expose), content_type="text/plain", charset="utf-8",
+        headers={"X-Content-Type-Options": "nosniff"}
+    )
+
+
+async def _handle_metrics_json(request: web.Request) -> web.Response:
+    data = await asyncio.to_thread(registry.to_dict)
+    return web.Response(text=json.dumps(data), content_type="application/json")
+
+
+def create_metrics_app() -> web.Application:
+    """Create the HTTP application serving /metrics and /metrics.json"""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    app.router.add_get("/metrics.json", _handle_metrics_json)
+    return app
+
+
+async def start_metrics_server(
+    host: str, port: int, health: Optional[HealthMonitor] = None
+) -> web.AppRunner:
+    """
+    Start the metrics HTTP server in the running event loop
+
+    Args:
+        host: Interface to bind
+        port: TCP port
+        health: Also serve /healthz and /readyz for this process
+
+    Returns:
+        web.AppRunner: Runner, call cleanup() to stop the server
+    """
+    app = create_metrics_app()
+    if health is not None:
+        add_health_routes(app, health)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics server listening on %s:%s", host, port)
+    return runner
@@ -0,0 +1,538 @@
+"""
+Video processing pipeline executed by queue workers
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+import httpx
+from telegram import Bot
+from telegram.error import BadRequest
+from database import Database
+from ai_processor import AIProcessor
+from video_processor import VideoProcessor
+from job_queue import PermanentJobError
+from result_cache import ResultCache
+from media_registry import MediaRegistry, variant_key
+from scratch import ScratchDir, ScratchSpace, scratch_space
+from config import ALBUM_PARALLEL_DOWNLOADS, STREAM_PROBE_MIN_SIZE, TELEGRAM_UPLOAD_LIMIT
+from download_manager import download_manager, DownloadError
+from metrics import track_stage
+from transcoder import TranscodeError
+from url_ingest import IngestError, UrlIngestor, url_ingestor
+from progress import ProgressReporter, format_progress
+from media_executor import QueuePositionCallback
+from utils import download_large_file, compute_content_hash, format_file_size, split_message
+
+logger = logging.getLogger(__name__)
+
+# Called with a short progress description, e.g. "download"
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+# Status text of the transcoder stages
+TRANSCODE_STAGES = {
+    "copy": "копирую без перекодирования",
+    "encode": "кодирую",
+    "pass1": "первый проход",
+    "pass2": "второй проход",
+}
+
+
+
+def format_album_report(items: list[tuple[Optional[str], str]]) -> list[str]:
+    """
+    Reply to an album: one section per video, split into messages Telegram accepts
+
+    Args:
+        items: File name (None if unknown) and analysis of each video
+
+    Returns:
+        list: Message texts in order
+    """
+    sections = [
+        f"🎬 Видео {number}{f': {name}' if name else ''}\n{analysis}"
+        for number, (name, analysis) in enumerate(items, start=1)
+    ]
+    return split_message(f"✅ Альбом обработан ({len(items)} видео)!\n\n" + "\n\n".join(sections))
+
+
+class VideoPipeline:
+    def __init__(
+        self,
+        db: Database,
+        ai_processor: AIProcessor,
+        video_processor: VideoProcessor,
+        result_cache: ResultCache,
+        media_registry: MediaRegistry,
+        scratch: ScratchSpace = scratch_space,
+        ingestor: UrlIngestor = url_ingestor
+    ):
+        """Initialize pipeline with shared components"""
+        self.db = db
+        self.ai_processor = ai_processor
+        self.video_processor = video_processor
+        self.result_cache = result_cache
+        self.media_registry = media_registry
+        self.scratch = scratch
+        self.ingestor = ingestor
+
+    async def run(self, job: dict, bot: Bot, on_progress: ProgressCallback):
+        """
+        Run a queued job
+
+        Args:
+            job: Job claimed from the queue
+            bot: Bot used to report results
+            on_progress: Callback receiving the current stage
+
+        Raises:
+            PermanentJobError: If the job can't succeed on retry
+        """
+        operation = job["operation"]
+        status = ProgressReporter(lambda text: self.edit_status(bot, job, text))
+        try:
+            if operation == "analyze":
+                await self.analyze(job, bot, on_progress, status)
+            elif operation == "analyze_album":
+                await self.analyze_album(job, bot, on_progress, status)
+            elif operation == "compress":
+                await self.compress(job, bot, on_progress, status)
+            else:
+                raise PermanentJobError(f"❌ Неизвестная операция: {operation}")
+        finally:
+            # Error messages edited by the worker must not be overwritten by a pending update
+            await status.close()
+
+    async def analyze(self, job: dict, bot: Bot, on_progress: ProgressCallback, status: ProgressReporter):
+        """Download a video, extract metadata and reply with the AI analysis"""
+        payload = job["payload"]
+        file_id = payload.get("file_id")
+        work_dir = await self.reserve_scratch(job)
+        video_path = work_dir.file("source.mp4")
+        started = time.monotonic()
+
+        async def report_queue_position(position: int):
+            status.update(f"⏳ Ожидает обработки, место в очереди: {position}")
+
+        async def probe_partial(path: str) -> Optional[dict]:
+            return await self.video_processor.probe_partial(
+                path, on_queue_position=report_queue_position
+            )
+
+        try:
+            await on_progress("download")
+            status.update("⏳ Загружаю видео...")
+
+            with track_stage("download"):
+                # Large files: read metadata from the head/tail of the file and skip the rest
+                result = None
+                complete = True
+                if payload.get("url"):
+                    video_path = await self.fetch_url(job, work_dir, status)
+                elif payload["file_size"] >= STREAM_PROBE_MIN_SIZE:
+                    try:
+                        result = await download_manager.download_for_probe(
+                            file_id, payload["file_size"], video_path, probe_partial
+                        )
+                    except DownloadError as e:
+                        raise PermanentJobError(str(e))
+                    except httpx.HTTPError as e:
+                        logger.warning("Streaming probe failed, downloading the whole file: %s", e)
+                    # A successful probe leaves a sparse file with only its head and tail
+                    complete = result is None
+
+                if result is None and not payload.get("url"):
+                    success, error_msg = await download_large_file(
+                        file_id, payload["file_size"], video_path, self.download_progress(status, payload)
+                    )
+                    if not success:
+                        raise PermanentJobError(error_msg)
+
+            await on_progress("process")
+            status.update(
+                f"✅ Видео загружено!\n"
+                f"⏳ Обрабатываю видео..."
+            )
+
+            # The same video may have been uploaded before as a different file
+            content_hash = await asyncio.to_thread(compute_content_hash, video_path)
+            cached = await asyncio.to_thread(self.result_cache.get_by_hash, content_hash, "analyze")
+            if cached is not None:
+                analysis = cached["analysis"]
+                # Remember the new file_unique_id so the next copy skips the download
+                await asyncio.to_thread(
+                    self.result_cache.put, payload["file_unique_id"], content_hash, "analyze", cached
+                )
+            else:
+                if result is None:
+                    # Process video (waits for a free media worker if all are busy)
+                    result = await self.video_processor.process_video(
+                        video_path, on_queue_position=report_queue_position
+                    )
+
+                await on_progress("analyze")
+                analysis = await self.describe(video_path, result, complete, report_queue_position)
+
+                # Failed probes return placeholders and must not be cached
+                if result.get("duration") != "Unknown":
+                    await asyncio.to_thread(
+                        self.result_cache.put, payload["file_unique_id"], content_hash, "analyze",
+                        {"metadata": result, "analysis": analysis}
+                    )
+
+            with track_stage("reply"):
+                await status.publish(f"✅ Видео обработано!\n\n{analysis}")
+
+            # Log to database
+            await self.db.log_video_processing(
+                job["user_id"], payload["file_size"], int((time.monotonic() - started) * 1000)
+            )
+        finally:
+            await asyncio.to_thread(self.scratch.release, work_dir)
+
+    async def analyze_album(
+        self, job: dict, bot: Bot, on_progress: ProgressCallback, status: ProgressReporter
+    ):
+        """
+        Analyze the videos of an album and reply with one aggregated message
+
+        Downloads share the connection pool and run ALBUM_PARALLEL_DOWNLOADS at a
+        time, all videos are probed under one media slot and the AI requests are
+        issued together, so the AI client batches them. The result cache is read
+        with one query per lookup key and written in one transaction. A video that
+        fails to download is reported in its section instead of failing the album.
+        """
+        payload = job["payload"]
+        videos = payload["videos"]
+        work_dir = await self.reserve_scratch(job)
+        started = time.monotonic()
+        analyses: list[Optional[str]] = [None] * len(videos)
+        paths: list[Optional[str]] = [None] * len(videos)
+        downloads = asyncio.Semaphore(ALBUM_PARALLEL_DOWNLOADS)
+
+        def report(title: str):
+            done = sum(analysis is not None for analysis in analyses)
+            status.update(format_progress(title, done / len(videos), f"{done} из {len(videos)} видео"))
+
+        async def report_queue_position(position: int):
+            status.update(f"⏳ Ожидает обработки, место в очереди: {position}")
+
+        async def fetch(index: int, video: dict):
+            path = work_dir.file(f"source-{index}.mp4")
+            async with downloads:
+                success, error_msg = await download_large_file(video["file_id"], video["file_size"], path)
+            if success:
+                paths[index] = path
+            else:
+                analyses[index] = error_msg
+            report("⏳ Загружаю видео альбома...")
+
+        try:
+            cached = await asyncio.to_thread(
+                self.result_cache.get_many, [video["file_unique_id"] for video in videos], "analyze"
+            )
+            for index, video in enumerate(videos):
+                if video["file_unique_id"] in cached:
+                    analyses[index] = cached[video["file_unique_id"]]["analysis"]
+
+            await on_progress("download")
+            report("⏳ Загружаю видео альбома...")
+            with track_stage("download"):
+                await asyncio.gather(*(
+                    fetch(index, video) for index, video in enumerate(videos) if analyses[index] is None
+                ))
+
+            await on_progress("process")
+            pending = [index for index, path in enumerate(paths) if path is not None]
+            hashes = await asyncio.gather(
+                *(asyncio.to_thread(compute_content_hash, paths[index]) for index in pending)
+            )
+            cached = await asyncio.to_thread(self.result_cache.get_many_by_hash, hashes, "analyze")
+            # Stored together once the album is analyzed
+            entries = []
+            probe = []
+            for index, content_hash in zip(pending, hashes):
+                if content_hash in cached:
+                    analyses[index] = cached[content_hash]["analysis"]
+                    entries.append(
+                        (videos[index]["file_unique_id"], content_hash, "analyze", cached[content_hash])
+                    )
+                else:
+                    probe.append((index, content_hash))
+            report("⏳ Обрабатываю видео альбома...")
+            results = await self.video_processor.process_videos(
+                [paths[index] for index, _ in probe], on_queue_position=report_queue_position
+            )
+
+            await on_progress("analyze")
+
+            async def analyze(index: int, content_hash: str, result: dict):
+                analyses[index] = await self.describe(paths[index], result, True, report_queue_position)
+                if result.get("duration") != "Unknown":
+                    entries.append((
+                        videos[index]["file_unique_id"], content_hash, "analyze",
+                        {"metadata": result, "analysis": analyses[index]}
+                    ))
+                report("⏳ Анализирую видео альбома...")
+
+            await asyncio.gather(*(
+                analyze(index, content_hash, result) for (index, content_hash), result in zip(probe, results)
+            ))
+            await asyncio.to_thread(self.result_cache.put_many, entries)
+
+            with track_stage("reply"):
+                first, *rest = format_album_report([
+                    (video.get("file_name"), analysis) for video, analysis in zip(videos, analyses)
+                ])
+                await status.publish(first)
+                for text in rest:
+                    await bot.send_message(job["chat_id"], text)
+
+            # Queued together, the rows are committed by one executemany of the writer
+            processing_ms = int((time.monotonic() - started) * 1000)
+            for index, video in enumerate(videos):
+                downloaded = paths[index] is not None
+                await self.db.log_video_processing(
+                    job["user_id"], video["file_size"] if downloaded else 0,
+                    processing_ms if downloaded else None
+                )
+        finally:
+            await asyncio.to_thread(self.scratch.release, work_dir)
+
+    async def describe(
+        self,
+        video_path: str,
+        result: dict,
+        complete: bool,
+        report_queue_position: QueuePositionCallback
+    ) -> str:
+        """
+        Analysis text of a probed video
+
+        Args:
+            video_path: Path to the video file
+            result: Metadata of the video, extended with frame summaries
+            complete: False if only the head and tail of the file were downloaded
+            report_queue_position: Media queue position callback
+
+        Returns:
+            str: Analysis, with the AI description when frames are available
+        """
+        if complete and self.ai_processor.enabled:
+            # Frames give the model something to describe besides the metadata
+            async with self.video_processor.executor.slot(report_queue_position):
+                frames = await self.video_processor.sample_frames(video_path, result)
+            if frames:
+                result["frames"] = self.video_processor.summarize_frames(frames)
+
+        with track_stage("analyze"):
+            if result.get("frames"):
+                analysis, description = await asyncio.gather(
+                    self.ai_processor.analyze_video(result),
+                    self.ai_processor.generate_description(video_path, result)
+                )
+                return f"{analysis}\n\n📝 {description}"
+            return await self.ai_processor.analyze_video(result)
+
+    async def compress(self, job: dict, bot: Bot, on_progress: ProgressCallback, status: ProgressReporter):
+        """Download a video, transcode it with the requested profile and send it back"""
+        payload = job["payload"]
+        profile = payload.get("profile")
+        started = time.monotonic()
+
+        # An identical request may have finished while this one was queued
+        variant = variant_key(profile, payload.get("target_size") if payload.get("exact_size") else None)
+        if await self.send_registered(bot, job["chat_id"], payload["file_unique_id"], variant, count_miss=False):
+            await status.publish("✅ Видео сжато и отправлено!")
+            await self.db.log_video_processing(
+                job["user_id"], payload["file_size"], int((time.monotonic() - started) * 1000)
+            )
+            return
+
+        work_dir = await self.reserve_scratch(job)
+        video_path = work_dir.file("source.mp4")
+        output_path = work_dir.file(f"{profile}.mp4")
+
+        try:
+            await on_progress("download")
+            status.update("⏳ Загружаю видео...")
+            with track_stage("download"):
+                if payload.get("url"):
+                    video_path = await self.fetch_url(job, work_dir, status)
+                else:
+                    success, error_msg = await download_large_file(
+                        payload["file_id"], payload["file_size"], video_path,
+                        self.download_progress(status, payload)
+                    )
+                    if not success:
+                        raise PermanentJobError(error_msg)
+
+            await on_progress("compress")
+            status.update(f"✅ Видео загружено!\n⏳ Сжимаю ({profile})...")
+
+            async def report_queue_position(position: int):
+                status.update(f"⏳ Ожидает сжатия, место в очереди: {position}")
+
+            def report_transcode_progress(stage: str, fraction: float):
+                status.update(format_progress(
+                    f"⏳ Сжимаю ({profile}): {TRANSCODE_STAGES.get(stage, stage)}...", fraction
+                ))
+
+            async with self.video_processor.executor.slot(report_queue_position):
+                metadata = await self.video_processor.get_video_metadata(video_path)
+            # Each ffmpeg run takes its own slot, so long videos can spread over several
+            try:
+                result = await self.video_processor.transcoder.transcode(
+                    video_path, output_path, metadata, profile,
+                    payload.get("target_size", TELEGRAM_UPLOAD_LIMIT),
+                    exact_size=payload.get("exact_size", False),
+                    on_position=report_queue_position,
+                    on_progress=report_transcode_progress
+                )
+            except TranscodeError as e:
+                raise PermanentJobError(str(e))
+
+            await on_progress("reply")
+            if result["method"] == "copy":
+                method = "без перекодирования"
+            elif result["method"] == "two-pass":
+                method = f"профиль {result['profile']}, два прохода"
+            elif result["method"] == "segmented":
+                method = f"профиль {result['profile']}, параллельно по частям"
+            else:
+                method = f"профиль {result['profile']}"
+            caption = (
+                f"✅ Готово: {format_file_size(payload['file_size'])} → "
+                f"{format_file_size(result['output_size'])} ({method})"
+            )
+            with track_stage("reply"):
+                with open(output_path, "rb") as video:
+                    message = await bot.send_video(
+                        job["chat_id"],
+                        video,
+                        caption=caption,
+                        supports_streaming=True,
+                        read_timeout=120,
+                        write_timeout=300
+                    )
+                await status.publish("✅ Видео сжато и отправлено!")
+
+            # Telegram may store a silent clip as an animation
+            sent = message.video or message.animation or message.document
+            if sent is not None:
+                await asyncio.to_thread(
+                    self.media_registry.put,
+                    payload["file_unique_id"], variant, sent.file_id, result["output_size"], caption
+                )
+
+            await self.db.log_video_processing(
+                job["user_id"], payload["file_size"], int((time.monotonic() - started) * 1000)
+            )
+            await self.db.log_transcode(
+                job["id"], job["user_id"], result, payload["file_size"], payload.get("target_size")
+            )
+        finally:
+            await asyncio.to_thread(self.scratch.release, work_dir)
+
+    async def fetch_url(self, job: dict, work_dir: ScratchDir, status: ProgressReporter) -> str:
+        """
+        Download the linked video of a job into its scratch directory
+
+        The payload's file_size is set to the size of the downloaded file.
+
+        Returns:
+            str: Path of the downloaded file
+
+        Raises:
+            PermanentJobError: If the link can't be downloaded
+        """
+        payload = job["payload"]
+
+        def on_bytes(done: int, total: Optional[int]):
+            if total:
+                status.update(format_progress(
+                    "⏳ Загружаю видео по ссылке...", done / total,
+                    f"{format_file_size(done)} из {format_file_size(total)}"
+                ))
+            else:
+                status.update(f"⏳ Загружаю видео по ссылке... {format_file_size(done)}")
+
+        try:
+            video = await self.ingestor.download(
+                payload["url"], work_dir.path, job["operation"], payload.get("profile"), on_bytes
+            )
+        except IngestError as e:
+            raise PermanentJobError(str(e))
+        payload["file_size"] = video["size"]
+        return video["path"]
+
+    @staticmethod
+    def download_progress(status: ProgressReporter, payload: dict) -> Callable[[int], None]:
+        """Download progress callback showing the bytes received in the status message"""
+        total = payload["file_size"]
+
+        def on_bytes(done: int):
+            if total:
+                status.update(format_progress(
+                    "⏳ Загружаю видео...", done / total,
+                    f"{format_file_size(done)} из {format_file_size(total)}"
+                ))
+        return on_bytes
+
+    async def send_registered(
+        self, bot: Bot, chat_id: int, file_unique_id: str, variant: str, count_miss: bool = True
+    ) -> bool:
+        """
+        Send a result uploaded earlier by its file_id instead of producing it again
+
+        Args:
+            bot: Bot used to send the result
+            chat_id: Chat to send the result to
+            file_unique_id: Telegram file_unique_id of the source video
+            variant: Result key from variant_key()
+            count_miss: Count a miss in the registry stats
+
+        Returns:
+            bool: True if the result was sent
+        """
+        entry = await asyncio.to_thread(self.media_registry.get, file_unique_id, variant, count_miss)
+        if entry is None:
+            return False
+        try:
+            with track_stage("reply"):
+                await bot.send_video(chat_id, entry["file_id"], caption=entry["caption"])
+        except BadRequest as e:
+            logger.warning("Registered file_id of %s/%s rejected: %s", file_unique_id, variant, e)
+            await asyncio.to_thread(self.media_registry.forget, file_unique_id, variant)
+            return False
+        return True
+
+    async def reserve_scratch(self, job: dict) -> ScratchDir:
+        """
+        Reserve scratch space for a job before anything is downloaded
+
+        Raises:
+            PermanentJobError: If the job can never fit on this server
+            ScratchSpaceError: If the space is taken by other jobs right now
+        """
+        # The size admission and claim were based on: the upload, plus the output for compression
+        size = job.get("size") or job["payload"]["file_size"]
+        if not self.scratch.fits(size):
+            raise PermanentJobError("❌ Видео слишком большое для обработки на этом сервере")
+        return await asyncio.to_thread(self.scratch.acquire, job["id"], size)
+
+    @staticmethod
+    async def edit_status(bot: Bot, job: dict, text: str):
+        """Edit the job's status message, or send a new one if there is none"""
+        if job.get("status_message_id"):
+            try:
+                await bot.edit_message_text(
+                    text, chat_id=job["chat_id"], message_id=job["status_message_id"]
+                )
+                return
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return
+                logger.warning("Failed to edit status message of job %s: %s", job['id'], e)
+        message = await bot.send_message(job["chat_id"], text)
+        job["status_message_id"] = message.message_id
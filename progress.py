@@ -0,0 +1,98 @@
+"""
+Throttled progress reporting through a job's status message
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+from telegram.error import RetryAfter, TelegramError
+from config import PROGRESS_EDIT_INTERVAL
+from metrics import STATUS_EDITS
+
+logger = logging.getLogger(__name__)
+
+BAR_WIDTH = 10
+
+
+def format_progress(title: str, fraction: float, detail: str = "") -> str:
+    """
+    Format a status text with a progress bar
+
+    Args:
+        title: First line, e.g. "⏳ Загружаю видео..."
+        fraction: Completed share, 0..1
+        detail: Optional text after the percentage
+
+    Returns:
+        str: e.g. "⏳ Загружаю видео...\n▰▰▰▰▱▱▱▱▱▱ 42% · 420.0 MB из 1.0 GB"
+    """
+    fraction = min(max(fraction, 0.0), 1.0)
+    filled = int(fraction * BAR_WIDTH)
+    text = f"{title}\n{'▰' * filled}{'▱' * (BAR_WIDTH - filled)} {int(fraction * 100)}%"
+    return f"{text} · {detail}" if detail else text
+
+
+class ProgressReporter:
+    def __init__(self, edit: Callable[[str], Awaitable[None]], interval: float = PROGRESS_EDIT_INTERVAL):
+        """
+        Coalesce status updates into at most one message edit per `interval`
+
+        Updates arriving between edits replace each other and only the latest
+        text is sent; a text equal to the one already shown is never sent.
+        On a 429 the next edit waits for Telegram's retry_after.
+
+        Args:
+            edit: Coroutine function editing the status message
+            interval: Minimum seconds between edits
+        """
+        self.edit = edit
+        self.interval = interval
+        self._text: Optional[str] = None
+        self._sent: Optional[str] = None
+        self._next_edit = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, text: str):
+        """Show `text` with the next edit, without waiting for it"""
+        if text == self._text:
+            return
+        if self._text != self._sent:
+            STATUS_EDITS.inc(result="coalesced")
+        self._text = text
+        if text == self._sent:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def publish(self, text: str):
+        """Show `text` and wait until it's sent (e.g. the final result)"""
+        self.update(text)
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def close(self):
+        """Drop pending updates, so later direct edits aren't overwritten"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        while self._text != self._sent:
+            delay = self._next_edit - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text = self._text
+            try:
+                await self.edit(text)
+                STATUS_EDITS.inc(result="sent")
+            except RetryAfter as e:
+                STATUS_EDITS.inc(result="rate_limited")
+                logger.info("Status edits rate limited, waiting %ss", e.retry_after)
+                self._next_edit = loop.time() + float(e.retry_after)
+                continue
+            except TelegramError as e:
+                # Not retried: the next update replaces this text anyway
+                STATUS_EDITS.inc(result="failed")
+                logger.warning("Failed to update status message: %s", e)
+            self._sent = text
+            self._next_edit = loop.time() + self.interval
@@ -0,0 +1,216 @@
+"""
+Persistent cache of processing results keyed by Telegram file_unique_id
+"""
+import json
+import logging
+import sqlite3
+import time
+from typing import Optional
+from config import DATABASE_URL, RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES
+from database import ThreadLocalConnection
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        ttl: int = RESULT_CACHE_TTL,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES
+    ):
+        """
+        Initialize result cache
+
+        Args:
+            db_path: SQLite database path, defaults to the bot database
+            ttl: Seconds an entry stays valid
+            max_entries: Maximum number of entries, least recently used are evicted
+        """
+        self.db_path = db_path or DATABASE_URL.replace("sqlite:///", "")
+        self._connections = ThreadLocalConnection(self.db_path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def init_db(self):
+        """Create cache tables if they don't exist"""
+        try:
+            with self._connect() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS result_cache (
+                        file_unique_id TEXT NOT NULL,
+                        operation TEXT NOT NULL,
+                        content_hash TEXT,
+                        result TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_access REAL NOT NULL,
+                        PRIMARY KEY (file_unique_id, operation)
+                    )
+                """)
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_result_cache_hash "
+                    "ON result_cache (content_hash, operation)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_result_cache_access ON result_cache (last_access)"
+                )
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS result_cache_stats (
+                        name TEXT PRIMARY KEY,
+                        value INTEGER NOT NULL DEFAULT 0
+                    )
+                """)
+                conn.execute(
+                    "INSERT OR IGNORE INTO result_cache_stats (name, value) "
+                    "VALUES ('hits', 0), ('misses', 0)"
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error("Error initializing result cache: %s", e)
+
+    def get(self, file_unique_id: str, operation: str) -> Optional[dict]:
+        """
+        Look up a result by Telegram file_unique_id
+
+        Returns:
+            dict: Cached result, or None on a miss
+        """
+        return self.get_many([file_unique_id], operation).get(file_unique_id)
+
+    def get_many(self, file_unique_ids: list[str], operation: str) -> dict[str, dict]:
+        """
+        Look up the results of several files in one query
+
+        Returns:
+            dict: Cached results by file_unique_id, misses are left out
+        """
+        return self._lookup("file_unique_id", file_unique_ids, operation)
+
+    def get_by_hash(self, content_hash: str, operation: str) -> Optional[dict]:
+        """
+        Look up a result by content hash (same video uploaded as a different file).
+        Only hits are counted; the preceding file_unique_id lookup already
+        recorded the miss.
+
+        Returns:
+            dict: Cached result, or None on a miss
+        """
+        return self.get_many_by_hash([content_hash], operation).get(content_hash)
+
+    def get_many_by_hash(self, content_hashes: list[str], operation: str) -> dict[str, dict]:
+        """
+        Look up the results of several content hashes in one query (hits only are counted)
+
+        Returns:
+            dict: Cached results by content hash, misses are left out
+        """
+        return self._lookup("content_hash", content_hashes, operation, count_miss=False)
+
+    def put(self, file_unique_id: str, content_hash: Optional[str], operation: str, result: dict):
+        """
+        Store a result and evict expired and least recently used entries
+
+        Args:
+            file_unique_id: Telegram file_unique_id of the source video
+            content_hash: Content fingerprint of the downloaded file
+            operation: Pipeline operation the result belongs to
+            result: JSON-serializable result
+        """
+        self.put_many([(file_unique_id, content_hash, operation, result)])
+
+    def put_many(self, entries: list[tuple[str, Optional[str], str, dict]]):
+        """
+        Store several results in one transaction, see put()
+
+        Args:
+            entries: (file_unique_id, content_hash, operation, result) of every result
+        """
+        if not entries:
+            return
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO result_cache
+                        (file_unique_id, operation, content_hash, result, created_at, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (file_unique_id, operation, content_hash, json.dumps(result), now, now)
+                        for file_unique_id, content_hash, operation, result in entries
+                    ]
+                )
+                conn.execute("DELETE FROM result_cache WHERE created_at < ?", (now - self.ttl,))
+                conn.execute(
+                    """
+                    DELETE FROM result_cache WHERE rowid IN (
+                        SELECT rowid FROM result_cache
+                        ORDER BY last_access DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,)
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error("Error storing cached result: %s", e)
+
+    def get_stats(self) -> dict:
+        """Get cache size and hit/miss counters"""
+        try:
+            with self._connect() as conn:
+                counters = dict(conn.execute("SELECT name, value FROM result_cache_stats").fetchall())
+                entries = conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+        except Exception as e:
+            logger.error("Error getting cache stats: %s", e)
+            counters, entries = {}, 0
+
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
+
+    def _lookup(
+        self, column: str, values: list[str], operation: str, count_miss: bool = True
+    ) -> dict[str, dict]:
+        values = list(dict.fromkeys(values))
+        if not values:
+            return {}
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    f"""
+                    SELECT rowid, {column}, result FROM result_cache
+                    WHERE {column} IN ({", ".join("?" * len(values))})
+                      AND operation = ? AND created_at >= ?
+                    """,
+                    (*values, operation, now - self.ttl)
+                ).fetchall()
+                if rows:
+                    conn.executemany(
+                        "UPDATE result_cache SET last_access = ? WHERE rowid = ?",
+                        [(now, row[0]) for row in rows]
+                    )
+                # Several files may share a content hash; each value counts once
+                found = {row[1]: row[2] for row in rows}
+                conn.executemany(
+                    "UPDATE result_cache_stats SET value = value + ? WHERE name = ?",
+                    [(len(found), "hits")] + ([(len(values) - len(found), "misses")] if count_miss else [])
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error("Error reading cached results: %s", e)
+            return {}
+
+        return {value: json.loads(result) for value, result in found.items()}
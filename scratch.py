@@ -0,0 +1,283 @@
+"""
+Scratch space for job files: per-job directories, space reservations and orphan cleanup
+"""
+import fcntl
+import glob
+import json
+import logging
+import os
+import shutil
+import socket
+import uuid
+from typing import Optional
+from config import (
+    SCRATCH_DIR, SCRATCH_MAX_BYTES, SCRATCH_TMPFS_DIR, SCRATCH_TMPFS_MAX_JOB_SIZE,
+    SCRATCH_TMPFS_MAX_BYTES, MIN_FREE_DISK
+)
+
+logger = logging.getLogger(__name__)
+
+# Written into every job directory and locked for as long as the job runs
+OWNER_FILE = ".owner"
+# Serializes reservations and sweeps of a root between processes
+LOCK_FILE = ".lock"
+# Temporary files of older versions, left in the working directory by crashes
+LEGACY_PATTERN = "temp_*.mp4"
+
+
+class ScratchSpaceError(Exception):
+    """Not enough scratch space for a job at the moment"""
+
+
+class ScratchDir:
+    def __init__(self, path: str, reserved: int, lock_fd: int):
+        """
+        Directory holding the files of one job
+
+        Args:
+            path: Directory path
+            reserved: Bytes reserved for the job
+            lock_fd: Descriptor of the locked owner file
+        """
+        self.path = path
+        self.reserved = reserved
+        self.lock_fd = lock_fd
+
+    def file(self, name: str) -> str:
+        """Get the path of a file inside the directory"""
+        return os.path.join(self.path, name)
+
+
+class ScratchRoot:
+    def __init__(self, path: str, max_bytes: int, min_free: int):
+        """
+        Filesystem location job directories are created in
+
+        Args:
+            path: Root directory
+            max_bytes: Cap on the space used by all jobs, 0 for none
+            min_free: Bytes of the filesystem that stay free
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+
+    def available(self) -> int:
+        """
+        Get the bytes a new reservation may take
+
+        Jobs count with the larger of their reservation and their actual usage,
+        so a job writing more than it reserved still holds back the others.
+        Only the reservations not yet written are taken off the free space,
+        as the written part is already missing from it.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        committed = 0
+        pending = 0
+        for entry in os.scandir(self.path):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                with open(os.path.join(entry.path, OWNER_FILE)) as f:
+                    reserved = json.load(f)["reserved"]
+            except (OSError, ValueError, KeyError):
+                reserved = 0
+            used = directory_usage(entry.path)
+            committed += max(reserved, used)
+            pending += max(reserved - used, 0)
+
+        available = shutil.disk_usage(self.path).free - self.min_free - pending
+        if self.max_bytes:
+            available = min(available, self.max_bytes - committed)
+        return available
+
+
+def directory_usage(path: str) -> int:
+    """Get the bytes allocated by files under a directory (sparse files count what's written)"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+class _RootLock:
+    """Exclusive lock on a scratch root, shared by all processes on the host"""
+
+    def __init__(self, root: ScratchRoot):
+        self.path = os.path.join(root.path, LOCK_FILE)
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        os.close(self.fd)
+
+
+class ScratchSpace:
+    def __init__(
+        self,
+        path: str = SCRATCH_DIR,
+        max_bytes: int = SCRATCH_MAX_BYTES,
+        tmpfs_path: str = SCRATCH_TMPFS_DIR,
+        tmpfs_max_bytes: int = SCRATCH_TMPFS_MAX_BYTES,
+        tmpfs_max_job_size: int = SCRATCH_TMPFS_MAX_JOB_SIZE,
+        min_free: int = MIN_FREE_DISK
+    ):
+        """
+        Initialize scratch space
+
+        Args:
+            path: Disk directory for job files
+            max_bytes: Cap on the disk space used by all jobs, 0 for none
+            tmpfs_path: Memory-backed directory for small jobs, empty to disable
+            tmpfs_max_bytes: Cap on the tmpfs space used by all jobs
+            tmpfs_max_job_size: Largest reservation placed on tmpfs
+            min_free: Disk bytes that stay free
+        """
+        self.disk = ScratchRoot(path, max_bytes, min_free)
+        self.tmpfs = None
+        if tmpfs_path:
+            # A subdirectory, so sweeps never touch other users of the tmpfs
+            self.tmpfs = ScratchRoot(os.path.join(tmpfs_path, "wowsilizing"), tmpfs_max_bytes, 0)
+        self.tmpfs_max_job_size = tmpfs_max_job_size
+
+    def _roots(self, size: int) -> list[ScratchRoot]:
+        """Roots a job of `size` bytes may use, fastest first"""
+        if self.tmpfs is not None and size <= self.tmpfs_max_job_size:
+            return [self.tmpfs, self.disk]
+        return [self.disk]
+
+    def max_job_size(self) -> Optional[int]:
+        """Get the largest reservation a job could ever get on disk, None if unknown"""
+        try:
+            os.makedirs(self.disk.path, exist_ok=True)
+            largest = shutil.disk_usage(self.disk.path).total - self.disk.min_free
+        except OSError as e:
+            logger.warning("Failed to check scratch disk size: %s", e)
+            return self.disk.max_bytes or None
+        return min(largest, self.disk.max_bytes) if self.disk.max_bytes else largest
+
+    def fits(self, size: int) -> bool:
+        """Check whether a job of `size` bytes could ever get its reservation on disk"""
+        largest = self.max_job_size()
+        return largest is None or size <= largest
+
+    def available(self) -> int:
+        """Get the disk bytes new jobs may reserve"""
+        try:
+            return self.disk.available()
+        except OSError as e:
+            logger.warning("Failed to check scratch space: %s", e)
+            return 0
+
+    def acquire(self, job_id: int, size: int) -> ScratchDir:
+        """
+        Reserve space and create a directory for a job
+
+        Args:
+            job_id: Job the directory belongs to
+            size: Bytes to reserve
+
+        Returns:
+            ScratchDir: Locked job directory, pass it to release() when done
+
+        Raises:
+            ScratchSpaceError: If no root has room for the reservation now
+        """
+        for root in self._roots(size):
+            try:
+                with _RootLock(root):
+                    if root.available() < size:
+                        continue
+                    path = os.path.join(root.path, f"job-{job_id}-{uuid.uuid4().hex[:8]}")
+                    os.makedirs(path)
+                    fd = os.open(os.path.join(path, OWNER_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+                    # Held until release; the kernel drops it if the process dies
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    os.write(fd, json.dumps({
+                        "job_id": job_id,
+                        "reserved": size,
+                        "host": socket.gethostname(),
+                        "pid": os.getpid()
+                    }).encode())
+                    logger.info("Reserved %s bytes of scratch space for job %s in %s", size, job_id, path)
+                    return ScratchDir(path, size, fd)
+            except OSError as e:
+                logger.warning("Scratch root %s unusable: %s", root.path, e)
+        raise ScratchSpaceError(f"No scratch space for {size} bytes of job {job_id}")
+
+    def release(self, scratch_dir: ScratchDir):
+        """Remove a job directory with its files and drop the reservation"""
+        shutil.rmtree(scratch_dir.path, ignore_errors=True)
+        try:
+            os.close(scratch_dir.lock_fd)
+        except OSError:
+            pass
+        logger.info("Scratch directory removed: %s", scratch_dir.path)
+
+    def sweep(self) -> int:
+        """
+        Remove job directories whose process is gone
+
+        A live job keeps its owner file locked, so any directory whose lock
+        can be taken belongs to a crashed or killed process. Safe to run while
+        other processes are working in the same root.
+
+        Returns:
+            int: Bytes freed
+        """
+        freed = 0
+        roots = [root for root in (self.tmpfs, self.disk) if root is not None]
+        for root in roots:
+            try:
+                with _RootLock(root):
+                    for entry in os.scandir(root.path):
+                        if entry.name == LOCK_FILE:
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self._is_orphan(entry.path):
+                                continue
+                            size = directory_usage(entry.path)
+                            shutil.rmtree(entry.path, ignore_errors=True)
+                        else:
+                            size = entry.stat(follow_symlinks=False).st_blocks * 512
+                            os.remove(entry.path)
+                        freed += size
+                        logger.info("Removed orphaned scratch entry %s (%s bytes)", entry.path, size)
+            except OSError as e:
+                logger.warning("Failed to sweep scratch root %s: %s", root.path, e)
+
+        for path in glob.glob(LEGACY_PATTERN):
+            try:
+                freed += os.stat(path).st_blocks * 512
+                os.remove(path)
+                logger.info("Removed leftover temporary file %s", path)
+            except OSError as e:
+                logger.warning("Failed to remove leftover temporary file %s: %s", path, e)
+        return freed
+
+    @staticmethod
+    def _is_orphan(path: str) -> bool:
+        """Check whether no live process holds the directory's owner lock"""
+        try:
+            fd = os.open(os.path.join(path, OWNER_FILE), os.O_RDONLY)
+        except FileNotFoundError:
+            # Creation is serialized with sweeps, so this is a half-created directory
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+        finally:
+            os.close(fd)
+
+
+scratch_space = ScratchSpace()
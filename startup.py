@@ -0,0 +1,127 @@
+"""
+Startup profiling and lazily initialized components
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class StartupProfile:
+    def __init__(self):
+        """
+        Timings of the startup: phases (imports, component initialization,
+        warm-up) and milestones measured from the creation of the profile
+        """
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.milestones: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the block as a phase"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = time.perf_counter() - started
+
+    def mark(self, name: str):
+        """Record the time elapsed since the start as a milestone"""
+        with self._lock:
+            self.milestones.setdefault(name, time.perf_counter() - self.started)
+
+    def to_dict(self) -> dict:
+        """Phases and milestones in milliseconds"""
+        with self._lock:
+            return {
+                "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+                "milestones_ms": {name: round(seconds * 1000, 1) for name, seconds in self.milestones.items()},
+            }
+
+    def log(self):
+        """Log the profile in one line"""
+        profile = self.to_dict()
+        logger.info(
+            "Startup profile: %s; phases: %s",
+            ", ".join(f"{name} at {ms} ms" for name, ms in profile["milestones_ms"].items()),
+            ", ".join(f"{name} {ms} ms" for name, ms in profile["phases_ms"].items())
+        )
+
+
+# Created by the first import, which entry points do before anything heavy
+startup_profile = StartupProfile()
+
+
+class Lazy(Generic[T]):
+    def __init__(self, name: str, factory: Callable[[], T]):
+        """
+        Proxy creating a component on first attribute access
+
+        The component is created once, by whichever thread gets to it first:
+        normally the background warm-up, or a request arriving before it.
+        Coroutines await resolve() before touching the component, so the event
+        loop never runs the factory or waits for another thread running it.
+
+        Args:
+            name: Component name used in the startup profile
+            factory: Creates the component
+        """
+        self._lazy_name = name
+        self._lazy_factory = factory
+        self._lazy_instance = None
+        self._lazy_lock = threading.Lock()
+
+    @property
+    def initialized(self) -> bool:
+        """Whether the component has been created"""
+        return self._lazy_instance is not None
+
+    def _lazy_resolve(self) -> T:
+        if self._lazy_instance is None:
+            with self._lazy_lock:
+                if self._lazy_instance is None:
+                    with startup_profile.phase(f"init {self._lazy_name}"):
+                        self._lazy_instance = self._lazy_factory()
+        return self._lazy_instance
+
+    async def resolve(self) -> T:
+        """Get the component, creating it in a worker thread if it doesn't exist yet"""
+        if self._lazy_instance is None:
+            await asyncio.to_thread(self._lazy_resolve)
+        return self._lazy_instance
+
+    def __getattr__(self, name: str):
+        # Only called for attributes the proxy itself doesn't have
+        return getattr(self._lazy_resolve(), name)
+
+
+def initialize(component) -> None:
+    """Create a Lazy component now; other objects are left as they are"""
+    if isinstance(component, Lazy):
+        component._lazy_resolve()
+
+
+def requires(*components) -> Callable[[Callable[..., Awaitable]], Callable[..., Awaitable]]:
+    """
+    Decorate a coroutine function using Lazy components: they are created off
+    the event loop before it runs (right away once the warm-up has made them)
+    """
+    lazy = [component for component in components if isinstance(component, Lazy)]
+
+    def decorator(func: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            await asyncio.gather(*(component.resolve() for component in lazy))
+            return await func(*args, **kwargs)
+        return wrapper
+    return decorator
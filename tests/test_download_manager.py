@@ -0,0 +1,119 @@
+"""
+Ranged and resumable fetches of the download manager
+"""
+import asyncio
+from typing import Optional
+import httpx
+import pytest
+import download_manager
+from download_manager import DownloadError, DownloadManager
+
+CHUNK = 16 * 1024
+DATA = bytes(range(256)) * 1024  # 256 KB
+
+
+class BrokenStream(httpx.AsyncByteStream):
+    """Response body that drops the connection after `data`"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.data
+        raise httpx.ReadError("connection reset")
+
+
+class FakeServer:
+    def __init__(self, ranges: bool = True, fail_after: Optional[int] = None, body: bytes = DATA):
+        """
+        Bot API stand-in serving `body` as the only file
+
+        Args:
+            ranges: Answer Range requests with 206; False sends the whole file with 200
+            fail_after: Drop the connection of the first file request after this many bytes
+            body: File contents
+        """
+        self.ranges = ranges
+        self.fail_after = fail_after
+        self.body = body
+        self.requests: list[Optional[str]] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/getFile"):
+            return httpx.Response(200, json={"ok": True, "result": {"file_path": "videos/file.mp4"}})
+
+        range_header = request.headers.get("Range")
+        self.requests.append(range_header)
+        status, headers, body = 200, {}, self.body
+        if range_header and self.ranges:
+            first, _, last = range_header.removeprefix("bytes=").partition("-")
+            start, end = int(first), int(last) if last else len(self.body) - 1
+            status, body = 206, self.body[start:end + 1]
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(self.body)}"
+
+        if self.fail_after is not None:
+            fail_after, self.fail_after = self.fail_after, None
+            return httpx.Response(status, headers=headers, stream=BrokenStream(body[:fail_after]))
+        return httpx.Response(status, headers=headers, content=body)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    async def sleep(delay):
+        pass
+    monkeypatch.setattr(download_manager.asyncio, "sleep", sleep)
+
+
+def download(server: FakeServer, tmp_path, **options) -> bytes:
+    """Download the server's file with a manager using `options` and return what was written"""
+    manager = DownloadManager(bot_token="TOKEN", api_url="http://api.test", chunk_size=CHUNK, **options)
+    output = tmp_path / "video.mp4"
+
+    async def run():
+        manager._client = httpx.AsyncClient(transport=httpx.MockTransport(server))
+        try:
+            await manager.download("file-id", len(DATA), str(output))
+        finally:
+            await manager.close()
+
+    asyncio.run(run())
+    return output.read_bytes()
+
+
+def test_parallel_ranges(tmp_path):
+    server = FakeServer()
+
+    assert download(server, tmp_path, parallel_parts=4, parallel_min_size=0) == DATA
+    part = len(DATA) // 4
+    assert server.requests[0] == "bytes=0-0"
+    assert sorted(server.requests[1:]) == sorted(
+        f"bytes={start}-{start + part - 1}" for start in range(0, len(DATA), part)
+    )
+
+
+def test_single_stream_without_range_support(tmp_path):
+    server = FakeServer(ranges=False)
+
+    assert download(server, tmp_path, parallel_parts=4, parallel_min_size=0) == DATA
+    assert server.requests == ["bytes=0-0", None]
+
+
+def test_resume_after_transport_error(tmp_path):
+    server = FakeServer(fail_after=4 * CHUNK)
+
+    assert download(server, tmp_path, parallel_parts=1) == DATA
+    assert server.requests == [None, f"bytes={4 * CHUNK}-"]
+
+
+def test_restart_when_range_ignored(tmp_path):
+    server = FakeServer(ranges=False, fail_after=4 * CHUNK)
+
+    assert download(server, tmp_path, parallel_parts=1) == DATA
+    assert server.requests == [None, f"bytes={4 * CHUNK}-"]
+
+
+def test_short_file_fails(tmp_path):
+    server = FakeServer(body=DATA[:-100])
+
+    with pytest.raises(DownloadError):
+        download(server, tmp_path, parallel_parts=1)
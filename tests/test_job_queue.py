@@ -0,0 +1,113 @@
+"""
+Claims of the job queue
+"""
+import time
+import pytest
+from job_queue import JobQueue, JOB_FAILED, JOB_QUEUED
+from config import JOB_MAX_DEFER
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def enqueue(queue: JobQueue, user_id: int, size: int = MB, weight: float = 1.0) -> int:
+    return queue.enqueue(user_id, user_id, "analyze", {}, size=size, weight=weight)
+
+
+def defer(queue: JobQueue, job_id: int, seconds: float):
+    """Make a queued job look like it has been waiting for `seconds`"""
+    with queue._connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET available_at = ? WHERE id = ? AND status = ?",
+            (time.time() - seconds, job_id, JOB_QUEUED)
+        )
+
+
+def test_users_take_turns(queue):
+    first = [enqueue(queue, 1) for _ in range(3)]
+    other = enqueue(queue, 2)
+
+    claimed = [queue.claim(f"w{i}", max_inflight_bytes=0)["id"] for i in range(4)]
+
+    assert claimed == [first[0], other, first[1], first[2]]
+    assert queue.claim("w4", max_inflight_bytes=0) is None
+
+
+def test_weight_gives_a_larger_share(queue):
+    light = [enqueue(queue, 1) for _ in range(2)]
+    heavy = [enqueue(queue, 2, weight=2.0) for _ in range(3)]
+
+    claimed = [queue.claim(f"w{i}", max_inflight_bytes=0)["id"] for i in range(5)]
+
+    assert claimed == [heavy[0], light[0], heavy[1], heavy[2], light[1]]
+
+
+def test_small_job_overtakes_one_over_budget(queue):
+    running = enqueue(queue, 1, size=60 * MB)
+    assert queue.claim("w0", max_inflight_bytes=100 * MB)["id"] == running
+    large = enqueue(queue, 2, size=50 * MB)
+    small = enqueue(queue, 3, size=10 * MB)
+
+    assert queue.claim("w1", max_inflight_bytes=100 * MB)["id"] == small
+    assert queue.claim("w2", max_inflight_bytes=100 * MB) is None
+
+    queue.complete(running, "w0")
+    assert queue.claim("w3", max_inflight_bytes=100 * MB)["id"] == large
+
+
+def test_free_disk_caps_jobs_while_others_run(queue):
+    running = enqueue(queue, 1, size=10 * MB)
+    assert queue.claim("w0", free_disk=100 * MB)["id"] == running
+    large = enqueue(queue, 2, size=50 * MB)
+
+    assert queue.claim("w1", free_disk=40 * MB) is None
+    assert queue.claim("w1", free_disk=60 * MB)["id"] == large
+
+
+def test_deferred_job_blocks_later_jobs_while_others_run(queue):
+    running = enqueue(queue, 1, size=10 * MB)
+    assert queue.claim("w0", free_disk=100 * MB)["id"] == running
+    large = enqueue(queue, 2, size=50 * MB)
+    enqueue(queue, 3, size=MB)
+    defer(queue, large, JOB_MAX_DEFER + 1)
+
+    assert queue.claim("w1", free_disk=20 * MB) is None
+
+
+def test_nothing_running_claims_job_larger_than_free_disk(queue):
+    # Regression: with an idle queue the free-disk cap used to defer the head
+    # forever and, after JOB_MAX_DEFER, block every job behind it
+    large = enqueue(queue, 1, size=50 * MB)
+    small = enqueue(queue, 2, size=MB)
+    defer(queue, large, JOB_MAX_DEFER + 1)
+    defer(queue, small, JOB_MAX_DEFER + 1)
+
+    assert queue.claim("w0", free_disk=10 * MB)["id"] == large
+    assert queue.claim("w1", free_disk=10 * MB)["id"] == small
+
+
+def test_job_that_can_never_fit_is_claimed_to_fail(queue):
+    running = enqueue(queue, 1, size=10 * MB)
+    assert queue.claim("w0", free_disk=100 * MB, max_job_size=100 * MB)["id"] == running
+    oversized = enqueue(queue, 2, size=500 * MB)
+
+    job = queue.claim("w1", free_disk=20 * MB, max_job_size=100 * MB)
+
+    assert job["id"] == oversized
+
+
+def test_expired_last_attempt_is_returned_failed(queue):
+    job_id = queue.enqueue(1, 1, "analyze", {}, status_message_id=7, max_attempts=1)
+    # The worker dies right after the claim: its lease runs out
+    assert queue.claim("w0", lease_seconds=0)["id"] == job_id
+
+    job = queue.claim("w1")
+
+    assert job["id"] == job_id
+    assert job["status"] == JOB_FAILED
+    assert job["status_message_id"] == 7
+    assert queue.claim("w2") is None
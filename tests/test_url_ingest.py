@@ -0,0 +1,86 @@
+"""
+Public host checks of links
+"""
+import asyncio
+import socket
+import pytest
+from url_ingest import IngestError, check_url, is_public_address
+
+# Answers of the stubbed resolver; DNS isn't reachable from the tests
+HOSTS = {
+    "video.example": ["93.184.216.34", "2606:2800:220:1:248:1893:25c8:1946"],
+    "internal.example": ["10.1.2.3"],
+    "localhost.example": ["127.0.0.1"],
+    "metadata.example": ["169.254.169.254"],
+    "mapped.example": ["::ffff:127.0.0.1"],
+    "mixed.example": ["93.184.216.34", "192.168.0.10"],
+}
+
+
+@pytest.fixture(autouse=True)
+def resolver(monkeypatch):
+    async def getaddrinfo(self, host, port, *args, **kwargs):
+        if host not in HOSTS:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [
+            (socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM,
+             socket.IPPROTO_TCP, "", (address, port))
+            for address in HOSTS[host]
+        ]
+    monkeypatch.setattr(asyncio.BaseEventLoop, "getaddrinfo", getaddrinfo)
+
+
+@pytest.mark.parametrize("address", [
+    "8.8.8.8",
+    "2001:4860:4860::8888",
+    "::ffff:8.8.8.8",
+])
+def test_public_addresses(address):
+    assert is_public_address(address)
+
+
+@pytest.mark.parametrize("address", [
+    "10.0.0.1",
+    "172.16.5.4",
+    "192.168.1.1",
+    "fd00::1",
+    "127.0.0.1",
+    "::1",
+    "169.254.169.254",
+    "fe80::1%eth0",
+    "::ffff:127.0.0.1",
+    "::ffff:10.0.0.1",
+    "::ffff:169.254.169.254",
+    "100.64.0.1",
+    "224.0.0.1",
+    "0.0.0.0",
+])
+def test_non_public_addresses(address):
+    assert not is_public_address(address)
+
+
+def test_public_host_passes():
+    asyncio.run(check_url("https://video.example/watch?v=1"))
+
+
+@pytest.mark.parametrize("url", [
+    "http://internal.example/video.mp4",
+    "http://localhost.example:8080/",
+    "http://metadata.example/latest/meta-data/",
+    "https://mapped.example/",
+    "https://mixed.example/watch",
+])
+def test_non_public_host_is_rejected(url):
+    with pytest.raises(IngestError):
+        asyncio.run(check_url(url))
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://video.example/video.mp4",
+    "file:///etc/passwd",
+    "http://video.example:99999/",
+    "https://unknown.example/",
+])
+def test_invalid_link_is_rejected(url):
+    with pytest.raises(IngestError):
+        asyncio.run(check_url(url))
@@ -0,0 +1,514 @@
+"""
+Preset-driven transcoding engine
+"""
+import asyncio
+import logging
+import os
+import re
+import shutil
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+from config import (
+    FFMPEG_TIMEOUT, TRANSCODE_THREADS, TARGET_SIZE_TOLERANCE, TARGET_SIZE_RETRIES,
+    SEGMENT_MIN_DURATION, SEGMENT_DURATION, SEGMENT_THREADS
+)
+from media_executor import MediaExecutor, QueuePositionCallback
+from metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+# Codecs Telegram clients play inline from an MP4 container
+COPY_VIDEO_CODECS = {"h264"}
+COPY_PIX_FMTS = {"yuv420p", "yuvj420p"}
+COPY_AUDIO_CODECS = {"aac", "mp3", None}
+
+# -benchmark makes ffmpeg report its own CPU time, which stays accurate
+# when several encodes run in parallel
+FFMPEG_BASE = ["ffmpeg", "-y", "-hide_banner", "-nostats", "-loglevel", "info", "-benchmark"]
+BENCH_PATTERN = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s")
+
+CONTAINER_OVERHEAD = 0.02  # share of the output taken by the MP4 container
+MIN_VIDEO_BITRATE = 100_000  # bit/s; below this the output isn't watchable
+MIN_SEGMENT_SECONDS = 5  # shorter chunks cost more in process startup than they gain
+
+# Called with the running stage ("copy", "encode", "pass1", "pass2") and its completed fraction
+TranscodeProgressCallback = Callable[[str, float], None]
+
+
+class TranscodeError(Exception):
+    """Transcoding failure; the message is shown to the user"""
+
+
+@dataclass(frozen=True)
+class TranscodeProfile:
+    name: str
+    description: str
+    preset: str
+    crf: int
+    audio_bitrate: str
+    max_height: Optional[int] = None
+    # 0 lets ffmpeg pick the thread count
+    threads: int = TRANSCODE_THREADS
+    # Remux with -c copy when the source already fits the profile
+    allow_copy: bool = True
+    # Encode timeout = max(FFMPEG_TIMEOUT, video duration * timeout_factor)
+    timeout_factor: float = 2.0
+
+
+PROFILES = {
+    profile.name: profile for profile in (
+        TranscodeProfile(
+            "telegram-fast", "Быстро, до 720p, для отправки в Telegram",
+            preset="veryfast", crf=26, audio_bitrate="128k", max_height=720, timeout_factor=1.0
+        ),
+        TranscodeProfile(
+            "small", "Минимальный размер, до 480p",
+            preset="medium", crf=30, audio_bitrate="96k", max_height=480, timeout_factor=2.0
+        ),
+        TranscodeProfile(
+            "archive", "Высокое качество, исходное разрешение",
+            preset="slow", crf=20, audio_bitrate="192k", allow_copy=False, timeout_factor=6.0
+        ),
+    )
+}
+DEFAULT_PROFILE = "telegram-fast"
+
+
+class Transcoder:
+    def __init__(self, executor: MediaExecutor):
+        """Initialize transcoder"""
+        self.executor = executor
+
+    @staticmethod
+    def get_profile(name: str) -> TranscodeProfile:
+        """
+        Get a profile by name
+
+        Raises:
+            TranscodeError: If the profile doesn't exist
+        """
+        try:
+            return PROFILES[name]
+        except KeyError:
+            raise TranscodeError(
+                f"❌ Неизвестный профиль: {name}\n"
+                f"Доступные профили: {', '.join(PROFILES)}"
+            )
+
+    @staticmethod
+    def can_stream_copy(metadata: dict, profile: TranscodeProfile) -> bool:
+        """Check whether the source streams can be remuxed without re-encoding"""
+        if not profile.allow_copy:
+            return False
+        if metadata.get("video_codec") not in COPY_VIDEO_CODECS:
+            return False
+        if metadata.get("pix_fmt") not in COPY_PIX_FMTS:
+            return False
+        if metadata.get("audio_codec") not in COPY_AUDIO_CODECS:
+            return False
+        height = metadata.get("height") or 0
+        return profile.max_height is None or 0 < height <= profile.max_height
+
+    def build_encode_command(
+        self,
+        input_path: str,
+        output_path: str,
+        profile: TranscodeProfile,
+        video_bitrate: Optional[int] = None,
+        pass_number: Optional[int] = None,
+        passlogfile: Optional[str] = None,
+        audio: bool = True,
+        threads: Optional[int] = None
+    ) -> list[str]:
+        """
+        Build the ffmpeg command encoding with a profile
+
+        Args:
+            input_path: Source video
+            output_path: Destination MP4 (ignored by the first pass)
+            profile: Encoding profile
+            video_bitrate: Target video bitrate in bit/s; CRF of the profile if None
+            pass_number: 1 or 2 for a two-pass encode
+            passlogfile: Prefix of the two-pass statistics files
+            audio: Encode the audio track; False writes a bare video stream
+            threads: Encoder threads, the profile's setting if None
+        """
+        cmd = FFMPEG_BASE + ["-i", input_path, "-map", "0:v:0"]
+        if audio:
+            cmd += ["-map", "0:a:0?"]
+        cmd += [
+            "-c:v", "libx264",
+            "-preset", profile.preset,
+            "-pix_fmt", "yuv420p",
+            "-threads", str(profile.threads if threads is None else threads),
+        ]
+        if video_bitrate is None:
+            cmd += ["-crf", str(profile.crf)]
+        else:
+            # Cap peaks so the average bitrate is kept over short windows too
+            cmd += [
+                "-b:v", str(video_bitrate),
+                "-maxrate", str(int(video_bitrate * 1.5)),
+                "-bufsize", str(video_bitrate * 2)
+            ]
+        if pass_number is not None:
+            cmd += ["-pass", str(pass_number), "-passlogfile", passlogfile]
+        if profile.max_height:
+            # Downscale only; -2 keeps the width even as libx264 requires
+            cmd += ["-vf", f"scale=-2:'min(ih,{profile.max_height})'"]
+
+        if pass_number == 1:
+            # The analysis pass only needs video statistics
+            return cmd + ["-an", "-f", "null", os.devnull]
+        if not audio:
+            return cmd + ["-an", output_path]
+        return cmd + [
+            "-c:a", "aac", "-b:a", profile.audio_bitrate,
+            "-movflags", "+faststart",
+            output_path
+        ]
+
+    @staticmethod
+    def build_copy_command(input_path: str, output_path: str) -> list[str]:
+        """Build the ffmpeg command remuxing without re-encoding"""
+        return FFMPEG_BASE + [
+            "-i", input_path,
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-c", "copy",
+            "-movflags", "+faststart",
+            output_path
+        ]
+
+    @staticmethod
+    def compute_video_bitrate(duration: float, target_size: int, audio_bitrate: str) -> int:
+        """
+        Compute the video bitrate that makes the output land on target_size
+
+        Args:
+            duration: Video duration in seconds
+            target_size: Desired output size in bytes
+            audio_bitrate: Audio bitrate of the profile, e.g. "128k"
+
+        Returns:
+            int: Video bitrate in bit/s
+        """
+        audio_bps = int(audio_bitrate.rstrip("k")) * 1000
+        # Reserve room for the MP4 container overhead
+        total_bps = target_size * 8 * (1 - CONTAINER_OVERHEAD) / duration
+        return int(total_bps - audio_bps)
+
+    def can_segment(self, duration: float) -> bool:
+        """Check whether a video is long enough to be encoded in parallel chunks"""
+        return (
+            SEGMENT_MIN_DURATION > 0
+            and duration >= SEGMENT_MIN_DURATION
+            and self.executor.max_workers > 1
+        )
+
+    async def _run_ffmpeg(
+        self,
+        cmd: list[str],
+        timeout: float,
+        stats: dict,
+        on_position: Optional[QueuePositionCallback] = None,
+        on_time: Optional[Callable[[float], None]] = None
+    ) -> subprocess.CompletedProcess:
+        """
+        Run ffmpeg in an executor slot and add its CPU time (reported by -benchmark) to stats.
+        With `on_time`, ffmpeg writes -progress reports to stdout and the callback
+        receives the output timestamp in seconds as the encode advances.
+        """
+        def on_line(line: str):
+            key, _, value = line.partition("=")
+            # out_time_ms is in microseconds as well; older builds only have that one
+            if key in ("out_time_us", "out_time_ms") and value.isdigit():
+                on_time(int(value) / 1_000_000)
+
+        if on_time is not None:
+            cmd = cmd[:1] + ["-progress", "pipe:1"] + cmd[1:]
+        try:
+            result = await self.executor.run(
+                cmd, timeout=timeout, on_position=on_position,
+                on_stdout_line=on_line if on_time is not None else None
+            )
+        except subprocess.TimeoutExpired:
+            raise TranscodeError("❌ Превышено время ожидания при сжатии видео")
+
+        stats["passes"] += 1
+        bench = BENCH_PATTERN.search(result.stderr)
+        if bench:
+            stats["cpu_seconds"] += float(bench.group(1)) + float(bench.group(2))
+        return result
+
+    async def transcode(
+        self,
+        input_path: str,
+        output_path: str,
+        metadata: dict,
+        profile_name: str = DEFAULT_PROFILE,
+        target_size: Optional[int] = None,
+        exact_size: bool = False,
+        on_position: Optional[QueuePositionCallback] = None,
+        on_progress: Optional[TranscodeProgressCallback] = None
+    ) -> dict:
+        """
+        Transcode a video choosing the cheapest path that meets the target size:
+        stream copy if the source already fits, then a CRF encode with the
+        profile (split into chunks encoded in parallel for long videos), then
+        a two-pass encode at the bitrate computed for the target.
+
+        Every ffmpeg run takes its own executor slot, so the caller must not
+        hold one: the chunks of a segmented encode would wait for it forever.
+
+        Args:
+            input_path: Source video
+            output_path: Destination MP4
+            metadata: Source metadata from VideoProcessor.get_video_metadata
+            profile_name: Requested profile
+            target_size: Maximum output size in bytes, None for no limit
+            exact_size: Go straight to the two-pass encode (the user asked
+                for a specific size rather than just an upper limit)
+            on_position: Optional callback receiving the executor queue position
+            on_progress: Optional callback receiving the stage and its progress
+
+        Returns:
+            dict: method ("copy"/"crf"/"segmented"/"two-pass"), profile, output_size,
+                passes, cpu_seconds and elapsed seconds
+
+        Raises:
+            TranscodeError: If no path produced an output within the target size
+        """
+        profile = self.get_profile(profile_name)
+        input_size = os.path.getsize(input_path)
+        try:
+            duration = float(metadata.get("duration", 0))
+        except ValueError:
+            duration = 0.0
+        encode_timeout = max(FFMPEG_TIMEOUT, duration * profile.timeout_factor)
+
+        started = time.monotonic()
+        stats = {"passes": 0, "cpu_seconds": 0.0}
+
+        def track(stage: str) -> Optional[Callable[[float], None]]:
+            if on_progress is None or duration <= 0:
+                return None
+            return lambda seconds: on_progress(stage, min(seconds / duration, 1.0))
+
+        def done(method: str) -> dict:
+            output_size = os.path.getsize(output_path)
+            elapsed = time.monotonic() - started
+            logger.info(
+                "Transcoded %s via %s (%s): %s -> %s bytes, %s passes, %.1f CPU s in %.1fs",
+                input_path, method, profile.name, input_size, output_size,
+                stats['passes'], stats['cpu_seconds'], elapsed
+            )
+            return {
+                "method": method,
+                "profile": profile.name,
+                "output_size": output_size,
+                "elapsed": elapsed,
+                **stats
+            }
+
+        with track_stage("compress"):
+            if self.can_stream_copy(metadata, profile) and (target_size is None or input_size <= target_size):
+                result = await self._run_ffmpeg(
+                    self.build_copy_command(input_path, output_path), FFMPEG_TIMEOUT, stats, on_position,
+                    track("copy")
+                )
+                if result.returncode == 0:
+                    return done("copy")
+                logger.warning("Stream copy failed, encoding instead: %s", result.stderr[-500:])
+
+            if not exact_size:
+                if self.can_segment(duration):
+                    method = "segmented"
+                    await self._encode_segmented(
+                        input_path, output_path, profile, metadata, duration, stats, on_position,
+                        on_progress
+                    )
+                else:
+                    method = "crf"
+                    result = await self._run_ffmpeg(
+                        self.build_encode_command(input_path, output_path, profile),
+                        encode_timeout, stats, on_position, track("encode")
+                    )
+                    if result.returncode != 0:
+                        logger.warning("ffmpeg with profile %s failed: %s", profile.name, result.stderr[-500:])
+                        raise TranscodeError("❌ Не удалось сжать видео")
+                if target_size is None or os.path.getsize(output_path) <= target_size:
+                    return done(method)
+
+            if duration <= 0:
+                raise TranscodeError("❌ Не удалось определить длительность видео")
+            await self._encode_two_pass(
+                input_path, output_path, profile, duration, target_size, encode_timeout, stats, on_position,
+                track
+            )
+            return done("two-pass")
+
+    async def _encode_segmented(
+        self,
+        input_path: str,
+        output_path: str,
+        profile: TranscodeProfile,
+        metadata: dict,
+        duration: float,
+        stats: dict,
+        on_position: Optional[QueuePositionCallback] = None,
+        on_progress: Optional[TranscodeProgressCallback] = None
+    ):
+        """
+        Encode a long video as chunks running in parallel executor slots.
+
+        The video stream is split without re-encoding, so every chunk starts
+        on a source keyframe and the encoded chunks join without seams. Audio
+        is encoded once over the whole file instead of per chunk, which keeps
+        it in sync and avoids AAC priming gaps at chunk boundaries.
+        """
+        work_dir = f"{output_path}.segments"
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            # At least two chunks per slot, so a slow chunk doesn't leave the others idle
+            segment_time = max(
+                MIN_SEGMENT_SECONDS, min(SEGMENT_DURATION, duration / (self.executor.max_workers * 2))
+            )
+            # Cuts only happen on keyframes, so shorter chunks than the GOP aren't possible
+            segment_time = max(segment_time, metadata.get("keyframe_interval") or 0)
+            result = await self._run_ffmpeg(FFMPEG_BASE + [
+                "-i", input_path,
+                "-map", "0:v:0", "-c", "copy",
+                "-f", "segment", "-segment_time", f"{segment_time:.3f}",
+                "-reset_timestamps", "1",
+                os.path.join(work_dir, "source_%05d.mkv")
+            ], FFMPEG_TIMEOUT, stats, on_position)
+            if result.returncode != 0:
+                logger.warning("Splitting %s failed: %s", input_path, result.stderr[-500:])
+                raise TranscodeError("❌ Не удалось сжать видео")
+
+            sources = sorted(name for name in os.listdir(work_dir) if name.startswith("source_"))
+            chunks = [os.path.join(work_dir, f"chunk_{index:05d}.mp4") for index in range(len(sources))]
+            chunk_timeout = max(FFMPEG_TIMEOUT, segment_time * profile.timeout_factor * 4)
+            commands = [
+                self.build_encode_command(
+                    os.path.join(work_dir, source), chunk, profile, audio=False, threads=SEGMENT_THREADS
+                )
+                for source, chunk in zip(sources, chunks)
+            ]
+            audio_path = None
+            if metadata.get("audio_codec"):
+                audio_path = os.path.join(work_dir, "audio.m4a")
+                commands.append(FFMPEG_BASE + [
+                    "-i", input_path, "-map", "0:a:0", "-vn",
+                    "-c:a", "aac", "-b:a", profile.audio_bitrate, audio_path
+                ])
+            logger.info("Encoding %s as %s chunks of ~%.0fs", input_path, len(sources), segment_time)
+
+            # Progress of the whole encode is the sum of the chunks' output timestamps
+            positions = [0.0] * len(sources)
+
+            def track_chunk(index: int) -> Optional[Callable[[float], None]]:
+                if on_progress is None:
+                    return None
+
+                def on_time(seconds: float):
+                    positions[index] = seconds
+                    on_progress("encode", min(sum(positions) / duration, 1.0))
+                return on_time
+
+            # At most one encode per executor slot is in flight, so a long video
+            # doesn't queue all its chunks ahead of every other job
+            in_flight = asyncio.Semaphore(self.executor.max_workers)
+
+            async def encode(index: int, cmd: list[str]) -> subprocess.CompletedProcess:
+                async with in_flight:
+                    return await self._run_ffmpeg(
+                        cmd, chunk_timeout, stats, on_position,
+                        track_chunk(index) if index < len(sources) else None
+                    )
+
+            tasks = [asyncio.create_task(encode(index, cmd)) for index, cmd in enumerate(commands)]
+            try:
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            failed = [result for result in results if result.returncode != 0]
+            if failed:
+                logger.warning("%s chunks of %s failed: %s", len(failed), input_path, failed[0].stderr[-500:])
+                raise TranscodeError("❌ Не удалось сжать видео")
+
+            # The concat demuxer joins the chunks by stream copy
+            list_path = os.path.join(work_dir, "chunks.txt")
+            with open(list_path, "w") as f:
+                f.writelines(f"file '{os.path.basename(chunk)}'\n" for chunk in chunks)
+            cmd = FFMPEG_BASE + ["-f", "concat", "-safe", "0", "-i", list_path]
+            if audio_path:
+                cmd += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0"]
+            cmd += ["-c", "copy", "-movflags", "+faststart", output_path]
+            result = await self._run_ffmpeg(cmd, FFMPEG_TIMEOUT, stats, on_position)
+            if result.returncode != 0:
+                logger.warning("Joining chunks of %s failed: %s", input_path, result.stderr[-500:])
+                raise TranscodeError("❌ Не удалось сжать видео")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def _encode_two_pass(
+        self,
+        input_path: str,
+        output_path: str,
+        profile: TranscodeProfile,
+        duration: float,
+        target_size: int,
+        timeout: float,
+        stats: dict,
+        on_position: Optional[QueuePositionCallback] = None,
+        track: Callable[[str], Optional[Callable[[float], None]]] = lambda stage: None
+    ):
+        """
+        Encode to a target size with an analysis pass and a bitrate-controlled pass.
+        `track` maps a stage name to the progress callback of its ffmpeg run.
+        """
+        bitrate = self.compute_video_bitrate(duration, target_size, profile.audio_bitrate)
+        if bitrate < MIN_VIDEO_BITRATE:
+            raise TranscodeError("❌ Видео слишком длинное, чтобы уложиться в этот размер")
+
+        passlogfile = f"{output_path}.2pass"
+        try:
+            result = await self._run_ffmpeg(
+                self.build_encode_command(input_path, output_path, profile, bitrate, 1, passlogfile),
+                timeout, stats, on_position, track("pass1")
+            )
+            if result.returncode != 0:
+                logger.warning("Two-pass analysis failed: %s", result.stderr[-500:])
+                raise TranscodeError("❌ Не удалось сжать видео")
+
+            # The second pass reuses the statistics; a retry only adjusts the bitrate
+            for _ in range(1 + TARGET_SIZE_RETRIES):
+                result = await self._run_ffmpeg(
+                    self.build_encode_command(input_path, output_path, profile, bitrate, 2, passlogfile),
+                    timeout, stats, on_position, track("pass2")
+                )
+                if result.returncode != 0:
+                    logger.warning("Two-pass encode failed: %s", result.stderr[-500:])
+                    raise TranscodeError("❌ Не удалось сжать видео")
+
+                output_size = os.path.getsize(output_path)
+                if output_size <= target_size:
+                    if output_size < target_size * (1 - TARGET_SIZE_TOLERANCE):
+                        logger.info("Two-pass output %s bytes is below the tolerance", output_size)
+                    return
+                logger.info("Two-pass output %s bytes exceeds target %s, retrying", output_size, target_size)
+                bitrate = int(bitrate * target_size / output_size * (1 - TARGET_SIZE_TOLERANCE / 2))
+        finally:
+            for suffix in ("-0.log", "-0.log.mbtree"):
+                try:
+                    os.remove(passlogfile + suffix)
+                except FileNotFoundError:
+                    pass
+
+        raise TranscodeError("❌ Не удалось уложиться в допустимый размер файла")
@@ -0,0 +1,326 @@
+"""
+Video ingestion from links with yt-dlp
+"""
+import asyncio
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+import re
+import socket
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+from config import (
+    YTDLP_PATH, YTDLP_CONCURRENT_FRAGMENTS, YTDLP_TIMEOUT, URL_MAX_BYTES, URL_MAX_DURATION,
+    URL_ANALYZE_MIN_HEIGHT, YTDLP_EXTRACTORS
+)
+from metrics import DOWNLOAD_BYTES
+from transcoder import PROFILES, DEFAULT_PROFILE
+from utils import format_file_size, format_duration
+
+logger = logging.getLogger(__name__)
+
+URL_PATTERN = re.compile(r"https?://[^\s<>\"']+", re.IGNORECASE)
+# Marker of the progress lines requested with --progress-template
+PROGRESS_PREFIX = "[progress]"
+PROGRESS_TEMPLATE = (
+    f"download:{PROGRESS_PREFIX} %(progress.downloaded_bytes)s "
+    "%(progress.total_bytes)s %(progress.total_bytes_estimate)s"
+)
+# Seconds allowed for reading the page and the format list
+INFO_TIMEOUT = 120
+
+
+class IngestError(Exception):
+    """Link can't be ingested; the message is shown to the user"""
+
+
+def extract_url(text: Optional[str]) -> Optional[str]:
+    """Get the first http(s) link of a message text"""
+    match = URL_PATTERN.search(text or "")
+    return match.group(0).rstrip(".,;:!?)") if match else None
+
+
+def url_key(url: str) -> str:
+    """Stable stand-in for a Telegram file_unique_id of a linked video"""
+    return "url:" + hashlib.sha256(url.strip().encode()).hexdigest()[:32]
+
+
+def is_public_address(address: str) -> bool:
+    """
+    Whether an IP address is on the public internet
+
+    Loopback, private (RFC 1918, unique local), link-local (including the cloud
+    metadata address 169.254.169.254), shared, multicast and reserved ranges aren't.
+    """
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def check_url(url: str):
+    """
+    Make sure a link points to a public http(s) host before anything fetches it
+
+    Every address the host resolves to is checked, so a name resolving to an
+    internal address is rejected as well.
+
+    This only partly mitigates SSRF: yt-dlp resolves the name again when it
+    connects, so a host whose DNS answer changes between the two lookups
+    (DNS rebinding) gets through, and neither the redirects yt-dlp follows
+    nor the fragment URLs of a manifest are checked. Where internal services
+    must stay unreachable, block them from the bot at the network level.
+
+    Raises:
+        IngestError: If the scheme isn't http(s) or the host isn't public
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        raise IngestError("❌ Некорректная ссылка")
+    if scheme not in ("http", "https") or not parts.hostname:
+        raise IngestError("❌ Поддерживаются только ссылки http и https")
+
+    try:
+        addresses = await asyncio.get_running_loop().getaddrinfo(
+            parts.hostname, port or (443 if scheme == "https" else 80), proto=socket.IPPROTO_TCP
+        )
+    except socket.gaierror:
+        raise IngestError("❌ Не удалось найти видео по ссылке")
+    if not addresses or not all(is_public_address(sockaddr[0]) for *_, sockaddr in addresses):
+        logger.warning("Rejected link to a non-public host: %s", url)
+        raise IngestError("❌ Ссылка ведёт на недоступный адрес")
+
+
+def format_selector(operation: str, profile_name: Optional[str] = None) -> str:
+    """
+    yt-dlp format selection fetching no more than the operation needs
+
+    Analysis only probes the file and takes small thumbnails, so the smallest
+    format that is still URL_ANALYZE_MIN_HEIGHT tall is enough. Compression
+    takes the best format not taller than the profile's output, preferring
+    H.264/AAC, which the transcoder can remux without re-encoding.
+
+    Args:
+        operation: "analyze" or "compress"
+        profile_name: Transcoding profile of a compression
+    """
+    if operation == "analyze":
+        height = URL_ANALYZE_MIN_HEIGHT
+        return f"wv*[height>={height}]+wa/w[height>={height}]/wv*+wa/w"
+
+    profile = PROFILES.get(profile_name or DEFAULT_PROFILE, PROFILES[DEFAULT_PROFILE])
+    if profile.max_height is None:
+        return "bv*[vcodec^=avc1]+ba[acodec^=mp4a]/bv*+ba/b"
+    height = f"[height<={profile.max_height}]"
+    return (
+        f"bv*{height}[vcodec^=avc1]+ba[acodec^=mp4a]/bv*{height}+ba/b{height}"
+        # Nothing small enough: the smallest format, the transcoder scales it down
+        "/wv*+ba/w"
+    )
+
+
+def estimate_size(info: dict) -> Optional[int]:
+    """Expected download size of the selected formats, None if the site doesn't tell"""
+    formats = info.get("requested_formats") or [info]
+    sizes = [fmt.get("filesize") or fmt.get("filesize_approx") for fmt in formats]
+    if not all(sizes):
+        return None
+    return int(sum(sizes))
+
+
+class UrlIngestor:
+    def __init__(
+        self,
+        binary: str = YTDLP_PATH,
+        fragments: int = YTDLP_CONCURRENT_FRAGMENTS,
+        max_bytes: int = URL_MAX_BYTES,
+        max_duration: int = URL_MAX_DURATION,
+        timeout: float = YTDLP_TIMEOUT,
+        extractors: str = YTDLP_EXTRACTORS
+    ):
+        """
+        Initialize URL ingestor
+
+        Args:
+            binary: yt-dlp executable
+            fragments: Fragments of DASH/HLS formats downloaded concurrently
+            max_bytes: Largest download accepted
+            max_duration: Longest video accepted, in seconds
+            timeout: Seconds allowed for a download
+            extractors: yt-dlp extractors allowed to handle links, empty for all
+        """
+        self.binary = binary
+        self.fragments = fragments
+        self.max_bytes = max_bytes
+        self.max_duration = max_duration
+        self.timeout = timeout
+        self.extractors = extractors
+
+    async def download(
+        self,
+        url: str,
+        output_dir: str,
+        operation: str,
+        profile_name: Optional[str] = None,
+        on_progress: Optional[Callable[[int, Optional[int]], None]] = None
+    ) -> dict:
+        """
+        Download a linked video
+
+        The page is read once: the format list is resolved and checked against
+        the limits first, then the download runs from the saved info. The link
+        and the URLs of the selected formats must point to public hosts, as far
+        as check_url can tell before yt-dlp connects.
+
+        Args:
+            url: Video page URL
+            output_dir: Directory the file is written to
+            operation: Pipeline operation the video is for
+            profile_name: Transcoding profile of a compression
+            on_progress: Optional callback receiving the bytes downloaded and
+                the expected total (None if unknown)
+
+        Returns:
+            dict: path, title, duration and size of the downloaded file
+
+        Raises:
+            IngestError: If the link isn't a single video within the limits or
+                the download fails
+        """
+        await check_url(url)
+        selector = format_selector(operation, profile_name)
+        info_path = os.path.join(output_dir, "info.json")
+        extractors = ["--use-extractors", self.extractors] if self.extractors else []
+        returncode, stdout, stderr = await self._run([
+            "--dump-single-json", "--no-playlist", *extractors, "-f", selector, url
+        ], INFO_TIMEOUT)
+        if returncode != 0:
+            logger.warning("yt-dlp could not read %s: %s", url, stderr[-500:])
+            raise IngestError("❌ Не удалось найти видео по ссылке")
+        info = json.loads(stdout)
+
+        if info.get("_type") == "playlist":
+            raise IngestError("❌ Плейлисты не поддерживаются, отправьте ссылку на одно видео")
+        if info.get("is_live"):
+            raise IngestError("❌ Прямые трансляции не поддерживаются")
+        duration = info.get("duration") or 0
+        if duration > self.max_duration:
+            raise IngestError(
+                f"❌ Видео слишком длинное ({format_duration(duration)}). "
+                f"Максимум: {format_duration(self.max_duration)}"
+            )
+        # Media may be served from other hosts than the page
+        for fmt in info.get("requested_formats") or [info]:
+            for key in ("url", "manifest_url"):
+                if fmt.get(key):
+                    await check_url(fmt[key])
+
+        expected = estimate_size(info)
+        if expected is not None and expected > self.max_bytes:
+            raise IngestError(
+                f"❌ Видео по ссылке слишком большое ({format_file_size(expected)}). "
+                f"Максимум: {format_file_size(self.max_bytes)}"
+            )
+        with open(info_path, "w") as f:
+            json.dump(info, f)
+
+        # Merged formats are downloaded one after another, each reporting from zero
+        finished = 0
+        current = 0
+
+        def on_line(line: str):
+            nonlocal finished, current
+            if not line.startswith(PROGRESS_PREFIX) or on_progress is None:
+                return
+            fields = line[len(PROGRESS_PREFIX):].split()
+            if not fields or not fields[0].isdigit():
+                return
+            downloaded = int(fields[0])
+            if downloaded < current:
+                finished += current
+            current = downloaded
+            on_progress(finished + current, expected)
+
+        returncode, stdout, stderr = await self._run([
+            "--load-info-json", info_path,
+            "-f", selector,
+            "-N", str(self.fragments),
+            "--max-filesize", str(self.max_bytes),
+            "--merge-output-format", "mp4/mkv",
+            "--no-mtime",
+            "-o", os.path.join(output_dir, "source.%(ext)s"),
+            "--progress", "--newline", "--progress-template", PROGRESS_TEMPLATE,
+            "--print", "after_move:filepath"
+        ], self.timeout, on_line)
+        paths = [line for line in stdout.splitlines() if line and not line.startswith(PROGRESS_PREFIX)]
+        if returncode != 0 or not paths or not os.path.exists(paths[-1]):
+            logger.warning("yt-dlp download of %s failed (%s): %s", url, returncode, stderr[-500:])
+            if "max-filesize" in stderr or (returncode == 0 and not paths):
+                # The site didn't announce the size; yt-dlp stopped at the limit
+                raise IngestError(
+                    f"❌ Видео по ссылке больше {format_file_size(self.max_bytes)}"
+                )
+            raise IngestError("❌ Не удалось скачать видео по ссылке")
+
+        path = paths[-1]
+        size = os.path.getsize(path)
+        DOWNLOAD_BYTES.inc(size)
+        logger.info("Downloaded %s (%s, %s bytes) to %s", url, info.get('format_id'), size, path)
+        return {
+            "path": path,
+            "title": info.get("title") or url,
+            "duration": duration,
+            "size": size
+        }
+
+    async def _run(
+        self,
+        args: list[str],
+        timeout: float,
+        on_line: Optional[Callable[[str], None]] = None
+    ) -> tuple[int, str, str]:
+        """Run yt-dlp, handing every output line to on_line as it arrives"""
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.binary, "--no-warnings", "--ignore-config", *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            logger.error("%s not found", self.binary)
+            raise IngestError("❌ Загрузка по ссылкам недоступна на сервере")
+
+        async def read(stream: asyncio.StreamReader) -> str:
+            lines = []
+            async for raw in stream:
+                line = raw.decode("utf-8", errors="replace").rstrip()
+                lines.append(line)
+                if on_line is not None:
+                    on_line(line)
+            return "\n".join(lines)
+
+        try:
+            # Progress may go to either stream depending on the yt-dlp version
+            stdout, stderr = await asyncio.wait_for(
+                asyncio.gather(read(process.stdout), read(process.stderr)), timeout
+            )
+            await process.wait()
+        except asyncio.TimeoutError:
+            raise IngestError("❌ Превышено время ожидания при загрузке видео по ссылке")
+        finally:
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+        return process.returncode, stdout, stderr
+
+
+# Shared ingestor of the process
+url_ingestor = UrlIngestor()
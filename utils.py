@@ -1,23 +1,27 @@
 """
 Utility functions for the bot
 """
+import hashlib
 import logging
-import sys
+import os
 import httpx
 from pathlib import Path
-from config import LOG_LEVEL, BOT_TOKEN
+from typing import Callable, Optional
+import logs
+from config import (
+    LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SPAN_SAMPLE_RATE, TELEGRAM_MESSAGE_LIMIT,
+    BOT_TOKEN, OPENAI_API_KEY, WEBHOOK_SECRET_TOKEN
+)
+from download_manager import download_manager, DownloadError
 
 logger = logging.getLogger(__name__)
 
 
 def setup_logging():
-    """Setup logging configuration"""
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=getattr(logging, LOG_LEVEL),
-        handlers=[
-            logging.StreamHandler(sys.stdout)
-        ]
+    """Setup logging configuration (writes to stdout from a background thread)"""
+    logs.setup(
+        LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SPAN_SAMPLE_RATE,
+        secrets=(BOT_TOKEN, OPENAI_API_KEY, WEBHOOK_SECRET_TOKEN)
     )
 
 
@@ -38,6 +42,54 @@ def format_file_size(size_bytes: int) -> str:
     return f"{size_bytes:.1f} TB"
 
 
+def format_duration(seconds: float) -> str:
+    """
+    Format an estimated duration in human-readable Russian
+
+    Args:
+        seconds: Duration in seconds
+
+    Returns:
+        str: Rounded duration (e.g., "~3 мин")
+    """
+    if seconds < 60:
+        return f"~{max(int(seconds), 1)} сек"
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"~{minutes} мин"
+    return f"~{minutes // 60} ч {minutes % 60} мин"
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """
+    Split a text into messages Telegram accepts, preferably between paragraphs
+
+    Args:
+        text: Text to send
+        limit: Maximum characters per message
+
+    Returns:
+        list: Message texts in order
+    """
+    messages = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if len(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            messages.append(current)
+        # A paragraph longer than a message is cut at the limit
+        while len(paragraph) > limit:
+            messages.append(paragraph[:limit])
+            paragraph = paragraph[limit:]
+        current = paragraph
+    if current or not messages:
+        messages.append(current)
+    return messages
+
+
 def validate_video_file(file_path: str, max_size_mb: int = 50) -> tuple[bool, str]:
     """
     Validate video file
@@ -62,15 +114,45 @@ def validate_video_file(file_path: str, max_size_mb: int = 50) -> tuple[bool, st
     return True, ""
 
 
-async def download_large_file(file_id: str, file_size: int, output_path: str) -> tuple[bool, str]:
+def compute_content_hash(file_path: str, sample_size: int = 1024 * 1024) -> str:
+    """
+    Compute a content fingerprint of a video file.
+    Only the file size and the first and last `sample_size` bytes are hashed,
+    so fingerprinting a 2 GB file costs two small reads.
+    
+    Args:
+        file_path: Path to the file
+        sample_size: Bytes read from the start and the end of the file
+        
+    Returns:
+        str: Hex digest
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(file_path, "rb") as f:
+        digest.update(f.read(sample_size))
+        if size > sample_size:
+            f.seek(max(size - sample_size, sample_size))
+            digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+
+async def download_large_file(
+    file_id: str,
+    file_size: int,
+    output_path: str,
+    on_progress: Optional[Callable[[int], None]] = None
+) -> tuple[bool, str]:
     """
     Download large files from Telegram using direct file_path URL.
     This bypasses the 20 MB limit of bot.get_file()
+    Uses the shared connection-pooled download manager.
     
     Args:
         file_id: Telegram file ID
         file_size: File size in bytes
         output_path: Path where to save the downloaded file
+        on_progress: Optional callback receiving the bytes downloaded so far
         
     Returns:
         tuple: (success: bool, error_message: str)
@@ -82,44 +164,14 @@ async def download_large_file(file_id: str, file_size: int, output_path: str) ->
             size_gb = file_size / (1024 * 1024 * 1024)
             return False, f"❌ Файл слишком большой ({size_gb:.2f} ГБ). Максимальный размер: 2 ГБ"
         
-        # First, try to get file info from Telegram API
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # Get file path from Telegram
-            get_file_url = f"https://api.telegram.org/bot{BOT_TOKEN}/getFile"
-            response = await client.get(get_file_url, params={"file_id": file_id})
-            
-            if response.status_code != 200:
-                logger.error(f"Failed to get file info: {response.text}")
-                return False, "❌ Не удалось получить информацию о файле"
-            
-            result = response.json()
-            if not result.get("ok"):
-                logger.error(f"Telegram API error: {result}")
-                return False, "❌ Ошибка при получении файла от Telegram"
-            
-            file_path = result["result"]["file_path"]
-            
-            # Download the file using direct URL
-            download_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_path}"
-            logger.info(f"Downloading file from: {download_url}")
-            
-            # Download with streaming to handle large files
-            async with client.stream("GET", download_url) as stream_response:
-                if stream_response.status_code != 200:
-                    logger.error(f"Failed to download file: {stream_response.status_code}")
-                    return False, "❌ Не удалось скачать файл"
-                
-                # Write file in chunks
-                with open(output_path, "wb") as f:
-                    async for chunk in stream_response.aiter_bytes(chunk_size=8192):
-                        f.write(chunk)
-            
-            logger.info(f"File downloaded successfully to: {output_path}")
-            return True, ""
-            
+        await download_manager.download(file_id, file_size, output_path, on_progress)
+        return True, ""
+        
+    except DownloadError as e:
+        return False, str(e)
     except httpx.TimeoutException:
         logger.error("Timeout while downloading file")
         return False, "❌ Превышено время ожидания при загрузке файла"
     except Exception as e:
-        logger.error(f"Error downloading file: {e}")
+        logger.error("Error downloading file: %s", e)
         return False, f"❌ Ошибка при загрузке файла: {str(e)}"
@@ -1,136 +1,374 @@
 """
 Video processor module for video manipulation and analysis
 """
+import asyncio
+import importlib
 import logging
+import os
 import subprocess
+import tempfile
 import json
+from collections import OrderedDict
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+from config import (
+    FFPROBE_TIMEOUT, FFMPEG_TIMEOUT, FRAME_BUDGET, FRAME_CANDIDATES, FRAME_THUMB_WIDTH, FRAME_HASH_DISTANCE
+)
+from media_executor import MediaExecutor, QueuePositionCallback, media_executor
+from media_info import MediaInfo, UNKNOWN_METADATA, build_keyframe_probe_command, build_probe_command
+from metrics import STAGE_ERRORS, track_stage
+from transcoder import Transcoder, TranscodeError, DEFAULT_PROFILE
+
+if TYPE_CHECKING:
+    # Only frame sampling needs numpy; it's imported on first use or by warm_up()
+    import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Hue ranges (upper bound in degrees) used to name the dominant color of a frame
+HUE_NAMES = (
+    (15, "red"), (45, "orange"), (70, "yellow"), (160, "green"),
+    (200, "cyan"), (260, "blue"), (320, "purple"), (360, "red")
+)
+
+# Probe results kept per VideoProcessor, keyed by path, size and modification time
+PROBE_CACHE_SIZE = 64
+
+
+def perceptual_hash(gray: "np.ndarray") -> "np.ndarray":
+    """
+    Difference hash of a grayscale image: 64 bits telling whether each cell
+    of a 8x9 grid is brighter than its right neighbour. Near-duplicate frames
+    differ in only a few bits.
+
+    Args:
+        gray: 2D array of luma values
+
+    Returns:
+        np.ndarray: 64 booleans
+    """
+    import numpy as np
+
+    height, width = gray.shape
+    rows = np.linspace(0, height, 9).astype(int)[:-1]
+    cols = np.linspace(0, width, 10).astype(int)[:-1]
+    # Mean of each grid cell (reduceat sums the slices between the edges)
+    sums = np.add.reduceat(np.add.reduceat(gray, rows, axis=0), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, height)), np.diff(np.append(cols, width)))
+    cells = sums / counts
+    return (cells[:, 1:] > cells[:, :-1]).ravel()
+
+
+def summarize_frame(image: "np.ndarray", time: float) -> dict:
+    """
+    Describe an RGB thumbnail with a few numbers a text model can reason about
+
+    Args:
+        image: Array of shape (height, width, 3), uint8
+        time: Position of the frame in seconds
+
+    Returns:
+        dict: Time, brightness, contrast, saturation (0..1) and dominant color
+    """
+    import numpy as np
+
+    rgb = image.astype(np.float32) / 255
+    luma = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    high, low = rgb.max(axis=2), rgb.min(axis=2)
+    chroma = high - low
+    saturation = np.where(high > 0, chroma / np.maximum(high, 1e-6), 0)
+
+    color = "gray"
+    colorful = chroma > 0.15
+    if colorful.mean() > 0.1:
+        r, g, b = (rgb[..., i][colorful] for i in range(3))
+        c, h = chroma[colorful], high[colorful]
+        hue = np.where(
+            h == r, ((g - b) / c) % 6, np.where(h == g, (b - r) / c + 2, (r - g) / c + 4)
+        ) * 60
+        dominant = float(np.median(hue))
+        color = next(name for bound, name in HUE_NAMES if dominant <= bound)
+
+    return {
+        "t": round(time, 1),
+        "brightness": round(float(luma.mean()), 2),
+        "contrast": round(float(luma.std()), 2),
+        "saturation": round(float(saturation.mean()), 2),
+        "color": color
+    }
+
 
 class VideoProcessor:
-    def __init__(self):
+    def __init__(self, executor: Optional[MediaExecutor] = None):
         """Initialize video processor"""
+        self.executor = executor or media_executor
+        self.transcoder = Transcoder(self.executor)
+        self._probe_cache: OrderedDict[tuple, MediaInfo] = OrderedDict()
         logger.info("Video Processor initialized")
+
+    async def warm_up(self):
+        """Import numpy, used by frame sampling, ahead of the first video"""
+        await asyncio.to_thread(importlib.import_module, "numpy")
     
-    async def process_video(self, video_path: str) -> dict:
+    async def process_video(
+        self,
+        video_path: str,
+        on_queue_position: Optional[QueuePositionCallback] = None
+    ) -> dict:
         """
         Process video and extract metadata
         
         Args:
             video_path: Path to the video file
+            on_queue_position: Optional callback receiving the position in the
+                media queue while the job waits for a free worker
             
         Returns:
             dict: Video metadata including duration, resolution, fps
         """
         try:
-            # Get video metadata using ffprobe
-            metadata = self.get_video_metadata(video_path)
+            async with self.executor.slot(on_queue_position):
+                # Get video metadata using ffprobe
+                metadata = await self.get_video_metadata(video_path)
             
             return metadata
             
         except Exception as e:
-            logger.error(f"Error processing video: {e}")
-            return {
-                "duration": "Unknown",
-                "resolution": "Unknown",
-                "fps": "Unknown"
-            }
+            logger.error("Error processing video: %s", e)
+            return dict(UNKNOWN_METADATA)
     
-    def get_video_metadata(self, video_path: str) -> dict:
+    async def process_videos(
+        self,
+        video_paths: list[str],
+        on_queue_position: Optional[QueuePositionCallback] = None
+    ) -> list[dict]:
         """
-        Extract video metadata using ffprobe
+        Extract metadata of several videos under a single media slot
+
+        ffprobe runs are short and I/O bound, so the videos of an album are
+        probed concurrently instead of queueing once per video.
+
+        Args:
+            video_paths: Paths to the video files
+            on_queue_position: Optional callback receiving the position in the
+                media queue while the batch waits for a free worker
+
+        Returns:
+            list: Metadata of each video, in the order of video_paths
+        """
+        if not video_paths:
+            return []
+        async with self.executor.slot(on_queue_position):
+            return list(await asyncio.gather(
+                *(self.get_video_metadata(path) for path in video_paths)
+            ))
+
+    async def probe_partial(
+        self,
+        video_path: str,
+        on_queue_position: Optional[QueuePositionCallback] = None
+    ) -> Optional[dict]:
+        """
+        Try to extract metadata from a partially downloaded video
         
         Args:
-            video_path: Path to the video file
+            video_path: Path to the (sparse) video file
+            on_queue_position: Optional queue position callback
             
         Returns:
-            dict: Video metadata
+            dict: Video metadata, or None if the available bytes aren't enough
+        """
+        async with self.executor.slot(on_queue_position):
+            metadata = await self.get_video_metadata(video_path)
+        
+        if metadata["duration"] in ("Unknown", "0.0") or metadata["resolution"] == "0x0":
+            return None
+        return metadata
+    
+    async def sample_frames(self, video_path: str, metadata: dict, budget: int = FRAME_BUDGET) -> list[dict]:
+        """
+        Pick a few representative frames of a video
+
+        One ffmpeg run seeks to FRAME_CANDIDATES evenly spaced points and
+        decodes only the keyframe at each of them, scaled down to a thumbnail,
+        so the cost doesn't grow with the video length. Near-duplicates are
+        dropped by perceptual hash and at most `budget` frames are kept.
+
+        Args:
+            video_path: Path to the fully downloaded video
+            metadata: Metadata from get_video_metadata
+            budget: Maximum number of frames returned
+
+        Returns:
+            list[dict]: Frames in time order with "time", "image" (RGB
+                thumbnail array) and "hash"; empty if sampling failed
         """
         try:
-            # Use ffprobe to get video information
-            cmd = [
-                "ffprobe",
-                "-v", "quiet",
-                "-print_format", "json",
-                "-show_format",
-                "-show_streams",
-                video_path
-            ]
-            
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            
-            if result.returncode == 0:
+            width, height = metadata.get("width") or 0, metadata.get("height") or 0
+            duration = float(metadata.get("duration", 0))
+        except ValueError:
+            return []
+        if not width or not height or duration <= 0:
+            return []
+
+        thumb_width = min(FRAME_THUMB_WIDTH, width) // 2 * 2
+        # The hash grid needs at least 9 rows and 10 columns of pixels
+        thumb_width = max(16, thumb_width)
+        thumb_height = max(16, round(thumb_width * height / width / 2) * 2)
+        # Sampling points closer than a second apart would land on the same keyframe
+        count = max(1, min(FRAME_CANDIDATES, int(duration)))
+        times = [duration * (i + 0.5) / count for i in range(count)]
+
+        frame_size = thumb_width * thumb_height * 3
+        with tempfile.TemporaryDirectory(prefix="frames_", dir=os.path.dirname(video_path) or None) as work_dir:
+            cmd = ["ffmpeg", "-v", "error", "-nostdin"]
+            for t in times:
+                # Input seeking jumps to the keyframe before t; other frames aren't decoded
+                cmd += ["-skip_frame", "nokey", "-ss", f"{t:.3f}", "-noaccurate_seek", "-i", video_path]
+            cmd += ["-filter_complex", ";".join(
+                f"[{i}:v:0]trim=end_frame=1,scale={thumb_width}:{thumb_height},setsar=1,format=rgb24[f{i}]"
+                for i in range(count)
+            )]
+            # One output per sampling point: a point without a frame leaves its file
+            # empty instead of shifting the times of the frames after it
+            outputs = [os.path.join(work_dir, f"{i:03d}.rgb") for i in range(count)]
+            for i, output in enumerate(outputs):
+                cmd += ["-map", f"[f{i}]", "-frames:v", "1", "-f", "rawvideo", "-pix_fmt", "rgb24", output]
+
+            try:
+                with track_stage("frames"):
+                    result = await self.executor.run(cmd, timeout=FFMPEG_TIMEOUT, text=False)
+            except subprocess.TimeoutExpired:
+                logger.warning("Frame sampling of %s timed out", video_path)
+                return []
+
+            def read_frames() -> list[tuple[float, bytes]]:
+                sampled = []
+                for t, output in zip(times, outputs):
+                    if os.path.exists(output) and os.path.getsize(output) >= frame_size:
+                        with open(output, "rb") as f:
+                            sampled.append((t, f.read(frame_size)))
+                return sampled
+
+            sampled = await asyncio.to_thread(read_frames) if result.returncode == 0 else []
+
+        if not sampled:
+            STAGE_ERRORS.inc(stage="frames")
+            logger.warning("Frame sampling failed: %s", result.stderr[-500:].decode('utf-8', errors='replace'))
+            return []
+
+        import numpy as np
+
+        images = np.frombuffer(b"".join(data for _, data in sampled), dtype=np.uint8)
+        images = images.reshape(len(sampled), thumb_height, thumb_width, 3)
+        luma = images @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+        frames = []
+        for (t, _), image, gray in zip(sampled, images, luma):
+            frame_hash = perceptual_hash(gray)
+            if all(np.count_nonzero(frame_hash != kept["hash"]) > FRAME_HASH_DISTANCE for kept in frames):
+                frames.append({"time": t, "image": image, "hash": frame_hash})
+
+        if len(frames) > budget:
+            # Keep frames spread over the whole video
+            frames = [frames[i] for i in np.linspace(0, len(frames) - 1, budget).round().astype(int)]
+        logger.info("Sampled %s of %s frames from %s", len(frames), len(sampled), video_path)
+        return frames
+
+    @staticmethod
+    def summarize_frames(frames: list[dict]) -> list[dict]:
+        """Compact per-frame summaries for the AI prompt"""
+        return [summarize_frame(frame["image"], frame["time"]) for frame in frames]
+
+    async def probe(self, video_path: str) -> Optional[MediaInfo]:
+        """
+        Probe a media file, reusing the result for an unchanged file
+
+        Args:
+            video_path: Path to the media file
+
+        Returns:
+            MediaInfo: Parsed metadata, or None if ffprobe failed
+        """
+        try:
+            stat = os.stat(video_path)
+        except OSError as e:
+            logger.error("Error extracting metadata: %s", e)
+            return None
+        # A partial download that grew since the last probe is probed again
+        key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+        info = self._probe_cache.get(key)
+        if info is not None:
+            self._probe_cache.move_to_end(key)
+            return info
+
+        try:
+            with track_stage("probe"):
+                result = await self.executor.run(build_probe_command(video_path), timeout=FFPROBE_TIMEOUT)
+                if result.returncode != 0:
+                    STAGE_ERRORS.inc(stage="probe")
+                    logger.warning("ffprobe failed for %s", video_path)
+                    return None
                 data = json.loads(result.stdout)
-                
-                # Extract video stream info
-                video_stream = next(
-                    (s for s in data.get("streams", []) if s.get("codec_type") == "video"),
-                    {}
-                )
-                
-                duration = float(data.get("format", {}).get("duration", 0))
-                width = video_stream.get("width", 0)
-                height = video_stream.get("height", 0)
-                fps = eval(video_stream.get("r_frame_rate", "0/1"))
-                
-                return {
-                    "duration": f"{duration:.1f}",
-                    "resolution": f"{width}x{height}",
-                    "fps": f"{fps:.1f}"
-                }
-            else:
-                logger.warning("ffprobe failed, returning default values")
-                return {
-                    "duration": "Unknown",
-                    "resolution": "Unknown",
-                    "fps": "Unknown"
-                }
-                
+                if any(stream.get("codec_type") == "video" for stream in data.get("streams") or ()):
+                    packets = await self.executor.run(
+                        build_keyframe_probe_command(video_path), timeout=FFPROBE_TIMEOUT
+                    )
+                    # Without the packets only the keyframe interval is unknown
+                    if packets.returncode == 0:
+                        data["packets"] = json.loads(packets.stdout).get("packets")
+            info = MediaInfo(data)
         except Exception as e:
-            logger.error(f"Error extracting metadata: {e}")
-            return {
-                "duration": "Unknown",
-                "resolution": "Unknown",
-                "fps": "Unknown"
-            }
+            logger.error("Error extracting metadata: %s", e)
+            return None
+
+        self._probe_cache[key] = info
+        if len(self._probe_cache) > PROBE_CACHE_SIZE:
+            self._probe_cache.popitem(last=False)
+        return info
+
+    async def get_video_metadata(self, video_path: str) -> dict:
+        """
+        Extract video metadata using ffprobe
+        
+        Args:
+            video_path: Path to the video file
+            
+        Returns:
+            dict: Video metadata (see MediaInfo.to_dict), or placeholders if
+                the file can't be probed
+        """
+        info = await self.probe(video_path)
+        if info is None:
+            return dict(UNKNOWN_METADATA)
+        return info.to_dict()
     
-    async def compress_video(self, input_path: str, output_path: str) -> bool:
+    async def compress_video(
+        self,
+        input_path: str,
+        output_path: str,
+        profile: str = DEFAULT_PROFILE,
+        target_size: Optional[int] = None
+    ) -> bool:
         """
         Compress video file
         
         Args:
             input_path: Path to input video
             output_path: Path to output video
+            profile: Transcoding profile name (see transcoder.PROFILES)
+            target_size: Optional maximum output size in bytes
             
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            cmd = [
-                "ffmpeg",
-                "-i", input_path,
-                "-c:v", "libx264",
-                "-crf", "28",
-                "-c:a", "aac",
-                "-b:a", "128k",
-                output_path
-            ]
-            
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                timeout=300
-            )
-            
-            return result.returncode == 0
-            
+            metadata = await self.get_video_metadata(input_path)
+            await self.transcoder.transcode(input_path, output_path, metadata, profile, target_size)
+            return True
+        except TranscodeError as e:
+            logger.error("Error compressing video: %s", e)
+            return False
         except Exception as e:
-            logger.error(f"Error compressing video: {e}")
+            logger.error("Error compressing video: %s", e)
             return False
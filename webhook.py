@@ -0,0 +1,192 @@
+"""
+Webhook receiver: an aiohttp server feeding Telegram updates to the application
+"""
+import asyncio
+import hmac
+import logging
+import signal
+import sqlite3
+import time
+from typing import Optional
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+from config import DATABASE_URL, WEBHOOK_MAX_CONNECTIONS
+from database import ThreadLocalConnection
+from health import HealthMonitor, add_health_routes
+from startup import startup_profile
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Seconds an update ID is remembered; Telegram gives up redelivering long before
+DEDUP_TTL = 24 * 3600
+
+
+class UpdateDeduplicator:
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Remember received update IDs in the bot's SQLite database, so an update
+        Telegram redelivers (after a timeout or a 5xx) isn't handled twice
+
+        The IDs are only shared by processes using the same database file, i.e.
+        replicas on one host or volume. Replicas with their own file each drop
+        only the redeliveries they received themselves. Call init_db (off the
+        event loop) before the first update.
+        """
+        self.db_path = db_path or DATABASE_URL.replace("sqlite:///", "")
+        self._connections = ThreadLocalConnection(self.db_path)
+        self._inserts = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def init_db(self):
+        """Create the update IDs table if it doesn't exist"""
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_updates (
+                    update_id INTEGER PRIMARY KEY,
+                    received_at REAL NOT NULL
+                )
+            """)
+            conn.commit()
+
+    def first_seen(self, update_id: int) -> bool:
+        """Record an update ID; False if it was already received through this database"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO webhook_updates (update_id, received_at) VALUES (?, ?)",
+                (update_id, now)
+            )
+            self._inserts += 1
+            if self._inserts % 1000 == 0:
+                conn.execute("DELETE FROM webhook_updates WHERE received_at < ?", (now - DEDUP_TTL,))
+            conn.commit()
+            return cursor.rowcount == 1
+
+
+def create_webhook_app(
+    application: Application,
+    path: str,
+    secret_token: str,
+    deduplicator: Optional[UpdateDeduplicator] = None,
+    health: Optional[HealthMonitor] = None
+) -> web.Application:
+    """
+    Create the HTTP application receiving updates
+
+    Args:
+        application: Initialized bot application; updates go to its update_queue
+        path: URL path Telegram posts to
+        secret_token: Expected value of the secret token header
+        deduplicator: Optional filter for redelivered updates
+        health: Optional readiness state served on /healthz and /readyz
+
+    Returns:
+        web.Application: Application answering POST requests on `path`
+    """
+    async def handle_update(request: web.Request) -> web.Response:
+        # Constant-time comparison, the token is the only authentication
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            logger.warning("Webhook request with a wrong secret token from %s", request.remote)
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            if not isinstance(data, dict):
+                return web.Response(status=400)
+            update = Update.de_json(data, application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logger.warning("Malformed webhook update from %s: %s", request.remote, e)
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+
+        if deduplicator is not None:
+            try:
+                if not await asyncio.to_thread(deduplicator.first_seen, update.update_id):
+                    logger.info("Skipping redelivered update %s", update.update_id)
+                    return web.Response()
+            except sqlite3.Error as e:
+                logger.warning("Update deduplication failed: %s", e)
+
+        # Handlers run in the application's own loop; Telegram gets its answer right away
+        await application.update_queue.put(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    if health is not None:
+        add_health_routes(app, health)
+    return app
+
+
+async def serve_webhook(
+    application: Application,
+    url: str,
+    path: str,
+    host: str,
+    port: int,
+    secret_token: str,
+    allowed_updates: list[str],
+    set_webhook: bool = True,
+    health: Optional[HealthMonitor] = None
+):
+    """
+    Run the application behind a webhook until SIGINT/SIGTERM, with the same
+    lifecycle hooks as Application.run_polling
+
+    The webhook isn't deleted on exit: with several replicas behind a load
+    balancer the others keep serving it.
+
+    Args:
+        application: Bot application with handlers registered
+        url: Public base URL of the receiver, e.g. https://bot.example.com
+        path: URL path of the receiver
+        host: Interface to bind
+        port: TCP port
+        secret_token: Token Telegram sends with every update
+        allowed_updates: Update types to subscribe to
+        set_webhook: Register the webhook with Telegram on start
+        health: Also serve /healthz and /readyz on the receiver's port
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    deduplicator = UpdateDeduplicator()
+    await asyncio.to_thread(deduplicator.init_db)
+    runner = web.AppRunner(
+        create_webhook_app(application, path, secret_token, deduplicator, health), access_log=None
+    )
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        startup_profile.mark("webhook listening")
+        await application.start()
+        if set_webhook:
+            # Idempotent, so every replica may do it on start
+            await application.bot.set_webhook(
+                url=url.rstrip("/") + path,
+                secret_token=secret_token,
+                allowed_updates=allowed_updates,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+        logger.info("Webhook receiver listening on %s:%s%s for %s", host, port, path, ', '.join(allowed_updates))
+        await stop.wait()
+    finally:
+        # Stop accepting updates before the handlers are torn down
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -0,0 +1,265 @@
+"""
+Queue worker entry point: claims video jobs from the database and processes them
+
+Usage:
+    python worker.py [--processes N] [--concurrency M]
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Optional
+from telegram import Bot
+from config import (
+    BOT_TOKEN, JOB_LEASE_SECONDS, JOB_POLL_INTERVAL, WORKER_CONCURRENCY, WORKER_PROCESSES,
+    METRICS_HOST, WORKER_METRICS_PORT, SCRATCH_RETRY_DELAY
+)
+from database import Database
+from ai_processor import AIProcessor
+from video_processor import VideoProcessor
+from job_queue import JOB_FAILED, JobQueue, PermanentJobError
+from pipeline import VideoPipeline
+from download_manager import download_manager
+from metrics import JOBS_IN_FLIGHT, JOB_QUEUE_DEPTH, start_metrics_server
+from result_cache import ResultCache
+from media_registry import MediaRegistry
+from scratch import ScratchSpaceError, scratch_space
+from health import HealthMonitor, binary_check, queue_check, sqlite_check
+from logs import job_trace
+from utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+ERROR_TEXT = (
+    "❌ Произошла ошибка при обработке видео.\n"
+    "Пожалуйста, попробуйте ещё раз позже."
+)
+
+
+async def process_job(queue: JobQueue, pipeline: VideoPipeline, bot: Bot, job: dict, worker_id: str):
+    """
+    Run one job while keeping its lease alive
+
+    Args:
+        queue: Job queue the job was claimed from
+        pipeline: Pipeline executing the job
+        bot: Bot used to report results
+        job: Claimed job
+        worker_id: ID of this worker
+    """
+    # Everything logged for the job, in this and in spawned tasks, carries its trace ID
+    with job_trace(job["id"], job["payload"].get("trace_id")):
+        await _run_job(queue, pipeline, bot, job, worker_id)
+
+
+async def _run_job(queue: JobQueue, pipeline: VideoPipeline, bot: Bot, job: dict, worker_id: str):
+    job_id = job["id"]
+    if job["status"] == JOB_FAILED:
+        # Its worker died on the last attempt; only the user's status message is left to update
+        logger.warning("Job %s (%s) failed: lease expired on the last attempt", job_id, job["operation"])
+        try:
+            await pipeline.edit_status(bot, job, ERROR_TEXT)
+        except Exception:
+            pass
+        return
+
+    started = time.monotonic()
+    progress = {"stage": "claimed"}
+
+    async def on_progress(stage: str):
+        progress["stage"] = stage
+        await asyncio.to_thread(queue.heartbeat, job_id, worker_id, stage)
+
+    task = asyncio.create_task(pipeline.run(job, bot, on_progress))
+
+    # Renew the lease until the job finishes; stop if another worker took it over
+    while True:
+        try:
+            done, _ = await asyncio.wait({task}, timeout=JOB_LEASE_SECONDS / 3)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if done:
+            break
+        owned = await asyncio.to_thread(queue.heartbeat, job_id, worker_id, progress["stage"])
+        if not owned:
+            logger.warning("Lost lease on job %s, cancelling", job_id)
+            task.cancel()
+            # Let its cleanup (scratch release, temp files) finish before the next claim
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await task
+            return
+
+    try:
+        task.result()
+        await asyncio.to_thread(queue.complete, job_id, worker_id)
+        logger.info("Job %s (%s) completed in %.1fs", job_id, job["operation"], time.monotonic() - started)
+    except ScratchSpaceError as e:
+        # Other jobs took the space since the claim; wait for them without using up an attempt
+        logger.info("Job %s postponed: %s", job_id, e)
+        await asyncio.to_thread(queue.release, job_id, worker_id, SCRATCH_RETRY_DELAY)
+        try:
+            await pipeline.edit_status(bot, job, "⏳ Ожидает освобождения места на сервере...")
+        except Exception:
+            pass
+    except PermanentJobError as e:
+        logger.info("Job %s (%s) failed permanently: %s", job_id, job["operation"], e)
+        await asyncio.to_thread(queue.fail, job_id, worker_id, str(e), False)
+        await pipeline.edit_status(bot, job, str(e) or ERROR_TEXT)
+    except Exception as e:
+        logger.error("Job %s failed at stage %s: %s", job_id, progress['stage'], e, exc_info=True)
+        retried = await asyncio.to_thread(queue.fail, job_id, worker_id, str(e))
+        if not retried:
+            try:
+                await pipeline.edit_status(bot, job, ERROR_TEXT)
+            except Exception:
+                pass
+
+
+async def worker_loop(queue: JobQueue, pipeline: VideoPipeline, bot: Bot, worker_id: str):
+    """Claim and process jobs until cancelled"""
+    logger.info("Worker %s started", worker_id)
+    while True:
+        try:
+            # Jobs that don't fit the free disk space wait for running ones to finish
+            job = await asyncio.to_thread(
+                lambda: queue.claim(
+                    worker_id,
+                    free_disk=scratch_space.available(),
+                    max_job_size=scratch_space.max_job_size()
+                )
+            )
+        except Exception as e:
+            logger.error("Worker %s failed to claim a job: %s", worker_id, e)
+            job = None
+
+        if job is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+
+        JOBS_IN_FLIGHT.inc()
+        try:
+            await process_job(queue, pipeline, bot, job, worker_id)
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back so another worker picks it up
+            await asyncio.to_thread(queue.release, job["id"], worker_id)
+            raise
+        finally:
+            JOBS_IN_FLIGHT.dec()
+
+
+def start_workers(
+    bot: Bot,
+    pipeline: VideoPipeline,
+    queue: Optional[JobQueue] = None,
+    concurrency: int = WORKER_CONCURRENCY
+) -> list[asyncio.Task]:
+    """
+    Start worker loops in the running event loop
+
+    Args:
+        bot: Initialized bot instance
+        pipeline: Pipeline executing the jobs
+        queue: Job queue, a new one is created if omitted
+        concurrency: Number of jobs processed at the same time
+
+    Returns:
+        list: Worker tasks, cancel them to stop the workers
+    """
+    queue = queue or JobQueue()
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    return [
+        asyncio.create_task(worker_loop(queue, pipeline, bot, f"{prefix}:{i}"))
+        for i in range(concurrency)
+    ]
+
+
+async def run_worker(concurrency: int, metrics_port: int = 0):
+    """Run worker loops until SIGINT/SIGTERM"""
+    # Files of jobs this host was running when a process died
+    await asyncio.to_thread(scratch_space.sweep)
+    db = Database()
+    queue = JobQueue()
+    ai_processor = AIProcessor()
+    pipeline = VideoPipeline(db, ai_processor, VideoProcessor(), ResultCache(), MediaRegistry())
+
+    metrics_server = None
+    if metrics_port:
+        JOB_QUEUE_DEPTH.set_function(lambda: {(k,): v for k, v in queue.depth().items()})
+        health = HealthMonitor()
+        health.add_check("ffmpeg", binary_check(("ffmpeg", "ffprobe")))
+        health.add_check("database", sqlite_check(queue.db_path))
+        health.add_check("queue", queue_check(queue.depth))
+        health.set_warm()
+        metrics_server = await start_metrics_server(METRICS_HOST, metrics_port, health)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with Bot(BOT_TOKEN) as bot:
+        tasks = start_workers(bot, pipeline, queue, concurrency)
+        await stop.wait()
+        logger.info("Stopping worker...")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    await download_manager.close()
+    await ai_processor.close()
+    await db.close()
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+
+
+def worker_process(concurrency: int, metrics_port: int = 0):
+    """Entry point of a single worker process"""
+    setup_logging()
+    asyncio.run(run_worker(concurrency, metrics_port))
+
+
+def main():
+    """Start worker processes"""
+    parser = argparse.ArgumentParser(description="Video processing worker")
+    parser.add_argument("--processes", type=int, default=WORKER_PROCESSES,
+                        help="number of worker processes")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY,
+                        help="jobs processed concurrently by each process")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        worker_process(args.concurrency, WORKER_METRICS_PORT)
+        return
+
+    setup_logging()
+    logger.info("Starting %s worker processes", args.processes)
+    processes = [
+        multiprocessing.Process(
+            target=worker_process,
+            args=(args.concurrency, WORKER_METRICS_PORT + i if WORKER_METRICS_PORT else 0),
+            daemon=False
+        )
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    # Forward termination to the children and wait for them to shut down
+    def terminate(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()